@@ -0,0 +1,193 @@
+import os
+import hashlib
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import folium
+    from folium.plugins import MarkerCluster, HeatMap
+    FOLIUM_AVAILABLE = True
+except ImportError:
+    FOLIUM_AVAILABLE = False
+
+from map_render import cached_map, route_hash, MAP_WIDTH, MAP_HEIGHT, GEOJSON_PRECISION
+from simplify import simplify_for_zoom, fit_zoom
+
+# Above this many activities the map shows a heatmap instead of individual routes
+HEATMAP_THRESHOLD = int(os.environ.get("ROUTE_MAP_HEATMAP_THRESHOLD", "200"))
+
+# Most route points drawn as lines; geometry is simplified further until it fits
+MAP_POINT_BUDGET = 20000
+
+# Most points fed to the heatmap
+HEATMAP_POINT_BUDGET = 50000
+
+# Colors cycled through for individual routes
+ACTIVITY_COLORS = ['blue', 'red', 'green', 'purple', 'orange', 'darkred', 'darkblue', 'darkgreen']
+
+
+def activity_tracks(activities):
+    """
+    Get the activities that have route coordinates
+
+    Args:
+        activities (list): Activity dicts from the API
+
+    Returns:
+        list: (index, activity, coords) tuples, coords as an (n, 2) array of (lat, lon)
+    """
+    tracks = []
+    for i, activity in enumerate(activities):
+        coords = activity.get('routeData', {}).get('coordinates')
+        if coords:
+            tracks.append((i, activity, np.asarray(coords, dtype=np.float64).reshape(-1, 2)))
+    return tracks
+
+
+def activities_key(activities):
+    """Key identifying a list of activities for the map cache"""
+    parts = []
+    for activity in activities:
+        if activity.get('_id'):
+            parts.append(f"{activity['_id']}:{activity.get('updatedAt', '')}")
+        else:
+            parts.append(route_hash(activity.get('routeData', {}).get('coordinates', [])))
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def tracks_bounds(tracks):
+    """Get (min_lat, min_lon, max_lat, max_lon) over all tracks"""
+    mins = np.min([coords.min(axis=0) for _, _, coords in tracks], axis=0)
+    maxs = np.max([coords.max(axis=0) for _, _, coords in tracks], axis=0)
+    return (mins[0], mins[1], maxs[0], maxs[1])
+
+
+def simplify_tracks(tracks, zoom, point_budget=MAP_POINT_BUDGET):
+    """
+    Simplify all tracks for a zoom level, coarsening until they fit a point budget
+
+    Args:
+        tracks (list): Tuples from activity_tracks
+        zoom (int): Zoom level the map opens at
+        point_budget (int): Most points kept over all tracks
+
+    Returns:
+        list: Simplified (lat, lon) arrays, one per track
+    """
+    while True:
+        simplified = [simplify_for_zoom(coords, zoom) for _, _, coords in tracks]
+        if zoom <= 0 or sum(len(coords) for coords in simplified) <= point_budget:
+            return simplified
+        zoom -= 1
+
+
+def activities_feature_collection(tracks, zoom, point_budget=MAP_POINT_BUDGET):
+    """
+    Merge all activity routes into one GeoJSON feature collection
+
+    Args:
+        tracks (list): Tuples from activity_tracks
+        zoom (int): Zoom level the geometry is simplified for
+        point_budget (int): Most points kept over all routes
+
+    Returns:
+        dict: GeoJSON FeatureCollection with name and color properties
+    """
+    features = []
+    for (i, activity, _), coords in zip(tracks, simplify_tracks(tracks, zoom, point_budget)):
+        features.append({
+            "type": "Feature",
+            "properties": {
+                "name": activity.get('name', f"Activity {i+1}"),
+                "color": ACTIVITY_COLORS[i % len(ACTIVITY_COLORS)],
+            },
+            "geometry": {
+                "type": "LineString",
+                "coordinates": np.round(coords[:, ::-1], GEOJSON_PRECISION).tolist(),
+            },
+        })
+    return {"type": "FeatureCollection", "features": features}
+
+
+def heatmap_points(tracks, zoom, point_budget=HEATMAP_POINT_BUDGET):
+    """
+    Get evenly thinned route points for a heatmap
+
+    Args:
+        tracks (list): Tuples from activity_tracks
+        zoom (int): Zoom level the points are thinned for
+        point_budget (int): Most points returned
+
+    Returns:
+        np.ndarray: (n, 2) array of (lat, lon)
+    """
+    points = np.concatenate([simplify_for_zoom(coords, zoom) for _, _, coords in tracks])
+    if len(points) > point_budget:
+        points = points[np.linspace(0, len(points) - 1, point_budget).astype(np.int64)]
+    return np.round(points, GEOJSON_PRECISION)
+
+
+def activities_map_html(activities, width=MAP_WIDTH, height=MAP_HEIGHT, heatmap_threshold=None):
+    """
+    Get the HTML of a map showing all activities, rendering it only once
+
+    Routes are merged into a single GeoJSON layer simplified for the zoom
+    the map opens at, and start markers are clustered. Beyond
+    heatmap_threshold activities, a heatmap is drawn instead. Either way
+    the number of points sent to the browser is capped, so the page size
+    does not grow with the history.
+
+    Args:
+        activities (list): Activity dicts from the API
+        width (int): Map width in pixels
+        height (int): Map height in pixels
+        heatmap_threshold (int): Activities above which to draw a heatmap (defaults to HEATMAP_THRESHOLD)
+
+    Returns:
+        str or None: Map HTML, or None when no activity has a route
+
+    Raises:
+        ImportError: If numpy or folium is not installed
+    """
+    if not NUMPY_AVAILABLE or not FOLIUM_AVAILABLE:
+        raise ImportError("numpy and folium packages are required to draw the activities map")
+
+    if heatmap_threshold is None:
+        heatmap_threshold = HEATMAP_THRESHOLD
+    tracks = activity_tracks(activities)
+    if not tracks:
+        return None
+
+    heatmap = len(tracks) > heatmap_threshold
+    key = ("activities", activities_key(activities), heatmap, width, height)
+    return cached_map(key, _render_activities_map, tracks, heatmap, width, height)
+
+
+def _render_activities_map(tracks, heatmap, width, height):
+    bounds = tracks_bounds(tracks)
+    zoom = fit_zoom(bounds, width, height)
+
+    m = folium.Map(location=[(bounds[0] + bounds[2]) / 2, (bounds[1] + bounds[3]) / 2], zoom_start=zoom)
+
+    if heatmap:
+        HeatMap(heatmap_points(tracks, zoom).tolist(), radius=6, blur=8).add_to(m)
+    else:
+        folium.GeoJson(
+            activities_feature_collection(tracks, zoom),
+            style_function=lambda feature: {"color": feature["properties"]["color"], "weight": 3, "opacity": 0.7},
+            tooltip=folium.GeoJsonTooltip(fields=["name"], labels=False),
+        ).add_to(m)
+
+        starts = MarkerCluster().add_to(m)
+        for i, activity, coords in tracks:
+            folium.Marker(
+                coords[0].tolist(),
+                tooltip=f"Start: {activity.get('name', f'Activity {i+1}')}"
+            ).add_to(starts)
+
+    m.fit_bounds([[bounds[0], bounds[1]], [bounds[2], bounds[3]]])
+    return folium.Figure(height=height).add_child(m).render()
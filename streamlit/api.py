@@ -2,6 +2,8 @@ import requests
 import json
 import streamlit as st
 
+from simplify import simplify_coordinates, douglas_peucker_mask, DISPLAY_TOLERANCE_M
+
 # Default API URL, can be overridden in session state
 DEFAULT_API_URL = "http://localhost:3000/api"
 
@@ -113,11 +115,11 @@ def update_profile(user_data):
 
 # Activity APIs
 
-def generate_route(start_location, distance, surface_preference):
-    """Generate a running route via the API"""
+def generate_route(start_location, distance, surface_preference, api_url=None, headers=None):
+    """Generate a running route via the API (pass api_url and headers when calling outside the script thread)"""
     try:
-        url = f"{get_api_url()}/activity/generate"
-        headers = get_headers()
+        url = f"{api_url or get_api_url()}/activity/generate"
+        headers = headers if headers is not None else get_headers()
         payload = {
             "startLocation": start_location,
             "distance": float(distance),
@@ -129,27 +131,64 @@ def generate_route(start_location, distance, surface_preference):
     except Exception as e:
         return False, str(e)
 
+def activity_payload(route_data, name=None):
+    """Build the activity body the API expects for a route"""
+    # Store the route thinned to DISPLAY_TOLERANCE_M; the dropped points are not visible on a map
+    if route_data.get("times") and len(route_data["times"]) == len(route_data.get("coordinates") or []):
+        # Keep the point times of recorded runs aligned with the points kept
+        keep = douglas_peucker_mask(route_data["coordinates"], DISPLAY_TOLERANCE_M)
+        route_data = dict(route_data,
+                          coordinates=[list(point) for point, kept in zip(route_data["coordinates"], keep) if kept],
+                          times=[offset for offset, kept in zip(route_data["times"], keep) if kept])
+    elif route_data.get("coordinates"):
+        route_data = dict(route_data, coordinates=simplify_coordinates(route_data["coordinates"]))
+    
+    return {
+        "name": name or f"Route from {route_data.get('startLocation', 'Unknown')}",
+        "distance": route_data.get("distance", 0),
+        "duration": route_data.get("estimatedTime", 0) * 60,  # Convert to seconds
+        "startLocation": route_data.get("startLocation", ""),
+        "routeData": route_data,
+        "activityType": "running"
+    }
+
 def save_activity(route_data, name=None):
     """Save generated route as an activity"""
     try:
         url = f"{get_api_url()}/activity"
         headers = get_headers()
-        
-        # Prepare activity data
-        payload = {
-            "name": name or f"Route from {route_data.get('startLocation', 'Unknown')}",
-            "distance": route_data.get("distance", 0),
-            "duration": route_data.get("estimatedTime", 0) * 60,  # Convert to seconds
-            "startLocation": route_data.get("startLocation", ""),
-            "routeData": route_data,
-            "activityType": "running"
-        }
+        payload = activity_payload(route_data, name)
         response = requests.post(url, json=payload, headers=headers)
         data = handle_response(response)
         return True, data
     except Exception as e:
         return False, str(e)
 
+def save_activities(payloads, api_url=None, headers=None, session=None):
+    """
+    Save many activity payloads over one keep-alive connection
+    
+    Args:
+        payloads (list): Bodies from activity_payload
+        api_url (str): API base URL (pass it when calling outside the script thread)
+        headers (dict): Request headers with the auth token
+        session (requests.Session): Session to reuse across batches
+    
+    Returns:
+        list: (success, data or error message) per payload
+    """
+    url = f"{api_url or get_api_url()}/activity"
+    headers = headers if headers is not None else get_headers()
+    session = session or requests.Session()
+    results = []
+    for payload in payloads:
+        try:
+            response = session.post(url, json=payload, headers=headers)
+            results.append((True, handle_response(response)))
+        except Exception as e:
+            results.append((False, str(e)))
+    return results
+
 def get_activities():
     """Get all activities for the current user"""
     try:
@@ -1,4 +1,5 @@
 import streamlit as st
+import streamlit.components.v1 as components
 
 # Page configuration
 st.set_page_config(
@@ -14,9 +15,30 @@ import datetime
 # Import API client
 from api import (
     login, register, logout, get_profile, update_profile,
-    generate_route as api_generate_route,
-    save_activity, get_activities, get_activity, update_activity, delete_activity
+    save_activity, get_activities, get_activity, update_activity, delete_activity,
+    get_headers
 )
+from route_jobs import submit_job, get_job, phase_progress, route_job
+from map_render import (route_map_html, route_map_payload, show_route_map, route_hash, MAP_RENDERER,
+                        MAP_WIDTH, MAP_HEIGHT)
+from activity_map import activities_map_html
+from heatmap import load_heatmap, update_heatmap, heatmap_map_html
+from route_keys import activity_key
+from track_import import read_track, track_route_data
+from track_analytics import activity_analysis, format_pace, SPLIT_UNITS
+from best_efforts import load_records, update_records, format_duration, BEST_EFFORT_DISTANCES
+from training_load import load_training, update_training, training_frame
+from route_similarity import load_similarity, update_similarity, route_group
+from segments import load_segments, update_segments, add_segment, remove_segment, segment_from_activity
+from map_matching import match_recorded_track
+from route_index import load_route_index, update_route_index, index_activity, routes_near
+from goals import (
+    load_goals, add_goal, remove_goal, record_activity, sync_activities, goal_progress, streaks,
+    GOAL_PERIODS, GOAL_METRICS
+)
+
+# Seconds between checks on a running route job
+JOB_POLL_INTERVAL = 0.5
 
 # Check for required packages with graceful fallbacks
 try:
@@ -26,13 +48,6 @@ except ImportError:
     FOLIUM_AVAILABLE = False
     st.error("folium package not found. Please install with: pip install folium")
 
-try:
-    from streamlit_folium import folium_static
-    STREAMLIT_FOLIUM_AVAILABLE = True
-except ImportError:
-    STREAMLIT_FOLIUM_AVAILABLE = False
-    st.error("streamlit_folium package not found. Please install with: pip install streamlit-folium")
-
 try:
     import requests
     REQUESTS_AVAILABLE = True
@@ -52,12 +67,18 @@ if 'show_requirements_warning' not in st.session_state:
     st.session_state.show_requirements_warning = True
 
 requirements_path = os.path.join(os.path.dirname(__file__), "requirements.txt")
-if os.path.exists(requirements_path) and st.session_state.show_requirements_warning:
-    # Create columns within a warning-styled container
-    st.warning("⚠️ To install all requirements at once, run: pip install -r requirements.txt")
-    if st.button("✕ Dismiss", key="close_requirements_warning", type="secondary"):
-        st.session_state.show_requirements_warning = False
-        st.rerun()
+
+# Dismissing the warning only reruns this fragment
+@st.fragment
+def requirements_warning():
+    if os.path.exists(requirements_path) and st.session_state.show_requirements_warning:
+        # Create columns within a warning-styled container
+        st.warning("⚠️ To install all requirements at once, run: pip install -r requirements.txt")
+        if st.button("✕ Dismiss", key="close_requirements_warning", type="secondary"):
+            st.session_state.show_requirements_warning = False
+            st.rerun(scope="fragment")
+
+requirements_warning()
 
 # Import local routing module
 try:
@@ -80,6 +101,17 @@ if 'api_url' not in st.session_state:
 # Initialize session state for current route
 if 'current_route' not in st.session_state:
     st.session_state.current_route = None
+    st.session_state.current_gpx = None
+    st.session_state.current_gpx_lite = None
+    st.session_state.current_route_hash = None
+
+# Background route generation job of this session
+if 'route_job_id' not in st.session_state:
+    st.session_state.route_job_id = None
+    st.session_state.route_job_shown = None
+    st.session_state.route_request = None
+    st.session_state.route_api_error = None
+    st.session_state.nearby_routes = None
 
 # For storing activity history
 if 'activity_history' not in st.session_state:
@@ -115,6 +147,276 @@ def handle_logout():
     st.success("Logged out successfully")
     st.rerun()
 
+def user_goals():
+    """Goal state of the logged-in user"""
+    user = st.session_state.user_data
+    return load_goals(user.get('id') or user.get('email'))
+
+def count_towards_goals(saved):
+    """Add a just-saved activity to the goal totals and route index without reloading the history"""
+    if isinstance(saved, dict) and saved.get('_id'):
+        record_activity(user_goals(), saved)
+        if NUMPY_AVAILABLE:
+            index_activity(user_route_index(), saved)
+
+def user_route_index():
+    """Route index of the logged-in user"""
+    user = st.session_state.user_data
+    return load_route_index(user.get('id') or user.get('email'))
+
+# Route page fragments. Each one re-executes on its own when its widgets are
+# used; only a new route (or a finished job) reruns the whole page.
+@st.fragment
+def route_inputs():
+    st.text_input("Starting Location", "Odense C, Denmark", key="route_start_location")
+    st.slider("Distance (km)", 1.0, 20.0, 5.0, 0.5, key="route_distance")
+    
+    surface_options = ["Any", "Road", "Trail", "Mixed"]
+    st.selectbox("Surface Preference", surface_options, key="route_surface")
+    
+    # Route generation runs as a background job so the page stays responsive
+    job = get_job(st.session_state.route_job_id) if st.session_state.route_job_id else None
+    job_running = job is not None and job["status"] == "running"
+    
+    if st.button("Generate Route", disabled=job_running):
+        start_location = st.session_state.route_start_location
+        distance = st.session_state.route_distance
+        surface = st.session_state.route_surface
+        if st.session_state.authenticated:
+            # Try the API first; the job falls back to local generation
+            job_api_url, job_headers = st.session_state.api_url, get_headers()
+        else:
+            job_api_url, job_headers = None, None
+        st.session_state.route_job_id = submit_job(route_job, start_location, distance, surface,
+                                                   api_url=job_api_url, headers=job_headers)
+        st.session_state.route_request = {"start_location": start_location, "distance": distance,
+                                          "surface": surface}
+        st.session_state.route_api_error = None
+        # Rerun the page so the progress fragment starts polling
+        st.rerun()
+
+# Function to follow the background job; polls only while it runs
+def route_job_status():
+    job = get_job(st.session_state.route_job_id) if st.session_state.route_job_id else None
+    if job is None:
+        return
+    
+    if job["status"] == "running":
+        st.fragment(run_every=JOB_POLL_INTERVAL)(route_job_progress)()
+    elif job["status"] == "refining":
+        # The first route is shown; keep polling while the job looks for a better one
+        show_job_result(job)
+        st.fragment(run_every=JOB_POLL_INTERVAL)(route_job_refinement)()
+    elif job["status"] == "done":
+        # Finished while the poller was not on screen (e.g. on another page);
+        # the map and stats below this pick it up in the same run
+        show_job_result(job)
+    elif job["status"] == "failed":
+        st.error(f"Error generating route: {job['error']}")
+    
+    if st.session_state.route_api_error:
+        st.warning(f"API route generation failed: {st.session_state.route_api_error}. Used local generation instead.")
+
+def show_job_result(job):
+    """Make a job's route the current one (once per job and result revision); tell whether it changed"""
+    if (job["id"], job["revision"]) == st.session_state.route_job_shown:
+        return False
+    st.session_state.route_job_shown = (job["id"], job["revision"])
+    st.session_state.current_route = job["result"]["route_data"]
+    st.session_state.current_gpx = job["result"]["gpx"]
+    st.session_state.current_gpx_lite = job["result"]["gpx_lite"]
+    st.session_state.current_route_hash = route_hash(job["result"]["route_data"].get("coordinates", []))
+    st.session_state.route_api_error = job["result"]["api_error"]
+    return True
+
+def route_job_progress():
+    job = get_job(st.session_state.route_job_id)
+    if job is None or job["status"] != "running":
+        # Finished (or refining): pick up the result and redraw the map, stats and actions
+        if job is not None and job["status"] in ("refining", "done"):
+            show_job_result(job)
+        st.rerun()
+    st.progress(phase_progress(job["phase"]), text=f"Generating your route... ({job['phase']})")
+
+def route_job_refinement():
+    job = get_job(st.session_state.route_job_id)
+    if job is None:
+        return
+    if show_job_result(job) or job["status"] != "refining":
+        # A better route, or the end of the search: redraw the map, stats and actions
+        st.rerun()
+    st.caption("Looking for a better route...")
+
+# Saved routes starting near the chosen start, offered before generating a new one
+@st.fragment
+def nearby_routes():
+    if not st.session_state.authenticated or not NUMPY_AVAILABLE or not ROUTING_AVAILABLE:
+        return
+
+    if st.button("Routes Near Me"):
+        from routing import geocode_location
+        try:
+            start_point = geocode_location(st.session_state.route_start_location)
+        except ValueError as e:
+            start_point = None
+            st.warning(str(e))
+        if start_point is not None:
+            st.session_state.nearby_routes = routes_near(
+                user_route_index(), start_point, distance_km=st.session_state.route_distance,
+                surface=st.session_state.route_surface)
+
+    if st.session_state.nearby_routes is None:
+        return
+    if not st.session_state.nearby_routes:
+        st.info("You have no saved routes of this distance and surface starting nearby.")
+        return
+
+    for key, entry, distance_m in st.session_state.nearby_routes:
+        col1, col2 = st.columns([3, 1])
+        col1.write(f"**{entry['name'] or 'Saved route'}**: {entry['distance']:.1f} km, "
+                   f"starts {distance_m / 1000:.1f} km away")
+        if col2.button("Use", key=f"nearby_{key}"):
+            success, activity = get_activity(key)
+            if not success:
+                st.error(f"Could not load route: {activity}")
+                continue
+            route_data = activity.get("routeData") or {}
+            st.session_state.current_route = route_data
+            st.session_state.current_route_hash = route_hash(route_data.get("coordinates", []))
+            st.session_state.current_gpx = st.session_state.current_gpx_lite = None
+            if available_packages.get('gpxpy', False):
+                try:
+                    st.session_state.current_gpx = create_gpx(route_data)
+                    st.session_state.current_gpx_lite = create_gpx(route_data, lite=True)
+                except Exception as e:
+                    print(f"Error creating GPX file: {e}")
+            st.session_state.route_request = {"start_location": st.session_state.route_start_location,
+                                              "distance": entry["distance"],
+                                              "surface": entry["surface"] or st.session_state.route_surface}
+            st.session_state.route_api_error = None
+            st.session_state.nearby_routes = None
+            # Stop following a generation job, so its refinement does not replace the saved route
+            st.session_state.route_job_id = None
+            # Redraw the map, stats and actions with the saved route
+            st.rerun()
+
+def show_route(coords, key, **options):
+    """Draw one route with the configured map renderer (options as for route_map_html)"""
+    if MAP_RENDERER == "geojson":
+        # The map stays mounted under key; only the route payload is sent
+        show_route_map(route_map_payload(coords, **options), key=key)
+    else:
+        components.html(route_map_html(coords, **options), height=MAP_HEIGHT + 10, width=MAP_WIDTH)
+
+@st.fragment
+def route_map():
+    route_data = st.session_state.current_route
+    coords = route_data.get("coordinates", []) if route_data else []
+    
+    try:
+        # Rendered once per route; redraws are served from the map cache
+        show_route(coords, "route_map", start_point=route_data.get("start_point") if coords else None,
+                   route_key=st.session_state.current_route_hash if coords else None)
+    except ImportError:
+        st.error("Folium package not found. Map cannot be displayed.")
+        st.info("Install with: pip install folium")
+    except Exception as e:
+        st.error(f"Error displaying map: {str(e)}")
+        st.write("Map embedding issue. Try installing/updating folium:")
+        st.code("pip install -U folium")
+
+@st.fragment
+def route_stats():
+    route_data = st.session_state.current_route
+    request = st.session_state.route_request
+    
+    if "error" in route_data:
+        st.warning("Route generated with limitations")
+        st.error(route_data["error"])
+        # More detailed debug information
+        with st.expander("Debug Details"):
+            st.write("Route generation encountered issues:")
+            st.write(f"- Start location: {request['start_location']}")
+            st.write(f"- Distance requested: {request['distance']} km")
+            st.write(f"- Surface preference: {request['surface']}")
+            st.write(f"- Error: {route_data['error']}")
+    
+    st.subheader("Route Statistics")
+    stats_col1, stats_col2, stats_col3 = st.columns(3)
+    
+    # Use the actual calculated distance from route_data, if available
+    requested_distance = request["distance"]
+    actual_distance = route_data.get("distance", requested_distance)
+    stats_col1.metric("Distance", f"{actual_distance} km", 
+                    delta=f"{actual_distance - requested_distance:.2f} km" if actual_distance != requested_distance else None)
+    
+    # Use the estimated time from route_data, if available
+    estimated_time = route_data.get("estimated_time", round(requested_distance * 6))
+    stats_col2.metric("Estimated Time", f"{estimated_time} min")  # Assume 6 min/km pace
+    
+    stats_col3.metric("Surface", request["surface"])
+    
+    # Add elevation info if available
+    if "elevation_gain" in route_data:
+        st.metric("Elevation Gain", f"{route_data['elevation_gain']} m")
+
+@st.fragment
+def route_actions():
+    route_data = st.session_state.current_route
+    request = st.session_state.route_request
+    
+    st.subheader("Actions")
+    col1, col2 = st.columns(2)
+    
+    # Save route button (only if authenticated)
+    if st.session_state.authenticated:
+        with col1:
+            if st.button("Save Route"):
+                with st.spinner("Saving route..."):
+                    # Get a name for the route
+                    route_name = f"Run on {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"
+                    
+                    # Save the route to the API
+                    success, result = save_activity(route_data, route_name)
+                    if success:
+                        count_towards_goals(result)
+                        st.success(f"Route saved successfully as '{route_name}'!")
+                    else:
+                        st.error(f"Failed to save route: {result}")
+    else:
+        with col1:
+            st.warning("Log in to save routes")
+    
+    # Download option (the GPX file is built by the background job)
+    with col2:
+        if st.session_state.current_gpx:
+            # Sanitize filename from location
+            safe_location = ''.join(c if c.isalnum() else '_' for c in request["start_location"])
+            
+            # Lite files keep the shape within a few metres with far fewer points
+            lite = st.toggle("Lite GPX (fewer points, for watches)", key="gpx_lite")
+            gpx_data = st.session_state.current_gpx_lite if lite and st.session_state.current_gpx_lite else st.session_state.current_gpx
+            
+            st.download_button(
+                label="Download GPX",
+                data=gpx_data,
+                file_name=f"{safe_location}_route.gpx",
+                mime="application/gpx+xml",
+                help="Download this route as a GPX file to use in your GPS device or other apps"
+            )
+            
+            with st.expander("GPX File Details"):
+                st.write("Your GPX file contains:")
+                st.write(f"- {gpx_data.count('<trkpt')} track points")
+                st.write(f"- Total distance: {route_data.get('distance', 0)} km")
+                st.write(f"- Starting coordinates: {route_data.get('start_point', (0,0))}")
+        elif not available_packages.get('gpxpy', False):
+            st.warning("GPX export requires the 'gpxpy' package.")
+            st.info("Install with: pip install gpxpy")
+        else:
+            st.warning("Could not generate GPX file. Make sure gpxpy is installed.")
+
+
 # UI Structure
 def main():
     # Sidebar
@@ -178,203 +480,26 @@ def main():
         if nav_selection == "Route Generator":
             st.title("Generate Your Running Route")
             
+            # Add API URL configuration in the sidebar
+            with st.sidebar.expander("API Configuration"):
+                api_url = st.text_input("API URL", value=st.session_state.api_url)
+                if st.button("Update API URL"):
+                    st.session_state.api_url = api_url
+                    st.success("API URL updated")
+            
             col1, col2 = st.columns(2)
             
             with col1:
-                start_location = st.text_input("Starting Location", "Odense C, Denmark")
-                distance = st.slider("Distance (km)", 1.0, 20.0, 5.0, 0.5)
-                
-                surface_options = ["Any", "Road", "Trail", "Mixed"]
-                surface = st.selectbox("Surface Preference", surface_options)
-                
-                # Add API URL configuration in the sidebar
-                with st.sidebar.expander("API Configuration"):
-                    api_url = st.text_input("API URL", value=st.session_state.api_url)
-                    if st.button("Update API URL"):
-                        st.session_state.api_url = api_url
-                        st.success("API URL updated")
-                
-                if st.button("Generate Route"):
-                    with st.spinner("Generating your route..."):
-                        try:
-                            # Add debug info
-                            st.write("Debug Info:")
-                            debug_info = st.empty()
-                            debug_info.info(f"Starting route generation from {start_location} for {distance} km on {surface} surface")
-                            
-                            # Try getting route from API first
-                            if st.session_state.authenticated:
-                                success, api_route_data = api_generate_route(start_location, distance, surface)
-                                if success:
-                                    route_data = api_route_data
-                                    # Store the route in session state for later saving
-                                    st.session_state.current_route = route_data
-                                    debug_info.success("Route generated via API successfully!")
-                                else:
-                                    # If API fails, fall back to local generation
-                                    debug_info.warning(f"API route generation failed: {api_route_data}. Falling back to local generation.")
-                                    route_data = generate_route(start_location, distance, surface)
-                            else:
-                                # Not authenticated, use local generation
-                                debug_info.info("Using local route generation (not logged in)")
-                                route_data = generate_route(start_location, distance, surface)
-                            
-                            if route_data:
-                                if "error" in route_data:
-                                    st.warning("Route generated with limitations")
-                                    st.error(route_data["error"])
-                                    # More detailed debug information
-                                    with st.expander("Debug Details"):
-                                        st.write("Route generation encountered issues:")
-                                        st.write(f"- Start location: {start_location}")
-                                        st.write(f"- Distance requested: {distance} km")
-                                        st.write(f"- Surface preference: {surface}")
-                                        st.write(f"- Error: {route_data['error']}")
-                                else:
-                                    st.success("Route generated successfully!")
-                                    debug_info.success("Route generation completed successfully")
-                                
-                                # Check if folium and numpy are available
-                                if not FOLIUM_AVAILABLE or not NUMPY_AVAILABLE:
-                                    st.error("Unable to create map: required packages missing")
-                                    if not FOLIUM_AVAILABLE:
-                                        st.info("Install folium: pip install folium")
-                                    if not NUMPY_AVAILABLE:
-                                        st.info("Install numpy: pip install numpy") 
-                                    m = None
-                                else:
-                                    # We'll use a placeholder map until the routing is fully implemented
-                                    m = folium.Map(location=[55.3960, 10.3883], zoom_start=13)
-                                    folium.Marker([55.3960, 10.3883], tooltip="Start/End").add_to(m)
-                                    
-                                    # In a real implementation, we'd render the generated route
-                                    # For now, draw a sample circular path
-                                    # Generate circular route approximation
-                                    center = [55.3960, 10.3883]
-                                    radius = 0.01 * distance  # Rough approximation
-                                    n_points = 20
-                                    angles = np.linspace(0, 2*np.pi, n_points)
-                                    coords = [(center[0] + radius * np.cos(angle), 
-                                            center[1] + radius * np.sin(angle)) for angle in angles]
-                                    
-                                    # Add circular route to map
-                                    folium.PolyLine(coords, color="blue", weight=3, opacity=0.7).add_to(m)
-                                
-                                # Display the map and stats
-                                with col2:
-                                    if m is not None and FOLIUM_AVAILABLE and STREAMLIT_FOLIUM_AVAILABLE:
-                                        try:
-                                            folium_static(m)
-                                            st.success("Map embedded successfully!")
-                                        except Exception as e:
-                                            st.error(f"Error displaying map: {str(e)}")
-                                            st.write("Map embedding issue. Try installing/updating your folium packages:")
-                                            st.code("pip install -U folium streamlit-folium")
-                                    elif m is None:
-                                        st.error("Map cannot be displayed due to missing dependencies")
-                                    else:
-                                        st.warning("Map display requires folium and streamlit_folium packages")
-                                        st.info("Install with: pip install folium streamlit-folium")
-                                
-                                st.subheader("Route Statistics")
-                                stats_col1, stats_col2, stats_col3 = st.columns(3)
-                                
-                                # Use the actual calculated distance from route_data, if available
-                                actual_distance = route_data.get("distance", distance)
-                                stats_col1.metric("Distance", f"{actual_distance} km", 
-                                                delta=f"{actual_distance - distance:.2f} km" if actual_distance != distance else None)
-                                
-                                # Use the estimated time from route_data, if available
-                                estimated_time = route_data.get("estimated_time", round(distance * 6))
-                                stats_col2.metric("Estimated Time", f"{estimated_time} min")  # Assume 6 min/km pace
-                                
-                                stats_col3.metric("Surface", surface)
-                                
-                                # Add elevation info if available
-                                if "elevation_gain" in route_data:
-                                    st.metric("Elevation Gain", f"{route_data['elevation_gain']} m")
-                                
-                                # Actions section
-                                st.subheader("Actions")
-                                col1, col2 = st.columns(2)
-                                
-                                # Save route button (only if authenticated)
-                                if st.session_state.authenticated:
-                                    with col1:
-                                        if st.button("Save Route"):
-                                            if st.session_state.current_route:
-                                                with st.spinner("Saving route..."):
-                                                    # Get a name for the route
-                                                    route_name = f"Run on {datetime.datetime.now().strftime('%Y-%m-%d %H:%M')}"
-                                                    
-                                                    # Save the route to the API
-                                                    success, result = save_activity(st.session_state.current_route, route_name)
-                                                    if success:
-                                                        st.success(f"Route saved successfully as '{route_name}'!")
-                                                    else:
-                                                        st.error(f"Failed to save route: {result}")
-                                            else:
-                                                st.warning("No route to save. Generate a route first.")
-                                else:
-                                    with col1:
-                                        st.warning("Log in to save routes")
-                                
-                                # Download option
-                                with col2:
-                                    try:
-                                        if available_packages.get('gpxpy', False):
-                                            # Generate GPX file
-                                            gpx_data = create_gpx(route_data)
-                                            
-                                            # Log success for testing
-                                            st.success("✅ GPX file generated successfully")
-                                            
-                                            # Sanitize filename from location
-                                            safe_location = ''.join(c if c.isalnum() else '_' for c in start_location)
-                                            
-                                            st.download_button(
-                                                label="Download GPX",
-                                                data=gpx_data,
-                                                file_name=f"{safe_location}_route.gpx",
-                                                mime="application/gpx+xml",
-                                                help="Download this route as a GPX file to use in your GPS device or other apps"
-                                            )
-                                            
-                                            with st.expander("GPX File Details"):
-                                                st.write("Your GPX file contains:")
-                                                st.write(f"- {len(route_data['coordinates'])} waypoints")
-                                                st.write(f"- Total distance: {route_data.get('distance', 0)} km")
-                                                st.write(f"- Starting coordinates: {route_data.get('start_point', (0,0))}")
-                                        else:
-                                            st.warning("GPX export requires the 'gpxpy' package.")
-                                            st.info("Install with: pip install gpxpy")
-                                    except Exception as e:
-                                        st.error(f"Error creating GPX file: {str(e)}")
-                                        st.warning("Could not generate GPX file. Make sure gpxpy is installed.")
-                        except Exception as e:
-                            st.error(f"Error generating route: {str(e)}")
+                route_inputs()
+                nearby_routes()
+                route_job_status()
             
             with col2:
-                if 'm' not in locals():
-                    # Show placeholder map when no route is generated yet
-                    if FOLIUM_AVAILABLE:
-                        # Use coordinates from route_data if available
-                        if st.session_state.current_route and 'coordinates' in st.session_state.current_route:
-                            start_coords = st.session_state.current_route.get('coordinates', [[55.3960, 10.3883]])[0]
-                            m = folium.Map(location=start_coords, zoom_start=13)
-                        else:
-                            m = folium.Map(location=[55.3960, 10.3883], zoom_start=13)
-                    else:
-                        m = None
-                        st.error("Folium package not found. Map cannot be displayed.")
-                        st.info("Install with: pip install folium")
-                    if m is not None and FOLIUM_AVAILABLE and STREAMLIT_FOLIUM_AVAILABLE:
-                        folium_static(m)
-                    elif m is None:
-                        st.error("Map cannot be displayed due to missing dependencies")
-                    else:
-                        st.warning("Map display requires folium and streamlit_folium packages")
-                        st.info("Install with: pip install folium streamlit-folium")
+                route_map()
+            
+            if st.session_state.current_route:
+                route_stats()
+                route_actions()
                     
         elif nav_selection == "Activity History":
             st.title("Your Activity History")
@@ -392,6 +517,33 @@ def main():
                         else:
                             st.error(f"Failed to load activities: {activities}")
                 
+                # Import a recorded run from a GPS watch or another app
+                with st.expander("Import a Run"):
+                    uploaded = st.file_uploader("GPX, TCX or FIT file", type=["gpx", "tcx", "fit"])
+                    snap = st.checkbox("Snap to streets (distance and surface mix from the street network)")
+                    if uploaded is not None and st.button("Import"):
+                        with st.spinner("Reading track..."):
+                            try:
+                                track = read_track(uploaded, uploaded.name)
+                                route_data = track_route_data(track)
+                                if snap:
+                                    try:
+                                        matched = match_recorded_track(track)
+                                        route_data["matched"] = {key: value for key, value in matched.items()
+                                                                 if key != "coordinates"}
+                                    except Exception as e:
+                                        st.warning(f"Could not snap the run to streets: {str(e)}")
+                                run_name = os.path.splitext(uploaded.name)[0]
+                                success, result = save_activity(route_data, run_name)
+                                if success:
+                                    count_towards_goals(result)
+                                    st.session_state.activity_history = []
+                                    st.success(f"Imported '{run_name}' ({route_data['distance']} km)")
+                                else:
+                                    st.error(f"Failed to save imported run: {result}")
+                            except (ValueError, ImportError) as e:
+                                st.error(f"Could not import {uploaded.name}: {str(e)}")
+                
                 # Display activities
                 if not st.session_state.activity_history:
                     # First time load
@@ -407,9 +559,19 @@ def main():
                     st.subheader(f"You have {len(st.session_state.activity_history)} saved activities")
                     
                     # Create tabs for different views
-                    tab1, tab2 = st.tabs(["List View", "Map View"])
+                    tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
+                        ["List View", "Map View", "Heatmap", "Records", "Training Load", "Segments"])
                     
                     with tab1:
+                        # Repeated routes are grouped incrementally; only new activities are matched
+                        similarity = None
+                        if NUMPY_AVAILABLE:
+                            user = st.session_state.user_data
+                            similarity = load_similarity(user.get('id') or user.get('email'))
+                            update_similarity(similarity, st.session_state.activity_history)
+                            # Keeps "Routes Near Me" in step with edits and deletions made elsewhere
+                            update_route_index(user_route_index(), st.session_state.activity_history)
+                        
                         # List view with details
                         for idx, activity in enumerate(st.session_state.activity_history):
                             with st.container():
@@ -419,6 +581,9 @@ def main():
                                     st.subheader(activity.get('name', f"Activity {idx+1}"))
                                     st.write(f"Date: {activity.get('createdAt', 'Unknown')}")
                                     st.write(f"Distance: {activity.get('distance', 0)} km")
+                                    group = route_group(similarity, activity_key(activity)) if similarity else None
+                                    if group and len(group["members"]) > 1:
+                                        st.caption(f"Repeated route: run {len(group['members'])} times")
                                     
                                 with col2:
                                     duration_mins = activity.get('duration', 0) / 60  # Convert seconds to minutes
@@ -435,40 +600,112 @@ def main():
                         # Map view of all activities
                         if FOLIUM_AVAILABLE:
                             try:
-                                # Create a map centered on the first activity
-                                first_activity = st.session_state.activity_history[0]
-                                start_loc = first_activity.get('routeData', {}).get('coordinates', [[55.3960, 10.3883]])[0]
-                                
-                                m = folium.Map(location=start_loc, zoom_start=12)
-                                
-                                # Add routes to map with different colors
-                                colors = ['blue', 'red', 'green', 'purple', 'orange', 'darkred', 'darkblue', 'darkgreen']
-                                
-                                for i, activity in enumerate(st.session_state.activity_history):
-                                    if 'routeData' in activity and 'coordinates' in activity['routeData']:
-                                        coords = activity['routeData']['coordinates']
-                                        color = colors[i % len(colors)]
-                                        folium.PolyLine(
-                                            coords, 
-                                            color=color, 
-                                            weight=3, 
-                                            opacity=0.7, 
-                                            tooltip=activity.get('name', f"Activity {i+1}")
-                                        ).add_to(m)
-                                        
-                                        # Add start marker
-                                        folium.Marker(
-                                            coords[0],
-                                            tooltip=f"Start: {activity.get('name', f'Activity {i+1}')}" 
-                                        ).add_to(m)
-                                
-                                # Display the map
-                                folium_static(m)
+                                # One merged, simplified layer (or a heatmap for long histories)
+                                html = activities_map_html(st.session_state.activity_history)
+                                if html is not None:
+                                    components.html(html, height=MAP_HEIGHT + 10, width=MAP_WIDTH)
+                                else:
+                                    st.info("None of your activities has a route to show yet.")
                                 
                             except Exception as e:
                                 st.error(f"Error displaying activity maps: {str(e)}")
                         else:
                             st.error("Folium package is required to display maps")
+                    
+                    with tab3:
+                        # Where you run: binned incrementally, drawn as one image overlay
+                        if FOLIUM_AVAILABLE:
+                            try:
+                                user = st.session_state.user_data
+                                heatmap = load_heatmap(user.get('id') or user.get('email'))
+                                update_heatmap(heatmap, st.session_state.activity_history)
+                                html = heatmap_map_html(heatmap)
+                                if html is not None:
+                                    components.html(html, height=MAP_HEIGHT + 10, width=MAP_WIDTH)
+                                else:
+                                    st.info("None of your activities has a route to show yet.")
+                            except Exception as e:
+                                st.error(f"Error displaying heatmap: {str(e)}")
+                        else:
+                            st.error("Folium package is required to display maps")
+                    
+                    with tab4:
+                        # Fastest efforts from imported recordings, updated only for new activities
+                        user = st.session_state.user_data
+                        records = load_records(user.get('id') or user.get('email'))
+                        update_records(records, st.session_state.activity_history)
+                        if any(records["table"].values()):
+                            for name in BEST_EFFORT_DISTANCES:
+                                ranking = records["table"].get(name)
+                                if ranking:
+                                    st.write(f"**{name}**: " + ", ".join(
+                                        f"{format_duration(record['time'])} ({record['name']}, {record['date'][:10]})"
+                                        for record in ranking))
+                        else:
+                            st.info("Import recorded runs (GPX, TCX or FIT) to see your personal records.")
+                    
+                    with tab5:
+                        # Daily fitness/fatigue series, persisted and extended only from the first changed day
+                        if NUMPY_AVAILABLE:
+                            user = st.session_state.user_data
+                            training = load_training(user.get('id') or user.get('email'))
+                            update_training(training, st.session_state.activity_history)
+                            span = st.radio("Show", ["90 days", "1 year", "All"], horizontal=True, key="training_span")
+                            frame = training_frame(training, {"90 days": 90, "1 year": 365, "All": None}[span])
+                            if len(frame["Date"]):
+                                latest = {name: column[-1] for name, column in frame.items()}
+                                metric_cols = st.columns(3)
+                                metric_cols[0].metric("Fitness (CTL)", f"{latest['Fitness (CTL)']:.0f}")
+                                metric_cols[1].metric("Fatigue (ATL)", f"{latest['Fatigue (ATL)']:.0f}")
+                                metric_cols[2].metric("Form (TSB)", f"{latest['Form (TSB)']:.0f}")
+                                st.line_chart(frame, x="Date", y=["Fitness (CTL)", "Fatigue (ATL)", "Form (TSB)"])
+                            else:
+                                st.info("No dated activities yet.")
+                        else:
+                            st.error("NumPy is required for training load")
+                    
+                    with tab6:
+                        # Timed efforts on named stretches; new runs are matched only against segments they pass
+                        if NUMPY_AVAILABLE:
+                            user = st.session_state.user_data
+                            segments_state = load_segments(user.get('id') or user.get('email'))
+                            update_segments(segments_state, st.session_state.activity_history)
+                            for segment_id, segment in list(segments_state["segments"].items()):
+                                efforts = segments_state["efforts"].get(segment_id, [])
+                                st.write(f"**{segment['name']}**: {len(efforts)} efforts")
+                                if efforts:
+                                    st.dataframe({
+                                        "Time": [format_duration(effort["time"]) for effort in efforts[:10]],
+                                        "Activity": [effort["name"] for effort in efforts[:10]],
+                                        "Date": [effort["date"][:10] for effort in efforts[:10]],
+                                    }, hide_index=True)
+                                if st.button("Remove", key=f"remove_segment_{segment_id}"):
+                                    remove_segment(segments_state, segment_id)
+                                    st.rerun()
+                            
+                            recorded = [activity for activity in st.session_state.activity_history
+                                        if (activity.get('routeData') or {}).get('times')]
+                            if recorded:
+                                with st.form("segment_form"):
+                                    st.write("Create a segment from part of a recorded run")
+                                    source = st.selectbox("Run", range(len(recorded)),
+                                                          format_func=lambda i: recorded[i].get('name', f"Activity {i+1}"))
+                                    segment_name = st.text_input("Segment name")
+                                    seg_cols = st.columns(2)
+                                    start_km = seg_cols[0].number_input("From (km)", min_value=0.0, value=0.0, step=0.1)
+                                    end_km = seg_cols[1].number_input("To (km)", min_value=0.1, value=1.0, step=0.1)
+                                    if st.form_submit_button("Create Segment"):
+                                        if not segment_name or end_km <= start_km:
+                                            st.error("Give the segment a name and an end after its start")
+                                        else:
+                                            coords = segment_from_activity(recorded[source], start_km, end_km)
+                                            add_segment(segments_state, segment_name, coords,
+                                                        st.session_state.activity_history)
+                                            st.rerun()
+                            else:
+                                st.info("Import recorded runs (GPX, TCX or FIT) to time efforts on segments.")
+                        else:
+                            st.error("NumPy is required for segments")
                 
                 else:
                     st.info("No activities recorded yet. Generate and save some routes!")
@@ -483,14 +720,44 @@ def main():
                         st.write(f"Distance: {activity.get('distance')} km")
                         st.write(f"Duration: {activity.get('duration')/60:.1f} minutes")
                         st.write(f"Start Location: {activity.get('startLocation', 'Unknown')}")
+                        matched = (activity.get('routeData') or {}).get('matched')
+                        if matched:
+                            mix = ", ".join(f"{name} {share:.0%}" for name, share in matched["surface_mix"].items())
+                            climb = (f", {matched['elevation_gain']} m climb"
+                                     if matched.get('elevation_gain') is not None else "")
+                            st.write(f"On streets: {matched['distance_km']} km ({mix}){climb}")
+                        
+                        # Splits and moving time (measured for imported runs, estimated for planned routes)
+                        if NUMPY_AVAILABLE:
+                            analysis = activity_analysis(activity)
+                            if analysis and analysis.get("splits"):
+                                if analysis["estimated"]:
+                                    st.caption("Estimated from the route and duration; import a recording for measured splits.")
+                                else:
+                                    metric_cols = st.columns(4)
+                                    moving = analysis.get("moving_time")
+                                    metric_cols[0].metric("Moving Time", f"{moving / 60:.0f} min" if moving else "-")
+                                    metric_cols[1].metric("Avg Pace", f"{format_pace(analysis.get('average_pace'))} /km")
+                                    metric_cols[2].metric("Grade Adj. Pace", f"{format_pace(analysis.get('average_gap'))} /km")
+                                    metric_cols[3].metric("Avg HR", analysis.get("average_hr") or "-")
+                                
+                                unit = st.radio("Splits", list(SPLIT_UNITS), horizontal=True, key="splits_unit")
+                                splits = analysis["splits"][unit]
+                                st.dataframe({
+                                    unit: list(range(1, len(splits["pace"]) + 1)),
+                                    "Distance (m)": splits["distance"],
+                                    "Pace": [format_pace(pace) for pace in splits["pace"]],
+                                    "Elevation Gain (m)": splits["elevation_gain"],
+                                    "Avg HR": splits["hr"],
+                                }, hide_index=True)
                         
                         # Map of single activity
-                        if FOLIUM_AVAILABLE and 'routeData' in activity and 'coordinates' in activity['routeData']:
+                        if (FOLIUM_AVAILABLE or MAP_RENDERER == "geojson") and 'routeData' in activity and 'coordinates' in activity['routeData']:
                             coords = activity['routeData']['coordinates']
-                            activity_map = folium.Map(location=coords[0], zoom_start=14)
-                            folium.PolyLine(coords, color='blue', weight=3, opacity=0.7).add_to(activity_map)
-                            folium.Marker(coords[0], tooltip="Start").add_to(activity_map)
-                            folium_static(activity_map)
+                            # Saved activities are keyed by id, so redraws skip hashing the route
+                            route_key = f"{activity['_id']}:{activity.get('updatedAt', '')}" if activity.get('_id') else None
+                            show_route(coords, "activity_route_map", zoom_start=14, start_tooltip="Start",
+                                       route_key=route_key)
                         
                         # Actions for this activity
                         col1, col2 = st.columns(2)
@@ -533,6 +800,40 @@ def main():
                     if submit:
                         # This would be replaced with an actual API call to your Express backend
                         st.success("Profile updated successfully!")
+            
+            # Goals read pre-aggregated period totals; only changed activities update them
+            st.subheader("Goals")
+            goals_state = user_goals()
+            if st.session_state.activity_history:
+                sync_activities(goals_state, st.session_state.activity_history)
+            
+            streak = streaks(goals_state)
+            streak_cols = st.columns(3)
+            streak_cols[0].metric("Current Streak", f"{streak['current_days']} days")
+            streak_cols[1].metric("Longest Streak", f"{streak['longest_days']} days")
+            streak_cols[2].metric("Weekly Streak", f"{streak['current_weeks']} weeks")
+            
+            for progress in goal_progress(goals_state):
+                goal = progress["goal"]
+                goal_col, remove_col = st.columns([5, 1])
+                with goal_col:
+                    st.progress(progress["fraction"], text=(
+                        f"{goal['period'].capitalize()} {goal['metric']} ({progress['period']}): "
+                        f"{progress['value']:.1f} / {progress['target']:.0f} {progress['unit']}"))
+                with remove_col:
+                    if st.button("Remove", key=f"remove_goal_{goal['id']}"):
+                        remove_goal(goals_state, goal['id'])
+                        st.rerun()
+            
+            with st.form("goal_form"):
+                goal_cols = st.columns(3)
+                period = goal_cols[0].selectbox("Period", GOAL_PERIODS)
+                metric = goal_cols[1].selectbox(
+                    "Metric", list(GOAL_METRICS), format_func=lambda name: f"{name} ({GOAL_METRICS[name][1]})")
+                target = goal_cols[2].number_input("Target", min_value=1.0, value=20.0, step=1.0)
+                if st.form_submit_button("Add Goal"):
+                    add_goal(goals_state, period, metric, target)
+                    st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,213 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from graph_cache import tile_key, load_graph_tile
+from routing import generate_graph_route, geocode_location, create_gpx, available_packages, get_surface_filter
+
+# Largest number of same-tile requests handed to one worker at a time, so a
+# single busy tile still spreads over the pool
+CHUNK_SIZE = 25
+
+
+def read_rows(path):
+    """
+    Read route requests from a CSV or JSONL file
+
+    Each row needs a distance (km) and either a start location string
+    ("start") or "lat"/"lon" columns. "surface" and "id" are optional.
+
+    Args:
+        path (str): Input file (.csv or .jsonl), or "-" for JSONL on stdin
+
+    Returns:
+        list: Request dicts with id, start, lat, lon, distance and surface
+    """
+    if path == "-":
+        raw = [json.loads(line) for line in sys.stdin if line.strip()]
+    elif path.endswith(".csv"):
+        with open(path, newline="") as f:
+            raw = list(csv.DictReader(f))
+    else:
+        with open(path) as f:
+            raw = [json.loads(line) for line in f if line.strip()]
+
+    rows = []
+    for i, row in enumerate(raw):
+        rows.append({
+            "id": row.get("id") or str(i),
+            "start": row.get("start") or row.get("start_location") or "",
+            "lat": float(row["lat"]) if row.get("lat") not in (None, "") else None,
+            "lon": float(row["lon"]) if row.get("lon") not in (None, "") else None,
+            "distance": float(row["distance"]),
+            "surface": row.get("surface") or "Any",
+        })
+    return rows
+
+
+def _geocode_rows(rows):
+    """Fill in coordinates for rows given by name, geocoding every name once"""
+    names = {row["start"] for row in rows if row["lat"] is None and row["start"]}
+    points = {}
+    for name in names:
+        try:
+            points[name] = geocode_location(name)
+        except Exception as e:
+            print(f"Error geocoding {name}: {e}", file=sys.stderr)
+            points[name] = None
+
+    for row in rows:
+        if row["lat"] is None:
+            point = points.get(row["start"])
+            if point is not None:
+                row["lat"], row["lon"] = point
+
+
+def _log_to_stderr():
+    """Keep routing log output of workers out of JSONL written to stdout"""
+    sys.stdout = sys.stderr
+
+
+def _prepare_tile(row):
+    """Download or load the graph tile of a request, so later chunks read it from disk (runs in a worker)"""
+    try:
+        highway_filter, handle_missing_surface = get_surface_filter(row["surface"])
+        load_graph_tile((row["lat"], row["lon"]), row["distance"], row["surface"],
+                        highway_filter, handle_missing_surface)
+    except Exception as e:
+        # The chunks report the error for each of their requests
+        print(f"Error preparing graph tile: {e}")
+
+
+def _run_group(rows, time_budget):
+    """Generate all routes of one graph tile (runs in a worker process)"""
+    results = []
+    for row in rows:
+        started = time.perf_counter()
+        result = {"id": row["id"], "request": row, "route": None, "error": None}
+        try:
+            result["route"] = generate_graph_route((row["lat"], row["lon"]), row["distance"], row["surface"],
+                                                   time_budget=time_budget)
+        except Exception as e:
+            result["error"] = str(e)
+        result["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        results.append(result)
+    return results
+
+
+def generate_routes_batch(rows, workers=None, time_budget=None):
+    """
+    Generate routes for many requests at once
+
+    Requests are grouped by the graph tile they need and the groups run in
+    a process pool. A group larger than CHUNK_SIZE is split into chunks only
+    after one task has built its tile, so each tile is downloaded once and
+    the chunks read it from disk. Results are yielded as soon as their chunk
+    finishes.
+
+    Args:
+        rows (list): Request dicts from read_rows
+        workers (int): Worker processes (defaults to the number of cores)
+        time_budget (float): Seconds each loop search may take
+
+    Yields:
+        dict: Result with id, request, route (or None), error and elapsed_ms
+    """
+    _geocode_rows(rows)
+
+    groups = {}
+    for row in rows:
+        if row["lat"] is None:
+            yield {"id": row["id"], "request": row, "route": None,
+                   "error": f"Could not find location: {row['start']}", "elapsed_ms": 0.0}
+            continue
+        key = tile_key((row["lat"], row["lon"]), row["distance"], row["surface"])
+        groups.setdefault(key, []).append(row)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_log_to_stderr) as pool:
+        def submit_chunks(group):
+            return {pool.submit(_run_group, group[i:i + CHUNK_SIZE], time_budget): None
+                    for i in range(0, len(group), CHUNK_SIZE)}
+
+        # Pending futures -> the group to fan out once its tile is ready (None for chunks)
+        pending = {}
+        for group in groups.values():
+            if len(group) > CHUNK_SIZE:
+                pending[pool.submit(_prepare_tile, group[0])] = group
+            else:
+                pending.update(submit_chunks(group))
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                group = pending.pop(future)
+                if group is not None:
+                    pending.update(submit_chunks(group))
+                else:
+                    yield from future.result()
+
+
+def _write_gpx(result, directory):
+    """Write one route as a GPX file and return its path"""
+    path = os.path.join(directory, f"{result['id']}.gpx")
+    with open(path, "w") as f:
+        f.write(create_gpx(result["route"]))
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate running routes for many requests at once")
+    parser.add_argument("input", help="CSV or JSONL file of requests (start or lat/lon, distance, surface)")
+    parser.add_argument("-o", "--output", default="-",
+                        help="JSONL output file, or directory for --format gpx (default: stdout)")
+    parser.add_argument("--format", choices=["jsonl", "gpx"], default="jsonl", help="Output format")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: number of cores)")
+    parser.add_argument("--time-budget", type=float, default=None, help="Seconds per loop search")
+    args = parser.parse_args(argv)
+
+    if args.format == "gpx":
+        if not available_packages.get('gpxpy', False):
+            parser.error("gpxpy package is required for GPX export")
+        if args.output == "-":
+            parser.error("--format gpx needs an output directory")
+        os.makedirs(args.output, exist_ok=True)
+        out = None
+    else:
+        out = sys.stdout if args.output == "-" else open(args.output, "w")
+
+    rows = read_rows(args.input)
+    started = time.perf_counter()
+    timings = []
+    failed = 0
+
+    try:
+        for result in generate_routes_batch(rows, args.workers, args.time_budget):
+            timings.append(result["elapsed_ms"])
+            if result["error"]:
+                failed += 1
+            if out is not None:
+                out.write(json.dumps(result) + "\n")
+                out.flush()
+            elif result["route"] is not None:
+                _write_gpx(result, args.output)
+    finally:
+        if out is not None and out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - started
+    timings.sort()
+    if timings:
+        p50 = timings[len(timings) // 2]
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"{len(timings)} routes ({failed} failed) in {elapsed:.1f} s: "
+              f"{len(timings) / elapsed:.2f} routes/s, p50 {p50:.0f} ms, p95 {p95:.0f} ms, "
+              f"max {timings[-1]:.0f} ms", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+import os
+import json
+import hashlib
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from route_keys import activity_key
+
+# Where per-user record tables are persisted between runs
+RECORDS_CACHE_DIR = os.environ.get(
+    "SMARTRUNNING_RECORDS_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".records_cache")
+)
+
+# Distances (m) personal records are kept for
+BEST_EFFORT_DISTANCES = {"1k": 1000.0, "5k": 5000.0, "10k": 10000.0, "half": 21097.5, "marathon": 42195.0}
+
+# Fastest efforts kept per distance
+RECORDS_PER_DISTANCE = 3
+
+# In-memory record tables by user
+_records = {}
+_records_lock = threading.Lock()
+
+
+def fastest_segment(distance, time, target):
+    """
+    Find the fastest stretch of a track covering a target distance
+
+    This is the two-pointer scan over cumulative distance done as array
+    operations: for every start point, the end pointer is where the
+    cumulative distance first reaches start + target. The start distances
+    are increasing, so searchsorted walks the array once, and the finish
+    time is interpolated inside the last segment.
+
+    Args:
+        distance (np.ndarray): Cumulative distance in metres (non-decreasing)
+        time (np.ndarray): Time in seconds at each point (non-decreasing)
+        target (float): Distance of the effort in metres
+
+    Returns:
+        dict or None: time (s) and start (m along the track), or None if the track is shorter
+    """
+    if len(distance) < 2 or distance[-1] < target:
+        return None
+    # Starts from which the target distance is still reached
+    count = int(np.searchsorted(distance, distance[-1] - target, side="right"))
+    ends = distance[:count] + target
+    j = np.clip(np.searchsorted(distance, ends, side="left"), 1, len(distance) - 1)
+    span = distance[j] - distance[j - 1]
+    fraction = np.divide(ends - distance[j - 1], span, out=np.ones_like(span), where=span > 0)
+    elapsed = time[j - 1] + fraction * (time[j] - time[j - 1]) - time[:count]
+    best = int(np.argmin(elapsed))
+    return {"time": round(float(elapsed[best]), 1), "start": round(float(distance[best]), 1)}
+
+
+def best_efforts(distance, time, targets=None):
+    """
+    Fastest effort of a track for each record distance
+
+    Args:
+        distance (np.ndarray): Cumulative distance in metres
+        time (np.ndarray): Time in seconds at each point
+        targets (dict): Name -> distance in metres (defaults to BEST_EFFORT_DISTANCES)
+
+    Returns:
+        dict: Name -> {"time", "start"} for each distance the track covers
+    """
+    efforts = {}
+    for name, target in (targets or BEST_EFFORT_DISTANCES).items():
+        effort = fastest_segment(distance, time, target)
+        if effort is not None:
+            efforts[name] = effort
+    return efforts
+
+
+def records_path(user_key):
+    """Get the on-disk path of a user's record table"""
+    name = hashlib.sha1(str(user_key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(RECORDS_CACHE_DIR, f"records_{name}.json")
+
+
+def _empty_records(user_key):
+    return {"user": user_key, "activities": {}, "table": {name: [] for name in BEST_EFFORT_DISTANCES},
+            "lock": threading.Lock()}
+
+
+def load_records(user_key):
+    """
+    Get a user's record table from memory or disk (empty if there is none yet)
+
+    Args:
+        user_key (str): User id
+
+    Returns:
+        dict: Records with per-activity efforts and the top efforts per distance
+    """
+    with _records_lock:
+        if user_key in _records:
+            return _records[user_key]
+
+    records = _empty_records(user_key)
+    try:
+        with open(records_path(user_key)) as f:
+            saved = json.load(f)
+        records["activities"] = saved.get("activities", {})
+        records["table"].update(saved.get("table", {}))
+    except (OSError, ValueError):
+        pass
+
+    with _records_lock:
+        return _records.setdefault(user_key, records)
+
+
+def save_records(records):
+    """Persist a record table as JSON"""
+    os.makedirs(RECORDS_CACHE_DIR, exist_ok=True)
+    path = records_path(records["user"])
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"activities": records["activities"], "table": records["table"]}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _add_to_table(table, key, entry):
+    for name, effort in entry["efforts"].items():
+        if name not in table:
+            continue
+        ranking = table[name]
+        if len(ranking) >= RECORDS_PER_DISTANCE and effort["time"] >= ranking[-1]["time"]:
+            continue
+        ranking.append({"time": effort["time"], "activity": key, "name": entry["name"], "date": entry["date"]})
+        ranking.sort(key=lambda record: record["time"])
+        del ranking[RECORDS_PER_DISTANCE:]
+
+
+def activity_efforts(activity):
+    """Best efforts stored with an imported activity, or None for planned routes"""
+    analysis = (activity.get("routeData") or {}).get("analysis") or {}
+    return analysis.get("best_efforts")
+
+
+def update_records(records, activities):
+    """
+    Add the best efforts of activities that are not in the record table yet
+
+    Efforts are computed once per activity when it is imported and stored
+    with it, so adding an activity only merges a few numbers into the top
+    lists. If an activity was deleted, the table is rebuilt from the
+    stored efforts of the remaining ones.
+
+    Args:
+        records (dict): Records from load_records
+        activities (list): All of the user's activity dicts
+
+    Returns:
+        int: Number of activities added
+    """
+    entries = {}
+    for activity in activities:
+        efforts = activity_efforts(activity)
+        if efforts:
+            route_data = activity.get("routeData") or {}
+            entries[activity_key(activity)] = {
+                "name": activity.get("name", "Activity"),
+                "date": route_data.get("start_time") or activity.get("createdAt", ""),
+                "efforts": efforts,
+            }
+
+    with records["lock"]:
+        deleted = not set(records["activities"]) <= set(entries)
+        if deleted:
+            records["activities"] = {key: entry for key, entry in records["activities"].items() if key in entries}
+            records["table"] = {name: [] for name in BEST_EFFORT_DISTANCES}
+            for key, entry in records["activities"].items():
+                _add_to_table(records["table"], key, entry)
+
+        new = [key for key in entries if key not in records["activities"]]
+        for key in new:
+            records["activities"][key] = entries[key]
+            _add_to_table(records["table"], key, entries[key])
+
+        if new or deleted:
+            try:
+                save_records(records)
+            except OSError as e:
+                print(f"Warning: could not persist records: {e}")
+    return len(new)
+
+
+def format_duration(seconds):
+    """Format seconds as h:mm:ss or m:ss"""
+    seconds = int(round(seconds))
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes}:{seconds:02d}"
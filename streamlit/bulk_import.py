@@ -0,0 +1,332 @@
+import os
+import io
+import sys
+import csv
+import gzip
+import json
+import time
+import zipfile
+import hashlib
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from api import DEFAULT_API_URL, activity_payload, save_activities
+from track_import import read_track, track_route_data
+
+# Track files handed to one worker at a time; small files make per-task overhead matter
+CHUNK_SIZE = 16
+
+# Activities written to the backend or local store (and checkpointed) together
+BATCH_SIZE = 100
+
+# Files the importer reads, optionally gzipped as in Strava exports
+TRACK_EXTENSIONS = (".gpx", ".tcx", ".fit")
+
+# Worker side: archive path -> open ZipFile, so each worker opens an archive once
+_archives = {}
+
+
+def track_name(member):
+    """Name of a track file without directories and a .gz suffix"""
+    name = member.replace("\\", "/").rsplit("/", 1)[-1]
+    return name[:-3] if name.lower().endswith(".gz") else name
+
+
+def is_track_file(member):
+    return track_name(member).lower().endswith(TRACK_EXTENSIONS)
+
+
+def list_sources(path, scratch_dir, prefix=""):
+    """
+    List the track files of an export archive or directory
+
+    Nested zips (as in Garmin exports) are extracted to scratch_dir once,
+    so workers can read their members directly.
+
+    Args:
+        path (str): .zip archive or directory
+        scratch_dir (str): Directory for extracted nested archives
+        prefix (str): Key prefix of a nested archive
+
+    Returns:
+        list: (container, member, key) tuples; container is a zip path, or None when
+        member is a file path. key names the file within the export, the same on every run.
+    """
+    sources = []
+    if os.path.isdir(path):
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                key = prefix + os.path.relpath(full, path).replace(os.sep, "/")
+                if name.lower().endswith(".zip"):
+                    sources.extend(list_sources(full, scratch_dir, key + "!"))
+                elif is_track_file(name):
+                    sources.append((None, full, key))
+        return sources
+
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            key = prefix + info.filename
+            if info.filename.lower().endswith(".zip"):
+                target = os.path.join(scratch_dir, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16])
+                archive.extract(info, target)
+                sources.extend(list_sources(os.path.join(target, info.filename), scratch_dir, key + "!"))
+            elif is_track_file(info.filename):
+                sources.append((path, info.filename, key))
+    return sources
+
+
+def read_activity_names(path):
+    """
+    Get activity names and dates from a Strava export's activities.csv
+
+    Returns:
+        dict: Track file name -> {"name": ..., "date": ...} (empty if there is no activities.csv)
+    """
+    try:
+        if os.path.isdir(path):
+            f = open(os.path.join(path, "activities.csv"), newline="", encoding="utf-8")
+        else:
+            with zipfile.ZipFile(path) as archive:
+                f = io.TextIOWrapper(io.BytesIO(archive.read("activities.csv")), encoding="utf-8", newline="")
+    except (OSError, KeyError):
+        return {}
+
+    names = {}
+    with f:
+        for row in csv.DictReader(f):
+            filename = row.get("Filename") or ""
+            if filename:
+                names[track_name(filename)] = {"name": row.get("Activity Name") or "",
+                                               "date": row.get("Activity Date") or ""}
+    return names
+
+
+def _read_source(container, member):
+    if container is None:
+        with open(member, "rb") as f:
+            return f.read()
+    archive = _archives.get(container)
+    if archive is None:
+        archive = _archives[container] = zipfile.ZipFile(container)
+    return archive.read(member)
+
+
+def _summarize(container, member, key):
+    """Hash, parse and summarize one track file (runs in a worker process)"""
+    result = {"key": key, "name": track_name(member),
+              "sha256": None, "bytes": 0, "payload": None, "error": None}
+    try:
+        data = _read_source(container, member)
+        result["bytes"] = len(data)
+        if member.lower().endswith(".gz"):
+            data = gzip.decompress(data)
+        # Hash the decompressed content so a .fit and its .fit.gz count as one activity
+        result["sha256"] = hashlib.sha256(data).hexdigest()
+        route_data = track_route_data(read_track(io.BytesIO(data), result["name"]))
+        route_data["source_hash"] = result["sha256"]
+        # Built here so the parent only renames and writes it
+        result["payload"] = activity_payload(route_data, os.path.splitext(result["name"])[0])
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+def _summarize_chunk(sources):
+    return [_summarize(*source) for source in sources]
+
+
+def summarize_sources(sources, workers=None):
+    """
+    Parse and summarize track files in a process pool
+
+    Args:
+        sources (list): (container, member, key) tuples from list_sources
+        workers (int): Worker processes (defaults to the number of cores)
+
+    Yields:
+        dict: Result with key, name, sha256, bytes, payload (or None) and error,
+        as soon as its chunk finishes
+    """
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_summarize_chunk, sources[i:i + CHUNK_SIZE])
+                   for i in range(0, len(sources), CHUNK_SIZE)]
+        for future in as_completed(futures):
+            yield from future.result()
+
+
+def load_checkpoint(path):
+    """
+    Load an import checkpoint
+
+    Returns:
+        dict: "members" (source key -> sha256 or error) and "hashes" (imported content hashes)
+    """
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return {"members": {}, "hashes": []}
+    checkpoint.setdefault("members", {})
+    checkpoint.setdefault("hashes", [])
+    return checkpoint
+
+
+def save_checkpoint(path, checkpoint):
+    """Write a checkpoint atomically, so an interrupted run never leaves a broken one"""
+    temp = f"{path}.tmp"
+    with open(temp, "w") as f:
+        json.dump(checkpoint, f)
+    os.replace(temp, path)
+
+
+class JsonlStore:
+    """Local activity store: one activity payload per line"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, payloads):
+        with open(self.path, "a") as f:
+            for payload in payloads:
+                f.write(json.dumps(payload) + "\n")
+        return [(True, None)] * len(payloads)
+
+
+class ApiStore:
+    """Backend activity store, reusing one HTTP connection for every batch"""
+
+    def __init__(self, api_url, token):
+        import requests
+        self.api_url = api_url
+        self.headers = {"Content-Type": "application/json", "Authorization": f"Bearer {token}"}
+        self.session = requests.Session()
+
+    def write(self, payloads):
+        return save_activities(payloads, self.api_url, self.headers, self.session)
+
+
+def import_archive(path, store, checkpoint_path, workers=None, report=None):
+    """
+    Import every track file of an export archive or directory
+
+    Files already recorded in the checkpoint are skipped, duplicates (by
+    content hash, also across earlier runs) are dropped, and activities are
+    written to the store in batches of BATCH_SIZE. The checkpoint is saved
+    after every batch, so an interrupted import resumes where it stopped.
+
+    Args:
+        path (str): .zip export or directory
+        store: JsonlStore or ApiStore
+        checkpoint_path (str): Checkpoint JSON file
+        workers (int): Worker processes (defaults to the number of cores)
+        report (callable): Called with the stats dict after every batch
+
+    Returns:
+        dict: Stats with files, skipped, imported, duplicates, failed, bytes and elapsed seconds
+    """
+    started = time.perf_counter()
+    checkpoint = load_checkpoint(checkpoint_path)
+    members = checkpoint["members"]
+    hashes = set(checkpoint["hashes"])
+    names = read_activity_names(path)
+
+    stats = {"files": 0, "skipped": 0, "imported": 0, "duplicates": 0, "failed": 0, "bytes": 0, "elapsed": 0.0}
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        sources = list_sources(path, scratch_dir)
+        stats["files"] = len(sources)
+        pending = [source for source in sources if source[2] not in members]
+        stats["skipped"] = len(sources) - len(pending)
+
+        batch = []
+
+        def flush():
+            outcomes = store.write([payload for _, _, payload in batch])
+            for (key, sha256, _), (success, error) in zip(batch, outcomes):
+                if success:
+                    members[key] = sha256
+                    hashes.add(sha256)
+                    stats["imported"] += 1
+                else:
+                    # Left out of the checkpoint so the next run retries it
+                    print(f"Error saving {key}: {error}", file=sys.stderr)
+                    stats["failed"] += 1
+            batch.clear()
+            checkpoint["hashes"] = sorted(hashes)
+            save_checkpoint(checkpoint_path, checkpoint)
+            stats["elapsed"] = time.perf_counter() - started
+            if report:
+                report(stats)
+
+        queued = set()
+        for result in summarize_sources(pending, workers):
+            key = result["key"]
+            stats["bytes"] += result["bytes"]
+            if result["error"]:
+                print(f"Error importing {key}: {result['error']}", file=sys.stderr)
+                stats["failed"] += 1
+                members[key] = "error: " + result["error"]
+                continue
+            if result["sha256"] in hashes or result["sha256"] in queued:
+                stats["duplicates"] += 1
+                members[key] = result["sha256"]
+                continue
+
+            payload = result["payload"]
+            info = names.get(result["name"], {})
+            if info.get("name"):
+                payload["name"] = info["name"]
+            if info.get("date"):
+                payload["routeData"]["export_date"] = info["date"]
+            queued.add(result["sha256"])
+            batch.append((key, result["sha256"], payload))
+            if len(batch) >= BATCH_SIZE:
+                flush()
+        flush()
+
+    return stats
+
+
+def format_report(stats):
+    """One-line throughput summary of an import"""
+    elapsed = max(stats["elapsed"], 1e-9)
+    processed = stats["imported"] + stats["duplicates"] + stats["failed"]
+    return (f"{processed}/{stats['files'] - stats['skipped']} files in {elapsed:.1f} s "
+            f"({processed / elapsed:.1f} files/s, {stats['bytes'] / elapsed / 1e6:.1f} MB/s): "
+            f"{stats['imported']} imported, {stats['duplicates']} duplicates, {stats['failed']} failed, "
+            f"{stats['skipped']} already done")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import a Strava or Garmin export of past activities")
+    parser.add_argument("archive", help="Export .zip or an unpacked export directory")
+    parser.add_argument("-o", "--output", default=None,
+                        help="JSONL file to write activities to instead of the backend")
+    parser.add_argument("--api-url", default=os.environ.get("SMARTRUNNING_API_URL", DEFAULT_API_URL),
+                        help="Backend API URL")
+    parser.add_argument("--token", default=os.environ.get("SMARTRUNNING_TOKEN"),
+                        help="Backend auth token (default: SMARTRUNNING_TOKEN)")
+    parser.add_argument("--checkpoint", default=None,
+                        help="Checkpoint file for resuming (default: <archive>.import.json)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: number of cores)")
+    args = parser.parse_args(argv)
+
+    if args.output:
+        store = JsonlStore(args.output)
+    elif args.token:
+        store = ApiStore(args.api_url, args.token)
+    else:
+        parser.error("give --output, or --token (or SMARTRUNNING_TOKEN) to import into the backend")
+
+    checkpoint_path = args.checkpoint or f"{args.archive.rstrip(os.sep)}.import.json"
+    # The report runs after every batch, the last time once everything is written
+    stats = import_archive(args.archive, store, checkpoint_path, args.workers,
+                           report=lambda stats: print(format_report(stats), file=sys.stderr))
+    return 1 if stats["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,330 @@
+import os
+import json
+import uuid
+import hashlib
+import datetime
+import threading
+
+from route_keys import activity_key
+from training_load import activity_day
+
+# Where per-user goals and period totals are persisted between runs
+GOALS_CACHE_DIR = os.environ.get(
+    "SMARTRUNNING_GOALS_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".goals_cache")
+)
+
+# Periods goals can cover
+GOAL_PERIODS = ("week", "month", "year")
+
+# What a goal counts: metric -> (index in a period total, unit)
+GOAL_METRICS = {"distance": (0, "km"), "time": (1, "min"), "count": (2, "runs")}
+
+EPOCH = datetime.date(1970, 1, 1)
+
+# In-memory goal state by user
+_goals = {}
+_goals_lock = threading.Lock()
+
+
+def period_key(day, period):
+    """
+    Key of the week, month or year a day falls in
+
+    Args:
+        day (int): Days since 1970-01-01
+        period (str): "week" (ISO week), "month" or "year"
+
+    Returns:
+        str: e.g. "2024-W18", "2024-05" or "2024"
+    """
+    date = EPOCH + datetime.timedelta(days=day)
+    if period == "week":
+        year, week, _ = date.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == "month":
+        return f"{date.year}-{date.month:02d}"
+    return str(date.year)
+
+
+def today_day():
+    return (datetime.date.today() - EPOCH).days
+
+
+def goals_path(user_key):
+    """Get the on-disk path of a user's goals"""
+    name = hashlib.sha1(str(user_key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(GOALS_CACHE_DIR, f"goals_{name}.json")
+
+
+def _empty_goals(user_key):
+    return {"user": user_key, "goals": [], "totals": {period: {} for period in GOAL_PERIODS},
+            "activities": {}, "days": {}, "longest": 0, "lock": threading.Lock()}
+
+
+def load_goals(user_key):
+    """
+    Get a user's goals and period totals from memory or disk
+
+    Args:
+        user_key (str): User id
+
+    Returns:
+        dict: State with goals, per-period totals [km, minutes, runs], the contribution
+        of each activity, runs per day and the longest day streak
+    """
+    with _goals_lock:
+        if user_key in _goals:
+            return _goals[user_key]
+
+    state = _empty_goals(user_key)
+    try:
+        with open(goals_path(user_key)) as f:
+            saved = json.load(f)
+        for name in ("goals", "totals", "activities"):
+            state[name] = saved.get(name, state[name])
+        state["days"] = {int(day): count for day, count in saved.get("days", {}).items()}
+        state["longest"] = saved.get("longest")
+    except (OSError, ValueError):
+        pass
+
+    with _goals_lock:
+        return _goals.setdefault(user_key, state)
+
+
+def save_goals(state):
+    """Persist goals and period totals as JSON"""
+    os.makedirs(GOALS_CACHE_DIR, exist_ok=True)
+    path = goals_path(state["user"])
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({name: state[name] for name in ("goals", "totals", "activities", "days", "longest")}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _save(state):
+    try:
+        save_goals(state)
+    except OSError as e:
+        print(f"Warning: could not persist goals: {e}")
+
+
+def add_goal(state, period, metric, target):
+    """
+    Add a goal
+
+    Args:
+        state (dict): State from load_goals
+        period (str): One of GOAL_PERIODS
+        metric (str): One of GOAL_METRICS
+        target (float): Target in the metric's unit
+
+    Returns:
+        dict: The goal
+
+    Raises:
+        ValueError: If the period, metric or target is invalid
+    """
+    if period not in GOAL_PERIODS or metric not in GOAL_METRICS or not target > 0:
+        raise ValueError(f"Invalid goal: {period} {metric} {target}")
+    goal = {"id": uuid.uuid4().hex[:8], "period": period, "metric": metric, "target": float(target)}
+    with state["lock"]:
+        state["goals"].append(goal)
+        _save(state)
+    return goal
+
+
+def remove_goal(state, goal_id):
+    with state["lock"]:
+        state["goals"] = [goal for goal in state["goals"] if goal["id"] != goal_id]
+        _save(state)
+
+
+def _contribution(activity):
+    """What an activity adds to its periods, or None if it has no date"""
+    day = activity_day(activity)
+    if day is None:
+        return None
+    return {"stamp": activity.get("updatedAt", ""), "day": day,
+            "distance": float(activity.get("distance") or 0), "minutes": float(activity.get("duration") or 0) / 60}
+
+
+def _apply(state, contribution, sign):
+    for period in GOAL_PERIODS:
+        totals = state["totals"][period]
+        key = period_key(contribution["day"], period)
+        total = totals.setdefault(key, [0.0, 0.0, 0])
+        total[0] = round(total[0] + sign * contribution["distance"], 3)
+        total[1] = round(total[1] + sign * contribution["minutes"], 3)
+        total[2] += sign
+        if total[2] <= 0:
+            del totals[key]
+    days = state["days"]
+    day = contribution["day"]
+    days[day] = days.get(day, 0) + sign
+    if days[day] <= 0:
+        # A removed day may split the longest streak; it is recounted when next needed
+        del days[day]
+        state["longest"] = None
+    elif days[day] == 1 and state["longest"] is not None:
+        # A new day can only join the streaks on either side of it
+        before = after = 0
+        while day - before - 1 in days:
+            before += 1
+        while day + after + 1 in days:
+            after += 1
+        state["longest"] = max(state["longest"], before + 1 + after)
+
+
+def record_activity(state, activity, save=True):
+    """
+    Add a saved or updated activity to the period totals
+
+    An activity seen before first has its old contribution taken back, so
+    only the periods it was and is in are touched.
+
+    Args:
+        state (dict): State from load_goals
+        activity (dict): Activity from the API
+        save (bool): Persist the state afterwards
+
+    Returns:
+        bool: Whether the totals changed
+    """
+    key = activity_key(activity)
+    contribution = _contribution(activity)
+    with state["lock"]:
+        old = state["activities"].get(key)
+        if old == contribution:
+            return False
+        if old is not None:
+            _apply(state, old, -1)
+            del state["activities"][key]
+        if contribution is not None:
+            _apply(state, contribution, 1)
+            state["activities"][key] = contribution
+        if save:
+            _save(state)
+    return True
+
+
+def forget_activity(state, key, save=True):
+    """
+    Take a deleted activity out of the period totals
+
+    Args:
+        state (dict): State from load_goals
+        key (str): Activity key (see route_keys.activity_key)
+        save (bool): Persist the state afterwards
+
+    Returns:
+        bool: Whether the totals changed
+    """
+    with state["lock"]:
+        old = state["activities"].pop(key, None)
+        if old is None:
+            return False
+        _apply(state, old, -1)
+        if save:
+            _save(state)
+    return True
+
+
+def sync_activities(state, activities):
+    """
+    Apply activities saved, updated or deleted elsewhere since the last sync
+
+    Activities are compared by key and update time; only the ones that
+    differ change the totals.
+
+    Args:
+        state (dict): State from load_goals
+        activities (list): All of the user's activity dicts
+
+    Returns:
+        int: Number of activities added, updated or removed
+    """
+    seen = set()
+    changed = 0
+    for activity in activities:
+        key = activity_key(activity)
+        seen.add(key)
+        known = state["activities"].get(key)
+        if known is None or known["stamp"] != activity.get("updatedAt", ""):
+            changed += record_activity(state, activity, save=False)
+    for key in [key for key in state["activities"] if key not in seen]:
+        changed += forget_activity(state, key, save=False)
+    if changed:
+        with state["lock"]:
+            _save(state)
+    return changed
+
+
+def goal_progress(state, today=None):
+    """
+    Progress of every goal in the current period
+
+    Reads one pre-aggregated total per goal.
+
+    Args:
+        state (dict): State from load_goals
+        today (int): Day number (defaults to today)
+
+    Returns:
+        list: Dicts with goal, period (key), value, target, unit and fraction
+    """
+    today = today_day() if today is None else today
+    progress = []
+    for goal in state["goals"]:
+        key = period_key(today, goal["period"])
+        index, unit = GOAL_METRICS[goal["metric"]]
+        value = state["totals"][goal["period"]].get(key, [0.0, 0.0, 0])[index]
+        progress.append({"goal": goal, "period": key, "value": value, "target": goal["target"],
+                         "unit": unit, "fraction": min(value / goal["target"], 1.0)})
+    return progress
+
+
+def streaks(state, today=None):
+    """
+    Current and longest running streaks
+
+    The current streaks walk back over the days with a run, so the cost
+    is the streak length, not the history length; the longest streak is
+    kept up to date as runs are recorded. A streak still counts until a
+    day without a run has fully passed.
+
+    Args:
+        state (dict): State from load_goals
+        today (int): Day number (defaults to today)
+
+    Returns:
+        dict: current_days, longest_days and current_weeks
+    """
+    today = today_day() if today is None else today
+    days = state["days"]
+
+    day = today if today in days else today - 1
+    current = 0
+    while day in days:
+        current += 1
+        day -= 1
+
+    if state["longest"] is None:
+        longest = 0
+        for day in days:
+            if day - 1 not in days:
+                length = 1
+                while day + length in days:
+                    length += 1
+                longest = max(longest, length)
+        state["longest"] = longest
+
+    weeks = state["totals"]["week"]
+    week_start = today - (EPOCH + datetime.timedelta(days=today)).weekday()
+    if period_key(week_start, "week") not in weeks:
+        week_start -= 7
+    current_weeks = 0
+    while period_key(week_start, "week") in weeks:
+        current_weeks += 1
+        week_start -= 7
+
+    return {"current_days": current, "longest_days": state["longest"], "current_weeks": current_weeks}
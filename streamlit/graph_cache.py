@@ -0,0 +1,329 @@
+import os
+import math
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import osmnx as ox
+    OSMNX_AVAILABLE = True
+except ImportError:
+    OSMNX_AVAILABLE = False
+
+from spatial_index import GridIndex
+from single_flight import SingleFlight
+
+# Where graph tiles are persisted between runs
+GRAPH_CACHE_DIR = os.environ.get(
+    "SMARTRUNNING_GRAPH_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".graph_cache")
+)
+
+# Start points are bucketed into square tiles of this size (~2 km at Danish latitudes)
+TILE_SIZE_DEG = 0.02
+
+# Download radii (km) a tile can be built with. A loop of length L never gets
+# further than L/2 from its start, so requests share the smallest bucket that fits.
+RADIUS_BUCKETS_KM = (2.5, 5.0, 7.5, 10.0, 15.0, 25.0)
+
+# Number of tiles kept in memory at once
+MAX_TILES_IN_MEMORY = 8
+
+# Compact surface codes stored per edge
+SURFACE_CODES = {"unknown": 0, "paved": 1, "unpaved": 2}
+
+PAVED_SURFACES = {'paved', 'asphalt', 'concrete', 'concrete:plates', 'concrete:lanes',
+                  'paving_stones', 'sett', 'cobblestone', 'metal', 'wood'}
+UNPAVED_SURFACES = {'unpaved', 'gravel', 'fine_gravel', 'compacted', 'dirt', 'earth',
+                    'ground', 'grass', 'sand', 'mud', 'pebblestone', 'woodchips'}
+
+_tiles = OrderedDict()
+_tiles_lock = threading.Lock()
+
+# Concurrent requests for the same cold tile share one load or download
+_tile_flight = SingleFlight()
+
+
+def surface_code(surface):
+    """
+    Map an OSM surface tag to one of the compact SURFACE_CODES
+
+    Args:
+        surface (str or list): Value of the edge's surface tag
+
+    Returns:
+        int: Surface code
+    """
+    if isinstance(surface, list):
+        surface = surface[0] if surface else None
+    if surface in PAVED_SURFACES:
+        return SURFACE_CODES["paved"]
+    if surface in UNPAVED_SURFACES:
+        return SURFACE_CODES["unpaved"]
+    return SURFACE_CODES["unknown"]
+
+
+def tile_key(start_point, distance, surface_preference="Any"):
+    """
+    Get the cache key of the graph tile that covers a route request
+
+    Args:
+        start_point (tuple): (lat, lon) of the start
+        distance (float): Desired route distance in kilometers
+        surface_preference (str): Preferred surface type
+
+    Returns:
+        tuple: (lat_cell, lon_cell, radius_km, surface_preference)
+    """
+    lat_cell = int(math.floor(start_point[0] / TILE_SIZE_DEG))
+    lon_cell = int(math.floor(start_point[1] / TILE_SIZE_DEG))
+
+    # The start can sit anywhere inside the tile, so add the tile's half diagonal
+    half_diagonal_km = TILE_SIZE_DEG * 111.32 / math.sqrt(2)
+    needed_km = distance / 2 + half_diagonal_km
+    radius_km = next((r for r in RADIUS_BUCKETS_KM if r >= needed_km), RADIUS_BUCKETS_KM[-1])
+
+    return (lat_cell, lon_cell, radius_km, surface_preference)
+
+
+def tile_center(key):
+    """Get the (lat, lon) center of a tile from its key"""
+    return ((key[0] + 0.5) * TILE_SIZE_DEG, (key[1] + 0.5) * TILE_SIZE_DEG)
+
+
+def tile_path(key):
+    """Get the on-disk path of a tile"""
+    name = f"tile_{key[0]}_{key[1]}_{key[2]:g}km_{key[3].lower()}.npz"
+    return os.path.join(GRAPH_CACHE_DIR, name)
+
+
+def build_graph_arrays(G, handle_missing_surface=None):
+    """
+    Flatten an OSMnx graph into compact NumPy arrays
+
+    The network is treated as undirected (runners can use a street in both
+    directions). Adjacency is stored in CSR form so that searches can run
+    without NetworkX.
+
+    Args:
+        G (networkx.MultiDiGraph): Street network from OSMnx
+        handle_missing_surface (callable): Fills in missing surface tags on edge data
+
+    Returns:
+        dict: Node, edge, geometry and adjacency arrays
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required to build graph arrays")
+
+    node_ids = np.fromiter(G.nodes, dtype=np.int64, count=G.number_of_nodes())
+    node_index = {node: i for i, node in enumerate(node_ids.tolist())}
+    node_lat = np.array([G.nodes[n]['y'] for n in node_ids.tolist()], dtype=np.float64)
+    node_lon = np.array([G.nodes[n]['x'] for n in node_ids.tolist()], dtype=np.float64)
+    # NaN where the graph has no elevation (none is added to downloaded graphs yet)
+    node_elevation = np.array([G.nodes[n].get('elevation', np.nan) for n in node_ids.tolist()],
+                              dtype=np.float32)
+
+    edge_u, edge_v, edge_length, edge_surface = [], [], [], []
+    geom_lat, geom_lon, geom_ptr = [], [], [0]
+    seen = set()
+
+    for u, v, key, data in G.edges(keys=True, data=True):
+        # Drop the reverse twin of two-way streets
+        pair = (min(u, v), max(u, v), key)
+        if pair in seen:
+            continue
+        seen.add(pair)
+
+        if handle_missing_surface is not None:
+            data = handle_missing_surface(dict(data))
+
+        edge_u.append(node_index[u])
+        edge_v.append(node_index[v])
+        edge_length.append(float(data.get('length', 0.0)))
+        edge_surface.append(surface_code(data.get('surface')))
+
+        if 'geometry' in data:
+            coords = list(data['geometry'].coords)
+            geom_lon.extend(c[0] for c in coords)
+            geom_lat.extend(c[1] for c in coords)
+        else:
+            geom_lat.extend((G.nodes[u]['y'], G.nodes[v]['y']))
+            geom_lon.extend((G.nodes[u]['x'], G.nodes[v]['x']))
+        geom_ptr.append(len(geom_lat))
+
+    edge_u = np.array(edge_u, dtype=np.int32)
+    edge_v = np.array(edge_v, dtype=np.int32)
+
+    arrays = {
+        "node_ids": node_ids,
+        "node_lat": node_lat,
+        "node_lon": node_lon,
+        "node_elevation": node_elevation,
+        "edge_u": edge_u,
+        "edge_v": edge_v,
+        "edge_length": np.array(edge_length, dtype=np.float32),
+        "edge_surface": np.array(edge_surface, dtype=np.uint8),
+        "geom_ptr": np.array(geom_ptr, dtype=np.int64),
+        "geom_lat": np.array(geom_lat, dtype=np.float64),
+        "geom_lon": np.array(geom_lon, dtype=np.float64),
+    }
+    arrays.update(build_adjacency(len(node_ids), edge_u, edge_v))
+    return arrays
+
+
+def build_adjacency(num_nodes, edge_u, edge_v):
+    """
+    Build undirected CSR adjacency from edge endpoint arrays
+
+    Args:
+        num_nodes (int): Number of nodes
+        edge_u (np.ndarray): Edge source node indices
+        edge_v (np.ndarray): Edge target node indices
+
+    Returns:
+        dict: adj_ptr, adj_node and adj_edge arrays
+    """
+    edge_ids = np.arange(len(edge_u), dtype=np.int32)
+    src = np.concatenate([edge_u, edge_v])
+    dst = np.concatenate([edge_v, edge_u])
+    eid = np.concatenate([edge_ids, edge_ids])
+
+    order = np.argsort(src, kind='stable')
+    adj_ptr = np.zeros(num_nodes + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=num_nodes), out=adj_ptr[1:])
+
+    return {
+        "adj_ptr": adj_ptr,
+        "adj_node": dst[order].astype(np.int32),
+        "adj_edge": eid[order].astype(np.int32),
+    }
+
+
+def _download_graph(key, highway_filter):
+    """Download the street network for a tile with OSMnx"""
+    if not OSMNX_AVAILABLE:
+        raise ImportError("osmnx package is required to download street networks")
+
+    custom_filter = None
+    if highway_filter:
+        custom_filter = ''.join(f'["{tag}"~"{"|".join(values)}"]' for tag, values in highway_filter.items())
+
+    center = tile_center(key)
+    print(f"Downloading street network for tile {key} around {center}")
+    return ox.graph_from_point(center, dist=key[2] * 1000, custom_filter=custom_filter,
+                               network_type="walk", simplify=True)
+
+
+def _save_tile(tile):
+    os.makedirs(GRAPH_CACHE_DIR, exist_ok=True)
+    payload = dict(tile["arrays"])
+    payload.update({f"index_{name}": value for name, value in tile["index"].to_arrays().items()})
+    path = tile_path(tile["key"])
+    # Other processes may build the same tile; each writes its own file and
+    # swaps it in whole, so readers never see a partly written one
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **payload)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _load_tile(key):
+    path = tile_path(key)
+    if not os.path.exists(path):
+        return None
+
+    with np.load(path) as data:
+        arrays = {name: data[name] for name in data.files if not name.startswith("index_")}
+        index_arrays = {name[len("index_"):]: data[name] for name in data.files if name.startswith("index_")}
+    return {"key": key, "arrays": arrays, "index": GridIndex.from_arrays(index_arrays)}
+
+
+def load_graph_tile(start_point, distance, surface_preference="Any",
+                    highway_filter=None, handle_missing_surface=None):
+    """
+    Get the graph tile covering a route request
+
+    Tiles are looked up in memory first, then on disk, and are only
+    downloaded when neither has them. Concurrent callers asking for the same
+    cold tile wait for a single load. The spatial index is built once when
+    the tile is created and stored alongside its arrays.
+
+    Args:
+        start_point (tuple): (lat, lon) of the start
+        distance (float): Desired route distance in kilometers
+        surface_preference (str): Preferred surface type
+        highway_filter (dict): OSM highway filter from get_surface_filter
+        handle_missing_surface (callable): Fills in missing surface tags on edge data
+
+    Returns:
+        dict: Tile with "key", "arrays" and "index"
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required to load graph tiles")
+
+    key = tile_key(start_point, distance, surface_preference)
+
+    with _tiles_lock:
+        if key in _tiles:
+            _tiles.move_to_end(key)
+            return _tiles[key]
+
+    return _tile_flight.do(key, _load_or_build_tile, key, highway_filter, handle_missing_surface)
+
+
+def _load_or_build_tile(key, highway_filter, handle_missing_surface):
+    """Read a tile from disk, or download and build it, and keep it in memory"""
+    tile = _load_tile(key)
+    if tile is None:
+        G = _download_graph(key, highway_filter)
+        arrays = build_graph_arrays(G, handle_missing_surface)
+        index = GridIndex.build(arrays)
+        tile = {"key": key, "arrays": arrays, "index": index}
+        try:
+            _save_tile(tile)
+        except OSError as e:
+            print(f"Warning: could not persist graph tile {key}: {e}")
+
+    with _tiles_lock:
+        _tiles[key] = tile
+        _tiles.move_to_end(key)
+        while len(_tiles) > MAX_TILES_IN_MEMORY:
+            _tiles.popitem(last=False)
+
+    return tile
+
+
+def start_nodes(tile, lats, lons):
+    """
+    Snap start points to the closer end of their nearest street
+
+    Route generation and the loop library both snap with this, so a start
+    point always maps to the same node.
+
+    Args:
+        tile (dict): Tile from load_graph_tile
+        lats (array-like): Start latitudes
+        lons (array-like): Start longitudes
+
+    Returns:
+        np.ndarray: Tile node index per start point
+    """
+    arrays = tile["arrays"]
+    edge_ids, offsets, _ = tile["index"].nearest_edges(lats, lons)
+    closer_to_u = offsets <= arrays["edge_length"][edge_ids] / 2
+    return np.where(closer_to_u, arrays["edge_u"][edge_ids], arrays["edge_v"][edge_ids])
+
+
+def clear_tile_cache():
+    """Drop all tiles held in memory (on-disk tiles are kept)"""
+    with _tiles_lock:
+        _tiles.clear()
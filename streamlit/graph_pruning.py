@@ -0,0 +1,195 @@
+import heapq
+import time
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from graph_cache import build_adjacency
+
+
+def adjacency_lists(graph, edge_cost=None):
+    """
+    Convert a graph's CSR arrays to plain lists for fast pure-Python searches
+
+    Args:
+        graph (dict): Graph with adj_ptr, adj_node, adj_edge and edge_length arrays
+        edge_cost (np.ndarray): Optional per-edge cost (defaults to edge_length)
+
+    Returns:
+        tuple: (ptr, node, edge, cost, length) lists
+    """
+    length = graph["edge_length"]
+    cost = length if edge_cost is None else edge_cost
+    return (graph["adj_ptr"].tolist(), graph["adj_node"].tolist(), graph["adj_edge"].tolist(),
+            np.asarray(cost, dtype=np.float64).tolist(), np.asarray(length, dtype=np.float64).tolist())
+
+
+def bounded_dijkstra(adjacency, source, cutoff=float("inf"), deadline=None):
+    """
+    Single-source Dijkstra that stops expanding at a cost cutoff
+
+    When a deadline is given and passes, the search stops early. Nodes that
+    were only reached (not settled) keep a valid but possibly longer path.
+
+    Args:
+        adjacency (tuple): Lists from adjacency_lists
+        source (int): Source node index
+        cutoff (float): Nodes with a larger cost are left unreached
+        deadline (float): time.monotonic() value at which to stop
+
+    Returns:
+        tuple: (cost, length, pred_edge, pred_node) arrays; unreached nodes
+        have infinite cost and -1 predecessors
+    """
+    ptr, nbr, edge, weight, length = adjacency
+    n = len(ptr) - 1
+    inf = float("inf")
+    cost = [inf] * n
+    dist = [inf] * n
+    pred_edge = [-1] * n
+    pred_node = [-1] * n
+    done = [False] * n
+
+    cost[source] = 0.0
+    dist[source] = 0.0
+    heap = [(0.0, source)]
+    pops = 0
+    while heap:
+        c, u = heapq.heappop(heap)
+        if done[u]:
+            continue
+        pops += 1
+        if deadline is not None and pops % 1024 == 0 and time.monotonic() >= deadline:
+            break
+        done[u] = True
+        du = dist[u]
+        for i in range(ptr[u], ptr[u + 1]):
+            v = nbr[i]
+            if done[v]:
+                continue
+            e = edge[i]
+            cv = c + weight[e]
+            if cv < cost[v] and cv <= cutoff:
+                cost[v] = cv
+                dist[v] = du + length[e]
+                pred_edge[v] = e
+                pred_node[v] = u
+                heapq.heappush(heap, (cv, v))
+
+    return (np.array(cost), np.array(dist), np.array(pred_edge, dtype=np.int64),
+            np.array(pred_node, dtype=np.int64))
+
+
+def prune_graph(arrays, start_node, distance_m):
+    """
+    Reduce a tile to the part of the network a loop of the given length can use
+
+    1. A bounded Dijkstra from the start keeps only edges (u, v) with
+       d(u) + length + d(v) <= distance_m, i.e. edges that fit in some loop.
+       Everything outside the budget, including disconnected components, is dropped.
+    2. Dead-end spurs are peeled off, since a loop can only enter them and turn back.
+    3. Chains of degree-2 nodes are collapsed into single edges.
+
+    Args:
+        arrays (dict): Graph arrays of a tile
+        start_node (int): Tile node index of the start
+        distance_m (float): Loop length budget in meters
+
+    Returns:
+        dict: Pruned graph with its own CSR adjacency; edge_chain_ptr/edge_chain
+        list the tile edges behind every pruned edge (negative ids are traversed
+        v -> u, stored as ~edge_id)
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required to prune graphs")
+
+    edge_u, edge_v, edge_length = arrays["edge_u"], arrays["edge_v"], arrays["edge_length"]
+    num_nodes = len(arrays["node_lat"])
+
+    # 1. Distance budget
+    _, dist, _, _ = bounded_dijkstra(adjacency_lists(arrays), start_node, cutoff=distance_m / 2)
+    keep = np.isfinite(dist[edge_u]) & np.isfinite(dist[edge_v])
+    keep &= dist[edge_u] + edge_length + dist[edge_v] <= distance_m
+    keep &= edge_u != edge_v
+
+    # 2. Peel dead ends until none are left (the start always stays)
+    while True:
+        degree = np.bincount(edge_u[keep], minlength=num_nodes) + np.bincount(edge_v[keep], minlength=num_nodes)
+        dead_end = degree == 1
+        dead_end[start_node] = False
+        drop = keep & (dead_end[edge_u] | dead_end[edge_v])
+        if not drop.any():
+            break
+        keep &= ~drop
+
+    kept_edges = np.flatnonzero(keep)
+    degree = np.bincount(edge_u[keep], minlength=num_nodes) + np.bincount(edge_v[keep], minlength=num_nodes)
+    junction = (degree > 0) & (degree != 2)
+    junction[start_node] = True
+
+    # 3. Walk from every junction along each kept edge to the next junction
+    local = build_adjacency(num_nodes, edge_u[kept_edges], edge_v[kept_edges])
+    ptr = local["adj_ptr"].tolist()
+    nbr = local["adj_node"].tolist()
+    eid = kept_edges[local["adj_edge"]].tolist()
+    is_junction = junction.tolist()
+    tile_u = edge_u.tolist()
+    lengths = edge_length.tolist()
+
+    visited = set()
+    new_u, new_v, new_length, chain_ptr, chain = [], [], [], [0], []
+    for j in np.flatnonzero(junction).tolist():
+        for i in range(ptr[j], ptr[j + 1]):
+            e = eid[i]
+            if e in visited:
+                continue
+            prev, node, total, steps = j, nbr[i], 0.0, []
+            while True:
+                visited.add(e)
+                steps.append(e if tile_u[e] == prev else ~e)
+                total += lengths[e]
+                if is_junction[node]:
+                    break
+                # Degree-2 node: continue along the other edge
+                a, b = ptr[node], ptr[node] + 1
+                nxt = a if eid[a] != e else b
+                prev, node, e = node, nbr[nxt], eid[nxt]
+            new_u.append(j)
+            new_v.append(node)
+            new_length.append(total)
+            chain.extend(steps)
+            chain_ptr.append(len(chain))
+
+    node_map = np.flatnonzero(junction)
+    remap = np.full(num_nodes, -1, dtype=np.int32)
+    remap[node_map] = np.arange(len(node_map), dtype=np.int32)
+    pruned_u = remap[np.array(new_u, dtype=np.int64)].astype(np.int32)
+    pruned_v = remap[np.array(new_v, dtype=np.int64)].astype(np.int32)
+
+    chain = np.array(chain, dtype=np.int64)
+    chain_ptr = np.array(chain_ptr, dtype=np.int64)
+
+    # Length of each pruned edge per surface code
+    tile_edges = np.where(chain >= 0, chain, ~chain)
+    owner = np.repeat(np.arange(len(new_u)), np.diff(chain_ptr))
+    surface_length = np.zeros((len(new_u), 3))
+    np.add.at(surface_length, (owner, arrays["edge_surface"][tile_edges]), edge_length[tile_edges])
+
+    pruned = {
+        "node_map": node_map,
+        "node_lat": arrays["node_lat"][node_map],
+        "node_lon": arrays["node_lon"][node_map],
+        "node_elevation": arrays["node_elevation"][node_map],
+        "edge_u": pruned_u,
+        "edge_v": pruned_v,
+        "edge_length": np.array(new_length, dtype=np.float64),
+        "edge_surface_length": surface_length,
+        "edge_chain_ptr": chain_ptr,
+        "edge_chain": chain,
+        "start": int(remap[start_node]),
+    }
+    pruned.update(build_adjacency(len(node_map), pruned_u, pruned_v))
+    return pruned
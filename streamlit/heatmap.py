@@ -0,0 +1,375 @@
+import os
+import math
+import zlib
+import base64
+import struct
+import hashlib
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+try:
+    import folium
+    FOLIUM_AVAILABLE = True
+except ImportError:
+    FOLIUM_AVAILABLE = False
+
+from map_render import cached_map, MAP_WIDTH, MAP_HEIGHT
+from route_keys import activity_key
+
+# Where per-user heatmap tiles are persisted between runs
+HEATMAP_CACHE_DIR = os.environ.get(
+    "SMARTRUNNING_HEATMAP_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".heatmap_cache")
+)
+
+# Web-mercator zoom levels the heatmap is binned at
+HEATMAP_ZOOMS = (10, 12, 14)
+
+# Side of a heatmap tile in pixels (same as web map tiles)
+TILE_PIXELS = 256
+
+# Counts are stored as uint16 and saturate here
+MAX_COUNT = 65535
+
+# Largest overlay image side; the most detailed zoom whose tiles fit is used
+MAX_OVERLAY_PIXELS = 2048
+
+_heatmaps = {}
+_heatmaps_lock = threading.Lock()
+
+
+def mercator_pixels(lats, lons, zoom):
+    """
+    Project points to global web-mercator pixel coordinates
+
+    Args:
+        lats (array-like): Latitudes in degrees
+        lons (array-like): Longitudes in degrees
+        zoom (int): Zoom level
+
+    Returns:
+        tuple: (x, y) float arrays, with y growing southwards
+    """
+    scale = TILE_PIXELS * 2 ** zoom
+    lats = np.clip(np.asarray(lats, dtype=np.float64), -85.05112878, 85.05112878)
+    x = (np.asarray(lons, dtype=np.float64) + 180.0) / 360.0 * scale
+    sin_lat = np.sin(np.radians(lats))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+
+def pixel_latlon(x, y, zoom):
+    """Get the (lat, lon) of a global web-mercator pixel coordinate"""
+    scale = TILE_PIXELS * 2 ** zoom
+    lon = x / scale * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale))))
+    return lat, lon
+
+
+def densify(x, y):
+    """
+    Add points along a track so consecutive points are at most one pixel apart
+
+    Without this, sparse tracks show up as dots at high zoom levels.
+
+    Args:
+        x (np.ndarray): Pixel x coordinates of the track
+        y (np.ndarray): Pixel y coordinates of the track
+
+    Returns:
+        tuple: Densified (x, y) arrays
+    """
+    if len(x) < 2:
+        return x, y
+    steps = np.maximum(np.ceil(np.hypot(np.diff(x), np.diff(y))).astype(np.int64), 1)
+    seg = np.repeat(np.arange(len(steps)), steps)
+    # Fraction of the way along each segment, restarting at 0 for every segment
+    t = (np.arange(len(seg)) - np.repeat(np.cumsum(steps) - steps, steps)) / steps[seg]
+    dense_x = np.append(x[seg] + (x[seg + 1] - x[seg]) * t, x[-1])
+    dense_y = np.append(y[seg] + (y[seg + 1] - y[seg]) * t, y[-1])
+    return dense_x, dense_y
+
+
+def bin_points(x, y, zoom):
+    """
+    Count points per pixel, split into tiles
+
+    The 2D histogram is computed in one pass over all points by counting
+    combined (tile, pixel) indices.
+
+    Args:
+        x (np.ndarray): Global pixel x coordinates
+        y (np.ndarray): Global pixel y coordinates
+        zoom (int): Zoom level of the coordinates
+
+    Returns:
+        dict: (tile_x, tile_y) -> (TILE_PIXELS, TILE_PIXELS) uint16 count array
+    """
+    if len(x) == 0:
+        return {}
+    size = TILE_PIXELS * 2 ** zoom
+    px = np.clip(x.astype(np.int64), 0, size - 1)
+    py = np.clip(y.astype(np.int64), 0, size - 1)
+
+    tiles_per_side = 2 ** zoom
+    tile = (px // TILE_PIXELS) * tiles_per_side + py // TILE_PIXELS
+    local = (py % TILE_PIXELS) * TILE_PIXELS + px % TILE_PIXELS
+    cells, counts = np.unique(tile * TILE_PIXELS * TILE_PIXELS + local, return_counts=True)
+
+    cell_tiles = cells // (TILE_PIXELS * TILE_PIXELS)
+    starts = np.flatnonzero(np.r_[True, cell_tiles[1:] != cell_tiles[:-1]])
+    ends = np.r_[starts[1:], len(cells)]
+
+    tiles = {}
+    for start, end in zip(starts.tolist(), ends.tolist()):
+        grid = np.zeros(TILE_PIXELS * TILE_PIXELS, dtype=np.uint16)
+        grid[cells[start:end] % (TILE_PIXELS * TILE_PIXELS)] = np.minimum(counts[start:end], MAX_COUNT)
+        tile_id = int(cell_tiles[start])
+        tiles[(tile_id // tiles_per_side, tile_id % tiles_per_side)] = grid.reshape(TILE_PIXELS, TILE_PIXELS)
+    return tiles
+
+
+def heatmap_path(user_key):
+    """Get the on-disk path of a user's heatmap"""
+    name = hashlib.sha1(str(user_key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(HEATMAP_CACHE_DIR, f"heatmap_{name}.npz")
+
+
+def _empty_heatmap(user_key):
+    return {"user": user_key, "activities": set(), "tiles": {zoom: {} for zoom in HEATMAP_ZOOMS},
+            "version": 0, "lock": threading.Lock()}
+
+
+def load_heatmap(user_key):
+    """
+    Get a user's heatmap from memory or disk (empty if there is none yet)
+
+    Args:
+        user_key (str): User id
+
+    Returns:
+        dict: Heatmap with activities, tiles per zoom and a version counter
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required for heatmaps")
+
+    with _heatmaps_lock:
+        if user_key in _heatmaps:
+            return _heatmaps[user_key]
+
+    heatmap = _empty_heatmap(user_key)
+    path = heatmap_path(user_key)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            heatmap["activities"] = set(data["activities"].tolist())
+            for name in data.files:
+                if name.startswith("z"):
+                    zoom, tile_x, tile_y = (int(part) for part in name[1:].split("_"))
+                    if zoom in heatmap["tiles"]:
+                        heatmap["tiles"][zoom][(tile_x, tile_y)] = data[name]
+        heatmap["version"] = 1
+
+    with _heatmaps_lock:
+        return _heatmaps.setdefault(user_key, heatmap)
+
+
+def save_heatmap(heatmap):
+    """Persist a heatmap's tiles as arrays"""
+    os.makedirs(HEATMAP_CACHE_DIR, exist_ok=True)
+    payload = {"activities": np.array(sorted(heatmap["activities"]), dtype=str)}
+    for zoom, tiles in heatmap["tiles"].items():
+        for (tile_x, tile_y), grid in tiles.items():
+            payload[f"z{zoom}_{tile_x}_{tile_y}"] = grid
+    np.savez_compressed(heatmap_path(heatmap["user"]), **payload)
+
+
+def update_heatmap(heatmap, activities):
+    """
+    Add activities that are not in the heatmap yet
+
+    Only new tracks are binned. If an activity was deleted, the heatmap is
+    rebuilt from scratch, since its counts cannot be told apart afterwards.
+
+    Args:
+        heatmap (dict): Heatmap from load_heatmap
+        activities (list): All of the user's activity dicts
+
+    Returns:
+        int: Number of activities binned
+    """
+    tracks = {}
+    for activity in activities:
+        coords = activity.get('routeData', {}).get('coordinates')
+        if coords:
+            tracks[activity_key(activity)] = coords
+
+    with heatmap["lock"]:
+        if not heatmap["activities"] <= set(tracks):
+            heatmap["activities"] = set()
+            heatmap["tiles"] = {zoom: {} for zoom in HEATMAP_ZOOMS}
+
+        new = [key for key in tracks if key not in heatmap["activities"]]
+        if not new:
+            return 0
+
+        for zoom in HEATMAP_ZOOMS:
+            xs, ys = [], []
+            for key in new:
+                coords = np.asarray(tracks[key], dtype=np.float64).reshape(-1, 2)
+                x, y = densify(*mercator_pixels(coords[:, 0], coords[:, 1], zoom))
+                xs.append(x)
+                ys.append(y)
+            zoom_tiles = heatmap["tiles"][zoom]
+            for tile, grid in bin_points(np.concatenate(xs), np.concatenate(ys), zoom).items():
+                if tile in zoom_tiles:
+                    total = zoom_tiles[tile].astype(np.uint32) + grid
+                    zoom_tiles[tile] = np.minimum(total, MAX_COUNT).astype(np.uint16)
+                else:
+                    zoom_tiles[tile] = grid
+
+        heatmap["activities"].update(new)
+        heatmap["version"] += 1
+        try:
+            save_heatmap(heatmap)
+        except OSError as e:
+            print(f"Warning: could not persist heatmap: {e}")
+    return len(new)
+
+
+def colorize(counts):
+    """
+    Turn pixel counts into RGBA colors on a log scale (transparent where empty)
+
+    Args:
+        counts (np.ndarray): 2D count array
+
+    Returns:
+        np.ndarray: (h, w, 4) uint8 image
+    """
+    peak = counts.max() if counts.size else 0
+    t = np.log1p(counts.astype(np.float32)) / np.log1p(max(float(peak), 1.0))
+    rgba = np.empty(counts.shape + (4,), dtype=np.uint8)
+    # Dark red through yellow to white as runs pile up
+    rgba[..., 0] = np.clip(0.4 + t * 2, 0, 1) * 255
+    rgba[..., 1] = np.clip(t * 2 - 0.6, 0, 1) * 255
+    rgba[..., 2] = np.clip(t * 3 - 2, 0, 1) * 255
+    rgba[..., 3] = np.where(counts > 0, 90 + t * 165, 0)
+    return rgba
+
+
+def encode_png(rgba):
+    """Encode an (h, w, 4) uint8 image as PNG bytes"""
+    height, width = rgba.shape[:2]
+    # Every scanline starts with filter type 0 (none)
+    raw = np.concatenate([np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, width * 4)], axis=1)
+
+    def chunk(kind, data):
+        return (struct.pack(">I", len(data)) + kind + data +
+                struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff))
+
+    return (b"\x89PNG\r\n\x1a\n" +
+            chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)) +
+            chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)) +
+            chunk(b"IEND", b""))
+
+
+def heatmap_overlay(heatmap, max_pixels=MAX_OVERLAY_PIXELS):
+    """
+    Compose a heatmap's tiles into one image covering all of its data
+
+    The most detailed zoom level whose tiles fit in max_pixels is used. When
+    even the coarsest level does not fit (runs far apart), each tile is
+    block-summed by the smallest power of two that does, so the image never
+    exceeds max_pixels on a side.
+
+    Args:
+        heatmap (dict): Heatmap from load_heatmap
+        max_pixels (int): Largest image width or height
+
+    Returns:
+        tuple or None: (png bytes, [[south, west], [north, east]]), or None if the heatmap is empty
+    """
+    with heatmap["lock"]:
+        chosen = None
+        for zoom in sorted(HEATMAP_ZOOMS, reverse=True):
+            tiles = heatmap["tiles"][zoom]
+            if not tiles:
+                continue
+            xs = [tile[0] for tile in tiles]
+            ys = [tile[1] for tile in tiles]
+            span_x = (max(xs) - min(xs) + 1) * TILE_PIXELS
+            span_y = (max(ys) - min(ys) + 1) * TILE_PIXELS
+            chosen = (zoom, dict(tiles), min(xs), min(ys), span_x, span_y)
+            if span_x <= max_pixels and span_y <= max_pixels:
+                break
+        if chosen is None:
+            return None
+
+    zoom, tiles, min_x, min_y, span_x, span_y = chosen
+    factor = 1
+    while -(-max(span_x, span_y) // factor) > max_pixels:
+        factor *= 2
+    width, height = -(-span_x // factor), -(-span_y // factor)
+    counts = np.zeros((height, width), dtype=np.uint64)
+    for (tile_x, tile_y), grid in tiles.items():
+        if factor <= TILE_PIXELS:
+            side = TILE_PIXELS // factor
+            block = grid.reshape(side, factor, side, factor).sum(axis=(1, 3), dtype=np.uint64)
+            top = (tile_y - min_y) * side
+            left = (tile_x - min_x) * side
+            counts[top:top + side, left:left + side] += block
+        else:
+            # Several whole tiles share one pixel
+            per_pixel = factor // TILE_PIXELS
+            counts[(tile_y - min_y) // per_pixel, (tile_x - min_x) // per_pixel] += grid.sum(dtype=np.uint64)
+
+    north, west = pixel_latlon(min_x * TILE_PIXELS, min_y * TILE_PIXELS, zoom)
+    south, east = pixel_latlon(min_x * TILE_PIXELS + width * factor, min_y * TILE_PIXELS + height * factor, zoom)
+    return encode_png(colorize(counts)), [[south, west], [north, east]]
+
+
+def heatmap_map_html(heatmap, width=MAP_WIDTH, height=MAP_HEIGHT):
+    """
+    Get the HTML of a map with the heatmap as an image overlay
+
+    The map is cached per heatmap version, so redraws cost the same however
+    many points the heatmap holds.
+
+    Args:
+        heatmap (dict): Heatmap from load_heatmap
+        width (int): Map width in pixels
+        height (int): Map height in pixels
+
+    Returns:
+        str or None: Map HTML, or None if the heatmap is empty
+
+    Raises:
+        ImportError: If folium is not installed
+    """
+    if not FOLIUM_AVAILABLE:
+        raise ImportError("folium package is required to draw the heatmap")
+
+    key = ("heatmap", heatmap["user"], heatmap["version"], width, height)
+    return cached_map(key, _render_heatmap_map, heatmap, height)
+
+
+def _render_heatmap_map(heatmap, height):
+    overlay = heatmap_overlay(heatmap)
+    if overlay is None:
+        return None
+    png, bounds = overlay
+
+    m = folium.Map(location=[(bounds[0][0] + bounds[1][0]) / 2, (bounds[0][1] + bounds[1][1]) / 2],
+                   tiles="cartodbdark_matter")
+    folium.raster_layers.ImageOverlay(
+        image="data:image/png;base64," + base64.b64encode(png).decode("ascii"),
+        bounds=bounds,
+        opacity=0.9,
+    ).add_to(m)
+    m.fit_bounds(bounds)
+    return folium.Figure(height=height).add_child(m).render()
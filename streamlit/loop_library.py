@@ -0,0 +1,310 @@
+import os
+import csv
+import sys
+import argparse
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from graph_cache import tile_key, tile_path, start_nodes
+from graph_pruning import prune_graph
+from loop_search import find_loops, expand_loop, elevation_gain
+
+# Distances (km) precomputed for every anchor by default
+DEFAULT_DISTANCES_KM = (5.0, 10.0, 21.1)
+
+# Loops kept per anchor and distance
+DEFAULT_LOOPS_PER_DISTANCE = 6
+
+# Loops further than this from the requested length are not served
+DEFAULT_TOLERANCE = 0.05
+
+# Two loops sharing more than this fraction of their edges count as the same loop
+MAX_SHARED_EDGES = 0.5
+
+if NUMPY_AVAILABLE:
+    # One compact record per stored loop, sorted by length within each anchor;
+    # distance is the requested length (km) the loop was precomputed for.
+    # elevation_gain is kept for display only (NaN while tiles have no
+    # elevations); lookup does not index or filter by it
+    LOOP_DTYPE = np.dtype([
+        ("length", np.float32),
+        ("distance", np.float32),
+        ("paved", np.float16),
+        ("unpaved", np.float16),
+        ("elevation_gain", np.float32),
+        ("loop_id", np.int32),
+    ])
+
+_libraries = {}
+_libraries_lock = threading.Lock()
+
+
+def library_path(key):
+    """Get the on-disk path of a tile's loop library"""
+    return tile_path(key)[:-len(".npz")] + "_loops.npz"
+
+
+def _diverse(loops, count):
+    """Greedily keep the best loops that do not mostly retrace an already kept one"""
+    kept, kept_edges = [], []
+    for loop in loops:
+        edges = {s if s >= 0 else ~s for s in loop["steps"]}
+        if any(len(edges & other) > MAX_SHARED_EDGES * min(len(edges), len(other)) for other in kept_edges):
+            continue
+        kept.append(loop)
+        kept_edges.append(edges)
+        if len(kept) == count:
+            break
+    return kept
+
+
+def _gain(arrays, tile_steps):
+    gain = elevation_gain(arrays, tile_steps)
+    return gain if gain is not None else np.nan
+
+
+def build_library(tile, anchors, distances_km=DEFAULT_DISTANCES_KM, surface_preference="Any",
+                  loops_per_distance=DEFAULT_LOOPS_PER_DISTANCE, tolerance=DEFAULT_TOLERANCE):
+    """
+    Precompute a diverse set of loops for each anchor node of a tile
+
+    Args:
+        tile (dict): Graph tile from graph_cache.load_graph_tile
+        anchors (list): Tile node indices to precompute loops from
+        distances_km (tuple): Loop lengths to precompute
+        surface_preference (str): Surface preference the tile was built for
+        loops_per_distance (int): Loops kept per anchor and distance
+        tolerance (float): Maximum relative distance error of stored loops
+
+    Returns:
+        dict: Library with anchors, anchor_ptr, entries, loop_ptr and loop_steps arrays
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required to build loop libraries")
+
+    arrays = tile["arrays"]
+    anchors = sorted(set(int(a) for a in anchors))
+    entries, loop_steps, loop_ptr, anchor_ptr = [], [], [0], [0]
+
+    for anchor in anchors:
+        anchor_entries = []
+        for distance in distances_km:
+            distance_m = distance * 1000
+            graph = prune_graph(arrays, anchor, distance_m)
+            loops = find_loops(graph, distance_m, surface_preference,
+                               num_candidates=loops_per_distance * 4, seed=anchor)
+            loops = [loop for loop in loops if abs(loop["distance_error"]) <= tolerance]
+
+            for loop in _diverse(loops, loops_per_distance):
+                tile_steps = expand_loop(graph, loop["steps"])
+                anchor_entries.append((loop["length"], distance, loop["surface_mix"]["paved"],
+                                       loop["surface_mix"]["unpaved"],
+                                       _gain(arrays, tile_steps), len(loop_ptr) - 1))
+                loop_steps.extend(tile_steps)
+                loop_ptr.append(len(loop_steps))
+
+        anchor_entries.sort(key=lambda entry: entry[0])
+        entries.extend(anchor_entries)
+        anchor_ptr.append(len(entries))
+        print(f"Anchor {anchor}: {len(anchor_entries)} loops")
+
+    return {
+        "anchors": np.array(anchors, dtype=np.int64),
+        "anchor_ptr": np.array(anchor_ptr, dtype=np.int64),
+        "entries": np.array(entries, dtype=LOOP_DTYPE),
+        "loop_ptr": np.array(loop_ptr, dtype=np.int64),
+        "loop_steps": np.array(loop_steps, dtype=np.int64),
+    }
+
+
+def merge_libraries(first, second):
+    """
+    Combine two libraries of the same tile
+
+    Loops are merged per anchor and distance: where both libraries have
+    loops for the same anchor and distance, those in second win, and the
+    anchor's other distances are kept from either library.
+    """
+    groups = {}
+    for library in (first, second):
+        for i, anchor in enumerate(library["anchors"].tolist()):
+            entries = library["entries"][library["anchor_ptr"][i]:library["anchor_ptr"][i + 1]]
+            for distance in np.unique(entries["distance"]).tolist():
+                group = entries[entries["distance"] == distance]
+                loops = [library["loop_steps"][library["loop_ptr"][j]:library["loop_ptr"][j + 1]]
+                         for j in group["loop_id"].tolist()]
+                groups.setdefault(anchor, {})[distance] = (group, loops)
+
+    merged_entries, loop_steps, loop_ptr, anchor_ptr = [], [], [0], [0]
+    for anchor in sorted(groups):
+        anchor_entries = []
+        for entries, loops in groups[anchor].values():
+            entries = entries.copy()
+            for k, steps in enumerate(loops):
+                entries["loop_id"][k] = len(loop_ptr) - 1
+                loop_steps.append(steps)
+                loop_ptr.append(loop_ptr[-1] + len(steps))
+            anchor_entries.append(entries)
+        anchor_entries = np.concatenate(anchor_entries)
+        merged_entries.append(anchor_entries[np.argsort(anchor_entries["length"], kind="stable")])
+        anchor_ptr.append(anchor_ptr[-1] + len(anchor_entries))
+
+    return {
+        "anchors": np.array(sorted(groups), dtype=np.int64),
+        "anchor_ptr": np.array(anchor_ptr, dtype=np.int64),
+        "entries": np.concatenate(merged_entries) if merged_entries else np.zeros(0, dtype=LOOP_DTYPE),
+        "loop_ptr": np.array(loop_ptr, dtype=np.int64),
+        "loop_steps": np.concatenate(loop_steps) if loop_steps else np.zeros(0, dtype=np.int64),
+    }
+
+
+def save_library(key, library):
+    """Persist a tile's loop library next to the tile"""
+    path = library_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Swapped in whole, like graph_cache tiles, since other processes load it
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **library)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with _libraries_lock:
+        _libraries[key] = library
+
+
+def load_library(key):
+    """
+    Get the loop library of a tile, if one has been built
+
+    Only found libraries are kept in memory, so one built later (by the
+    offline job in another process) is picked up on the next request.
+
+    Args:
+        key (tuple): Tile key
+
+    Returns:
+        dict or None: The library
+    """
+    with _libraries_lock:
+        if key in _libraries:
+            return _libraries[key]
+
+    library = None
+    path = library_path(key)
+    if NUMPY_AVAILABLE and os.path.exists(path):
+        with np.load(path) as data:
+            library = {name: data[name] for name in data.files}
+        # Libraries written with an older entry layout are rebuilt by the offline job
+        if library["entries"].dtype != LOOP_DTYPE:
+            print(f"Warning: ignoring loop library {path} with an outdated layout")
+            library = None
+
+    if library is not None:
+        with _libraries_lock:
+            _libraries[key] = library
+    return library
+
+
+def lookup(library, anchor, distance_km, surface_preference="Any", tolerance=DEFAULT_TOLERANCE):
+    """
+    Find a stored loop for an anchor and distance
+
+    Both the anchor and the length range are found with binary searches.
+
+    Args:
+        library (dict): Loop library of the tile
+        anchor (int): Tile node index of the start
+        distance_km (float): Requested distance in kilometers
+        surface_preference (str): Preferred surface type
+        tolerance (float): Maximum relative distance error
+
+    Returns:
+        tuple or None: (entry, tile_steps) of the best matching loop
+    """
+    anchors = library["anchors"]
+    i = int(np.searchsorted(anchors, anchor))
+    if i >= len(anchors) or anchors[i] != anchor:
+        return None
+
+    entries = library["entries"][library["anchor_ptr"][i]:library["anchor_ptr"][i + 1]]
+    distance_m = distance_km * 1000
+    lo = int(np.searchsorted(entries["length"], distance_m * (1 - tolerance), side='left'))
+    hi = int(np.searchsorted(entries["length"], distance_m * (1 + tolerance), side='right'))
+    if lo == hi:
+        return None
+
+    candidates = entries[lo:hi]
+    error = np.abs(candidates["length"] - distance_m) / distance_m
+    if surface_preference == "Road":
+        error += 1.0 - candidates["paved"].astype(np.float32)
+    elif surface_preference == "Trail":
+        error += 1.0 - candidates["unpaved"].astype(np.float32)
+
+    entry = candidates[int(np.argmin(error))]
+    loop_id = int(entry["loop_id"])
+    steps = library["loop_steps"][library["loop_ptr"][loop_id]:library["loop_ptr"][loop_id + 1]]
+    return entry, steps.tolist()
+
+
+def main(argv=None):
+    """
+    Offline job: precompute loop libraries for popular start points
+
+    The anchors file is a CSV with lat and lon columns (and an optional
+    surface column). Each start point is snapped the way route generation
+    snaps it (graph_cache.start_nodes).
+    """
+    # Imported here to avoid a circular import (routing uses this module)
+    from routing import get_surface_filter
+    from graph_cache import load_graph_tile
+
+    parser = argparse.ArgumentParser(description="Precompute loop libraries for popular start points")
+    parser.add_argument("anchors", help="CSV file with lat, lon and optional surface columns")
+    parser.add_argument("--distances", default=",".join(f"{d:g}" for d in DEFAULT_DISTANCES_KM),
+                        help="Comma-separated loop distances in km")
+    parser.add_argument("--loops", type=int, default=DEFAULT_LOOPS_PER_DISTANCE,
+                        help="Loops kept per anchor and distance")
+    args = parser.parse_args(argv)
+
+    distances = [float(d) for d in args.distances.split(",")]
+
+    # Group anchors by the tile each request would use
+    jobs = {}
+    with open(args.anchors, newline="") as f:
+        for row in csv.DictReader(f):
+            point = (float(row["lat"]), float(row["lon"]))
+            surface = row.get("surface") or "Any"
+            for distance in distances:
+                key = tile_key(point, distance, surface)
+                jobs.setdefault(key, {"point": point, "distance": distance, "anchors": {}})
+                jobs[key]["anchors"].setdefault(point, []).append(distance)
+
+    for key, job in jobs.items():
+        surface = key[3]
+        highway_filter, handle_missing_surface = get_surface_filter(surface)
+        tile = load_graph_tile(job["point"], job["distance"], surface, highway_filter, handle_missing_surface)
+
+        points = list(job["anchors"])
+        nodes = start_nodes(tile, [p[0] for p in points], [p[1] for p in points])
+        library = None
+        for node, point in zip(nodes.tolist(), points):
+            part = build_library(tile, [node], job["anchors"][point], surface, args.loops)
+            library = part if library is None else merge_libraries(library, part)
+
+        existing = load_library(key)
+        if existing is not None:
+            library = merge_libraries(existing, library)
+        save_library(key, library)
+        print(f"Saved {len(library['entries'])} loops for {len(library['anchors'])} anchors of tile {key}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
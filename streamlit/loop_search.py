@@ -0,0 +1,292 @@
+import math
+import time
+import random
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from graph_cache import SURFACE_CODES
+from graph_pruning import adjacency_lists, bounded_dijkstra
+
+# Surface each preference favours (None: no preference)
+PREFERRED_SURFACE = {
+    "Road": SURFACE_CODES["paved"],
+    "Trail": SURFACE_CODES["unpaved"],
+    "Mixed": None,
+    "Any": None,
+}
+
+# Cost multiplier for edges whose known surface is not the preferred one
+SURFACE_PENALTY = 1.5
+
+# Weights of the candidate score terms
+OVERLAP_WEIGHT = 0.5
+SURFACE_WEIGHT = 0.2
+
+# Default number of candidate loops tried per search
+DEFAULT_CANDIDATES = 12
+
+
+def edge_costs(graph, surface_preference):
+    """
+    Per-edge routing cost that steers searches towards the preferred surface
+
+    Args:
+        graph (dict): Pruned graph
+        surface_preference (str): Preferred surface type
+
+    Returns:
+        np.ndarray: Cost per edge
+    """
+    preferred = PREFERRED_SURFACE.get(surface_preference)
+    if preferred is None:
+        return graph["edge_length"]
+
+    surface_length = graph["edge_surface_length"]
+    other = SURFACE_CODES["paved"] if preferred == SURFACE_CODES["unpaved"] else SURFACE_CODES["unpaved"]
+    return graph["edge_length"] + (SURFACE_PENALTY - 1.0) * surface_length[:, other]
+
+
+def _bearings(graph, origin):
+    """Bearing (radians) from one node to every node"""
+    lat0 = graph["node_lat"][origin]
+    dy = graph["node_lat"] - lat0
+    dx = (graph["node_lon"] - graph["node_lon"][origin]) * math.cos(math.radians(lat0))
+    return np.arctan2(dx, dy)
+
+
+def _path_to(pred_edge, pred_node, source, target):
+    """Edges of the shortest path tree from source to target, in travel order"""
+    edges = []
+    node = target
+    while node != source:
+        edges.append(int(pred_edge[node]))
+        node = int(pred_node[node])
+    edges.reverse()
+    return edges
+
+
+def _orient(graph, edges, start):
+    """Turn an edge list into signed steps (~e when traversed v -> u)"""
+    steps = []
+    node = start
+    for e in edges:
+        if graph["edge_u"][e] == node:
+            steps.append(e)
+            node = graph["edge_v"][e]
+        else:
+            steps.append(~e)
+            node = graph["edge_u"][e]
+    return steps
+
+
+def score_loop(graph, steps, distance_m, surface_preference):
+    """
+    Score a candidate loop (lower is better)
+
+    Args:
+        graph (dict): Pruned graph
+        steps (list): Signed edge steps of the loop
+        distance_m (float): Target length in meters
+        surface_preference (str): Preferred surface type
+
+    Returns:
+        dict: Loop with its length, distance error, overlap, surface mix and score
+    """
+    edges = np.array([s if s >= 0 else ~s for s in steps], dtype=np.int64)
+    lengths = graph["edge_length"][edges]
+    length = float(lengths.sum())
+
+    # Share of the loop spent on edges that are run more than once
+    unique, counts = np.unique(edges, return_counts=True)
+    repeated = float((graph["edge_length"][unique] * (counts - 1)).sum())
+    overlap = repeated / length if length > 0 else 1.0
+
+    surface_length = graph["edge_surface_length"][edges].sum(axis=0)
+    surface_mix = surface_length / max(length, 1e-9)
+
+    distance_error = (length - distance_m) / distance_m
+    score = abs(distance_error) + OVERLAP_WEIGHT * overlap
+    preferred = PREFERRED_SURFACE.get(surface_preference)
+    if preferred is not None:
+        score += SURFACE_WEIGHT * (1.0 - surface_mix[preferred])
+
+    return {
+        "steps": steps,
+        "length": length,
+        "distance_error": distance_error,
+        "overlap": overlap,
+        "surface_mix": {name: float(surface_mix[code]) for name, code in SURFACE_CODES.items()},
+        "score": score,
+    }
+
+
+def find_loops(graph, distance_m, surface_preference="Any", num_candidates=DEFAULT_CANDIDATES, seed=None,
+               time_budget=None, on_improvement=None, bearing_range=None):
+    """
+    Search the pruned graph for loops of the requested length
+
+    Each candidate is a triangle start -> A -> B -> start: A is a node about a
+    third of the distance away in a random bearing, and B is the node that
+    brings the total closest to the target while leaving in a different
+    direction. Every leg follows shortest paths, so only one extra Dijkstra
+    (from A) is needed per candidate.
+
+    The search is anytime: with a time budget it stops when the budget runs
+    out and returns what it has. The tree from the start and the first
+    complete candidate are never cut short, so even a spent budget yields a
+    loop of the right length when one exists.
+
+    Args:
+        graph (dict): Pruned graph from graph_pruning.prune_graph
+        distance_m (float): Target length in meters
+        surface_preference (str): Preferred surface type
+        num_candidates (int): Number of candidates to try (None: until the budget runs out)
+        seed (int): Seed for the bearing sampler
+        time_budget (float): Seconds the search may take
+        on_improvement (callable): Called with each loop that beats the best so far
+        bearing_range (tuple): (min, max) initial bearing in radians (default: all directions)
+
+    Returns:
+        list: Scored loops, best first
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required to search for loops")
+
+    deadline = time.monotonic() + time_budget if time_budget is not None else None
+
+    adjacency = adjacency_lists(graph, edge_costs(graph, surface_preference))
+    start = graph["start"]
+    cost0, dist0, pred_edge0, pred_node0 = bounded_dijkstra(adjacency, start, cutoff=distance_m)
+    bearing0 = _bearings(graph, start)
+
+    # Candidate first turning points: roughly a third of the loop away
+    via_a = np.flatnonzero((dist0 >= 0.25 * distance_m) & (dist0 <= 0.4 * distance_m))
+    if len(via_a) == 0:
+        via_a = np.flatnonzero(np.isfinite(dist0) & (dist0 > 0))
+    if len(via_a) == 0:
+        return []
+
+    rng = random.Random(seed)
+    low, high = bearing_range if bearing_range is not None else (-math.pi, math.pi)
+    untried = np.ones(len(via_a), dtype=bool)
+    loops = []
+    best_score = math.inf
+    attempts = 0
+    while untried.any() and (num_candidates is None or attempts < num_candidates):
+        if deadline is not None and loops and time.monotonic() >= deadline:
+            break
+        attempts += 1
+        steps = _candidate(graph, adjacency, start, dist0, pred_edge0, pred_node0, bearing0,
+                           via_a, untried, rng.uniform(low, high), distance_m, deadline if loops else None)
+        if steps is None:
+            continue
+        loop = score_loop(graph, steps, distance_m, surface_preference)
+        if loop["score"] < best_score:
+            best_score = loop["score"]
+            if on_improvement is not None:
+                on_improvement(loop)
+        loops.append(loop)
+
+    loops.sort(key=lambda loop: loop["score"])
+    return loops
+
+
+def _candidate(graph, adjacency, start, dist0, pred_edge0, pred_node0, bearing0, via_a, untried, bearing,
+               distance_m, deadline=None):
+    """Build one triangle candidate heading out on the given bearing"""
+    diff = np.abs(np.angle(np.exp(1j * (bearing0[via_a] - bearing))))
+    diff[~untried] = np.inf
+    pick = int(np.argmin(diff))
+    untried[pick] = False
+    a = int(via_a[pick])
+
+    _, dist_a, pred_edge_a, pred_node_a = bounded_dijkstra(adjacency, a, cutoff=distance_m - dist0[a],
+                                                           deadline=deadline)
+
+    # Total length of start -> A -> B -> start for every possible B
+    total = dist0[a] + dist_a + dist0
+    turn = np.abs(np.angle(np.exp(1j * (bearing0 - bearing0[a]))))
+    valid = np.isfinite(total) & (turn > math.radians(40))
+    valid[[start, a]] = False
+    if not valid.any():
+        return None
+
+    error = np.where(valid, np.abs(total - distance_m), np.inf)
+    b = int(np.argmin(error))
+
+    edges = _path_to(pred_edge0, pred_node0, start, a)
+    edges += _path_to(pred_edge_a, pred_node_a, a, b)
+    edges += list(reversed(_path_to(pred_edge0, pred_node0, start, b)))
+    return _orient(graph, edges, start)
+
+
+def expand_loop(graph, steps):
+    """
+    Expand a loop on the pruned graph back into tile edges
+
+    Args:
+        graph (dict): Pruned graph
+        steps (list): Signed pruned-edge steps of the loop
+
+    Returns:
+        list: Signed tile edge steps in travel order
+    """
+    chain_ptr, chain = graph["edge_chain_ptr"], graph["edge_chain"]
+    tile_steps = []
+    for step in steps:
+        e = step if step >= 0 else ~step
+        sub = chain[chain_ptr[e]:chain_ptr[e + 1]].tolist()
+        if step < 0:
+            # Reverse the chain and flip each tile edge's direction
+            sub = [~s for s in reversed(sub)]
+        tile_steps.extend(sub)
+    return tile_steps
+
+
+def loop_coordinates(tile_arrays, tile_steps):
+    """
+    Get the (lat, lon) geometry of a loop from its tile edge steps
+
+    Args:
+        tile_arrays (dict): Arrays of the tile
+        tile_steps (list): Signed tile edge steps
+
+    Returns:
+        list: (lat, lon) tuples along the loop
+    """
+    geom_ptr = tile_arrays["geom_ptr"]
+    geom_lat, geom_lon = tile_arrays["geom_lat"], tile_arrays["geom_lon"]
+    coords = []
+    for step in tile_steps:
+        e = step if step >= 0 else ~step
+        lats = geom_lat[geom_ptr[e]:geom_ptr[e + 1]]
+        lons = geom_lon[geom_ptr[e]:geom_ptr[e + 1]]
+        if step < 0:
+            lats, lons = lats[::-1], lons[::-1]
+        points = list(zip(lats.tolist(), lons.tolist()))
+        # Consecutive edges share their joining point
+        coords.extend(points[1:] if coords else points)
+    return coords
+
+
+def elevation_gain(tile_arrays, tile_steps):
+    """
+    Total climb in meters along a loop, from node elevations
+
+    Returns:
+        float or None: Climb, or None if the tile has no elevations for the
+        loop's nodes (NaN, or all zero in tiles built before that was marked)
+    """
+    if not tile_steps:
+        return 0.0
+    nodes = [tile_arrays["edge_u"][s] if s >= 0 else tile_arrays["edge_v"][~s] for s in tile_steps]
+    last = tile_steps[-1]
+    nodes.append(tile_arrays["edge_v"][last] if last >= 0 else tile_arrays["edge_u"][~last])
+    elevation = tile_arrays["node_elevation"][np.array(nodes)]
+    if np.isnan(elevation).any() or not elevation.any():
+        return None
+    return float(np.clip(np.diff(elevation), 0, None).sum())
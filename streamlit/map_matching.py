@@ -0,0 +1,385 @@
+import sys
+import math
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from graph_cache import SURFACE_CODES, load_graph_tile
+from loop_search import loop_coordinates, elevation_gain
+
+# Standard deviation (m) of GPS positions around the street actually run
+GPS_SIGMA_M = 5.0
+
+# Scale (m) of the difference between route and straight-line distance of a transition
+TRANSITION_BETA_M = 5.0
+
+# Candidate edges per point and how far (m) from the point they are searched
+MATCH_CANDIDATES = 5
+SEARCH_RADIUS_M = 50.0
+
+# Points closer than this (m) to the last kept point add nothing but noise (2 sigma)
+MIN_STEP_M = 2 * GPS_SIGMA_M
+
+# Longest detour (m) over the straight line a transition may take through the graph
+MAX_DETOUR_M = 100.0
+
+# Out-and-back excursions onto an edge shorter than this (m) are GPS noise at a junction
+MIN_TURNAROUND_M = 5 * GPS_SIGMA_M
+
+
+def _thin(xy, min_step):
+    """Indices of the points that are at least min_step from the previous kept point"""
+    kept = [0]
+    last = xy[0]
+    # Only points past min_step of cumulative travel can qualify, so most are skipped in bulk
+    travel = np.r_[0.0, np.cumsum(np.hypot(*np.diff(xy, axis=0).T))]
+    i = int(np.searchsorted(travel, min_step))
+    n = len(xy)
+    while i < n:
+        if math.hypot(xy[i, 0] - last[0], xy[i, 1] - last[1]) >= min_step:
+            kept.append(i)
+            last = xy[i]
+            i = int(np.searchsorted(travel, travel[i] + min_step))
+        else:
+            i += 1
+    return np.array(kept, dtype=np.int64)
+
+
+def shortest_lengths(arrays, sources, limits):
+    """
+    Shortest path lengths from many sources at once, each up to its own limit
+
+    A label-correcting search run for all sources together: every round
+    expands the (source, node) labels that improved in the previous round
+    through the CSR adjacency with array operations, and merges them into a
+    table sorted by source * num_nodes + node.
+
+    Args:
+        arrays (dict): Tile arrays with adj_ptr, adj_node, adj_edge and edge_length
+        sources (np.ndarray): Sorted unique source nodes
+        limits (np.ndarray): Largest length to search from each source
+
+    Returns:
+        dict: keys (sorted), length, pred_edge and pred_node per reached (source, node),
+        plus sources and num_nodes for lookups
+    """
+    adj_ptr, adj_node, adj_edge = arrays["adj_ptr"], arrays["adj_node"], arrays["adj_edge"]
+    edge_length = arrays["edge_length"].astype(np.float64)
+    n = len(adj_ptr) - 1
+
+    position = np.arange(len(sources), dtype=np.int64)
+    keys = position * n + sources
+    length = np.zeros(len(sources))
+    pred_edge = np.full(len(sources), -1, dtype=np.int64)
+    pred_node = np.full(len(sources), -1, dtype=np.int64)
+    f_src, f_node, f_len = position, sources.astype(np.int64), length.copy()
+
+    while len(f_src):
+        start = adj_ptr[f_node]
+        count = adj_ptr[f_node + 1] - start
+        rep = np.repeat(np.arange(len(f_node)), count)
+        idx = np.repeat(start, count) + np.arange(int(count.sum())) - np.repeat(np.cumsum(count) - count, count)
+        edges = adj_edge[idx].astype(np.int64)
+        src, node = f_src[rep], adj_node[idx].astype(np.int64)
+        total = f_len[rep] + edge_length[edges]
+        prev = f_node[rep]
+
+        ok = total <= limits[src]
+        src, node, total, edges, prev = src[ok], node[ok], total[ok], edges[ok], prev[ok]
+        new_keys = src * n + node
+        order = np.lexsort((total, new_keys))
+        first = order[np.r_[True, new_keys[order][1:] != new_keys[order][:-1]]] if len(order) else order
+        new_keys, total, edges, prev, src, node = (new_keys[first], total[first], edges[first], prev[first],
+                                                   src[first], node[first])
+
+        at = np.searchsorted(keys, new_keys)
+        found = at < len(keys)
+        found[found] = keys[at[found]] == new_keys[found]
+        better = found.copy()
+        better[found] = total[found] < length[at[found]]
+        length[at[better]] = total[better]
+        pred_edge[at[better]] = edges[better]
+        pred_node[at[better]] = prev[better]
+
+        fresh = ~found
+        keys = np.insert(keys, at[fresh], new_keys[fresh])
+        length = np.insert(length, at[fresh], total[fresh])
+        pred_edge = np.insert(pred_edge, at[fresh], edges[fresh])
+        pred_node = np.insert(pred_node, at[fresh], prev[fresh])
+
+        improved = better | fresh
+        f_src, f_node, f_len = src[improved], node[improved], total[improved]
+
+    return {"keys": keys, "length": length, "pred_edge": pred_edge, "pred_node": pred_node,
+            "sources": sources, "num_nodes": n}
+
+
+def _lookup(table, a, b):
+    """Positions of (source a, node b) in a shortest_lengths table (-1 where unreached)"""
+    src = np.searchsorted(table["sources"], a)
+    src = np.minimum(src, len(table["sources"]) - 1)
+    keys = src * table["num_nodes"] + b
+    at = np.minimum(np.searchsorted(table["keys"], keys), len(table["keys"]) - 1)
+    hit = (table["sources"][src] == a) & (table["keys"][at] == keys)
+    return np.where(hit, at, -1)
+
+
+def _path_edges(arrays, table, a, b):
+    """Edges of the shortest path from a to b in travel order, signed (~e when run v -> u)"""
+    steps = []
+    node = b
+    while node != a:
+        at = int(_lookup(table, np.array([a]), np.array([node]))[0])
+        edge, prev = int(table["pred_edge"][at]), int(table["pred_node"][at])
+        steps.append(edge if arrays["edge_u"][edge] == prev else ~edge)
+        node = prev
+    steps.reverse()
+    return steps
+
+
+def match_track(tile, lats, lons, sigma=GPS_SIGMA_M, beta=TRANSITION_BETA_M,
+                radius=SEARCH_RADIUS_M, candidates=MATCH_CANDIDATES):
+    """
+    Snap a GPS trace to the streets of a graph tile with an HMM and Viterbi
+
+    Candidates are the nearest edges of each point from the tile's spatial
+    index. Emission scores are Gaussian in the distance to the edge; a
+    transition scores how far the route length between two candidates
+    differs from the straight-line distance between the points. Route
+    lengths for all transitions come from one multi-source search, and the
+    (points x candidates x candidates) scores are computed as arrays, so
+    the only per-point Python work is the Viterbi step itself. Where no
+    candidate of a point can be reached from the previous one, the match
+    restarts.
+
+    Args:
+        tile (dict): Tile from graph_cache.load_graph_tile
+        lats (array-like): Trace latitudes
+        lons (array-like): Trace longitudes
+        sigma (float): GPS noise in metres
+        beta (float): Transition scale in metres
+        radius (float): Candidate search radius in metres
+        candidates (int): Candidates per point
+
+    Returns:
+        dict: steps (signed tile edge ids in running order, ~e when run v -> u; a
+        break leaves a gap between two steps),
+        point_edges (matched edge per trace point, -1 if none), distance (m along
+        the matched streets) and breaks (number of restarts)
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required for map matching")
+
+    arrays, index = tile["arrays"], tile["index"]
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+    point_edges = np.full(len(lats), -1, dtype=np.int64)
+    if len(lats) == 0:
+        return {"steps": [], "point_edges": point_edges, "distance": 0.0, "breaks": 0}
+
+    xy = index.project(lats, lons)
+    kept = _thin(xy, MIN_STEP_M)
+    edges, offsets, dists = index.candidate_edges(lats[kept], lons[kept], radius, candidates)
+    matched = edges[:, 0] >= 0
+    kept, edges, offsets, dists = kept[matched], edges[matched], offsets[matched], dists[matched]
+    if len(kept) == 0:
+        return {"steps": [], "point_edges": point_edges, "distance": 0.0, "breaks": 0}
+
+    valid = edges >= 0
+    emission = np.where(valid, -0.5 * (dists / sigma) ** 2, -np.inf)
+    straight = np.hypot(*np.diff(xy[kept], axis=0).T)
+
+    # Candidate positions measured from both ends of their edge
+    e = np.where(valid, edges, 0)
+    length = arrays["edge_length"][e].astype(np.float64)
+    ends = np.stack([arrays["edge_u"][e], arrays["edge_v"][e]], axis=-1).astype(np.int64)
+    end_distance = np.stack([offsets, length - offsets], axis=-1)
+    end_distance = np.where(valid[..., None], np.clip(end_distance, 0.0, None), np.inf)
+
+    # Search from the ends of every candidate far enough to reach the next point's candidates
+    limit = np.broadcast_to((straight + MAX_DETOUR_M)[:, None, None], ends[:-1].shape)
+    usable = np.broadcast_to(valid[:-1, :, None], ends[:-1].shape)
+    sources, inverse = np.unique(ends[:-1][usable], return_inverse=True)
+    limits = np.zeros(len(sources))
+    np.maximum.at(limits, inverse, limit[usable])
+    table = shortest_lengths(arrays, sources, limits) if len(sources) else None
+
+    # Route length for every (step, from candidate, to candidate, from end, to end)
+    a = ends[:-1][:, :, None, :, None]
+    b = ends[1:][:, None, :, None, :]
+    a, b = np.broadcast_arrays(a, b)
+    if table is not None:
+        at = _lookup(table, a.ravel(), b.ravel()).reshape(a.shape)
+        between = np.where(at >= 0, table["length"][np.maximum(at, 0)], np.inf)
+    else:
+        between = np.full(a.shape, np.inf)
+    via = end_distance[:-1][:, :, None, :, None] + between + end_distance[1:][:, None, :, None, :]
+    best_via = via.reshape(via.shape[:3] + (4,)).argmin(axis=-1)
+    route = np.take_along_axis(via.reshape(via.shape[:3] + (4,)), best_via[..., None], axis=-1)[..., 0]
+    same = (edges[:-1][:, :, None] == edges[1:][:, None, :]) & valid[:-1][:, :, None] & valid[1:][:, None, :]
+    along = np.where(same, np.abs(np.where(valid, offsets, 0.0)[:-1][:, :, None]
+                                  - np.where(valid, offsets, 0.0)[1:][:, None, :]), np.inf)
+    direct = same & (along <= route)
+    route = np.where(direct, along, route)
+    detour = np.abs(route - straight[:, None, None])
+    transition = np.where(np.isfinite(route) & (detour <= MAX_DETOUR_M), -detour / beta, -np.inf)
+
+    # Viterbi; a point none of whose candidates can be reached starts a new match
+    count = len(kept)
+    back = np.zeros((count, edges.shape[1]), dtype=np.int64)
+    restart = np.zeros(count, dtype=bool)
+    last_choice = np.zeros(count, dtype=np.int64)
+    score = emission[0]
+    for t in range(count - 1):
+        total = score[:, None] + transition[t]
+        best = total.max(axis=0) + emission[t + 1]
+        if np.isfinite(best).any():
+            back[t + 1] = total.argmax(axis=0)
+            score = best
+        else:
+            restart[t + 1] = True
+            last_choice[t] = int(score.argmax())
+            score = emission[t + 1]
+
+    choice = np.zeros(count, dtype=np.int64)
+    choice[-1] = int(score.argmax())
+    for t in range(count - 1, 0, -1):
+        choice[t - 1] = last_choice[t - 1] if restart[t] else back[t, choice[t]]
+
+    # Runs of consecutive points on one edge; between runs, the route the transition took
+    runs = []
+    for t in range(count):
+        j = choice[t]
+        offset = float(offsets[t, j])
+        if t > 0 and not restart[t] and direct[t - 1, choice[t - 1], j]:
+            run = runs[-1]
+            run["last"] = offset
+            run["low"], run["high"] = min(run["low"], offset), max(run["high"], offset)
+            continue
+        run = {"edge": int(edges[t, j]), "first": offset, "last": offset, "low": offset, "high": offset,
+               "entry": None, "exit": None, "path": [], "between": 0.0}
+        if t > 0 and not restart[t]:
+            i = choice[t - 1]
+            from_end, to_end = divmod(int(best_via[t - 1, i, j]), 2)
+            runs[-1]["exit"] = int(ends[t - 1, i, from_end])
+            run["entry"] = int(ends[t, j, to_end])
+            run["path"] = _path_edges(arrays, table, runs[-1]["exit"], run["entry"])
+            run["between"] = float(between[t - 1, i, j, from_end, to_end])
+        runs.append(run)
+
+    # Signed edge steps and matched distance; along-edge GPS jitter within a run is ignored
+    steps = []
+    distance = 0.0
+
+    def push(step):
+        if not steps or steps[-1] != step:
+            steps.append(step)
+
+    for run in runs:
+        for step in run["path"]:
+            push(step)
+        distance += run["between"]
+        edge = run["edge"]
+        u, length_e = int(arrays["edge_u"][edge]), float(arrays["edge_length"][edge])
+        entry, exit_ = run["entry"], run["exit"]
+        if entry is not None and entry == exit_:
+            # In and out through the same node: a turnaround, or GPS noise at a junction
+            depth = run["high"] if entry == u else length_e - run["low"]
+            if depth >= MIN_TURNAROUND_M:
+                push(edge if entry == u else ~edge)
+                push(~edge if entry == u else edge)
+                distance += 2 * depth
+            continue
+        if entry is not None:
+            forward = entry == u
+        elif exit_ is not None:
+            forward = exit_ != u
+        else:
+            forward = run["last"] >= run["first"]
+        start = (0.0 if forward else length_e) if entry is not None else run["first"]
+        end = (length_e if forward else 0.0) if exit_ is not None else run["last"]
+        # A trace that starts or ends at a junction touches the next edge without running it
+        if (entry is not None and exit_ is not None) or abs(end - start) >= GPS_SIGMA_M:
+            push(edge if forward else ~edge)
+        distance += abs(end - start)
+
+    # Every trace point takes the match of the last kept point at or before it
+    owner = np.searchsorted(kept, np.arange(len(lats)), side="right") - 1
+    chosen = edges[np.arange(count), choice]
+    point_edges = np.where(owner >= 0, chosen[np.maximum(owner, 0)], -1)
+    return {"steps": steps, "point_edges": point_edges, "distance": distance, "breaks": int(restart.sum())}
+
+
+def matched_summary(tile_arrays, match):
+    """
+    Distance, surface mix, climb and geometry of a matched trace
+
+    Everything is read from the tile's per-edge arrays along the matched steps.
+
+    Args:
+        tile_arrays (dict): Arrays of the tile the trace was matched on
+        match (dict): Result of match_track
+
+    Returns:
+        dict: distance_km, surface_mix (share of length per surface), elevation_gain (m,
+        None if the tile has no elevations), coordinates ((lat, lon) along the matched streets) and breaks
+    """
+    steps = match["steps"]
+    edges = np.array([step if step >= 0 else ~step for step in steps], dtype=np.int64)
+    lengths = tile_arrays["edge_length"][edges].astype(np.float64)
+    surface_length = np.bincount(tile_arrays["edge_surface"][edges], weights=lengths,
+                                 minlength=len(SURFACE_CODES))
+    surface_mix = surface_length / max(float(lengths.sum()), 1e-9)
+    gain = elevation_gain(tile_arrays, steps)
+    return {
+        "distance_km": round(match["distance"] / 1000, 2),
+        "surface_mix": {name: round(float(surface_mix[code]), 3) for name, code in SURFACE_CODES.items()},
+        "elevation_gain": round(gain) if gain is not None else None,
+        "coordinates": loop_coordinates(tile_arrays, steps),
+        "breaks": match["breaks"],
+    }
+
+
+def match_recorded_track(track, surface_preference="Any"):
+    """
+    Map-match an imported track on the cached street graph around it
+
+    The tile is chosen to reach the point of the track farthest from its
+    start, and is downloaded only if it is not cached yet.
+
+    Args:
+        track (dict): Arrays from track_import.read_track
+        surface_preference (str): Street network to match on (see routing.get_surface_filter)
+
+    Returns:
+        dict: Summary from matched_summary
+    """
+    # Imported here so matching cached tiles does not load the routing module up front
+    from routing import get_surface_filter
+
+    lats, lons = np.asarray(track["lat"]), np.asarray(track["lon"])
+    start = (float(lats[0]), float(lons[0]))
+    farthest_km = float(np.hypot((lats - start[0]) * 110.54,
+                                 (lons - start[1]) * 111.32 * math.cos(math.radians(start[0]))).max())
+    highway_filter, handle_missing_surface = get_surface_filter(surface_preference)
+    tile = load_graph_tile(start, 2 * farthest_km, surface_preference, highway_filter, handle_missing_surface)
+    return matched_summary(tile["arrays"], match_track(tile, lats, lons))
+
+
+def main(argv=None):
+    """Print the map-matched summary of each track file given on the command line"""
+    from track_import import read_track
+
+    for path in (argv if argv is not None else sys.argv[1:]):
+        summary = match_recorded_track(read_track(path))
+        mix = ", ".join(f"{name} {share:.0%}" for name, share in summary["surface_mix"].items())
+        climb = f"{summary['elevation_gain']} m climb, " if summary["elevation_gain"] is not None else ""
+        print(f"{path}: {summary['distance_km']} km on streets ({mix}), {climb}{summary['breaks']} breaks")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
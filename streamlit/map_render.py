@@ -0,0 +1,206 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+from resample import resample_coordinates
+from route_keys import route_hash
+
+try:
+    import folium
+    FOLIUM_AVAILABLE = True
+except ImportError:
+    FOLIUM_AVAILABLE = False
+
+# "folium" renders a full folium page per route; "geojson" keeps one Leaflet
+# map mounted and sends it only the route geometry
+MAP_RENDERER = os.environ.get("ROUTE_MAP_RENDERER", "folium")
+
+# Rendered maps kept in memory, shared by all sessions
+MAX_MAPS_IN_MEMORY = 32
+
+# Default map size in pixels (same as folium_static)
+MAP_WIDTH = 700
+MAP_HEIGHT = 500
+
+# Decimal places kept in GeoJSON coordinates (~1 m)
+GEOJSON_PRECISION = 5
+
+_maps = OrderedDict()
+_maps_lock = threading.Lock()
+
+# Frontend of the "geojson" renderer: a Streamlit component whose page and
+# Leaflet map are created once and then only receive route payloads
+ROUTE_MAP_COMPONENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "route_map_component")
+
+_route_map_component = None
+
+
+def route_geojson(coords, precision=GEOJSON_PRECISION):
+    """
+    Get a route as a compact GeoJSON LineString feature
+
+    Args:
+        coords (list): (lat, lon) points
+        precision (int): Decimal places kept per coordinate
+
+    Returns:
+        dict: GeoJSON Feature with [lon, lat] coordinates
+    """
+    return {
+        "type": "Feature",
+        "properties": {},
+        "geometry": {
+            "type": "LineString",
+            "coordinates": [[round(lon, precision), round(lat, precision)] for lat, lon in coords],
+        },
+    }
+
+
+def _view(coords, start_point, center, route_key):
+    """Fill in the route key, start marker and center a route map is drawn with"""
+    if route_key is None:
+        route_key = route_hash(coords) if coords else ""
+    if start_point is None and coords:
+        start_point = coords[0]
+    if center is None:
+        center = start_point if start_point is not None else (55.3960, 10.3883)
+    return route_key, start_point, center
+
+
+def route_map_html(coords, start_point=None, center=None, zoom_start=13, color="blue",
+                   start_tooltip="Start/End", height=MAP_HEIGHT, route_key=None):
+    """
+    Get the folium HTML of a map showing one route, rendering it only once
+
+    Maps are cached by route and view options, so redrawing a route costs
+    a dictionary lookup no matter how long it is. The route is resampled
+    with the "display" profile before it is sent to the browser.
+
+    Args:
+        coords (list): (lat, lon) points of the route (may be empty)
+        start_point (tuple): Where to put the start marker (defaults to the first point)
+        center (tuple): Map center when there is no route
+        zoom_start (int): Initial zoom level
+        color (str): Route line color
+        start_tooltip (str): Tooltip of the start marker
+        height (int): Map height in pixels
+        route_key (str): Precomputed route_hash of coords
+
+    Returns:
+        str: Self-contained HTML page
+
+    Raises:
+        ImportError: If folium is not installed
+    """
+    route_key, start_point, center = _view(coords, start_point, center, route_key)
+    key = (route_key, "folium", tuple(start_point) if start_point is not None else None, tuple(center),
+           zoom_start, color, start_tooltip, height)
+    return cached_map(key, _folium_html, coords, start_point, center, zoom_start, color, start_tooltip, height)
+
+
+def route_map_payload(coords, start_point=None, center=None, zoom_start=13, color="blue",
+                      start_tooltip="Start/End", route_key=None):
+    """
+    Get the compact JSON payload the route map component draws, building it only once
+
+    Payloads are cached like rendered maps. The route is resampled with the
+    "display" profile and sent as a GeoJSON LineString.
+
+    Args:
+        coords (list): (lat, lon) points of the route (may be empty)
+        start_point (tuple): Where to put the start marker (defaults to the first point)
+        center (tuple): Map center when there is no route
+        zoom_start (int): Initial zoom level
+        color (str): Route line color
+        start_tooltip (str): Tooltip of the start marker
+        route_key (str): Precomputed route_hash of coords
+
+    Returns:
+        str: JSON payload for show_route_map
+    """
+    route_key, start_point, center = _view(coords, start_point, center, route_key)
+    key = (route_key, "geojson", tuple(start_point) if start_point is not None else None, tuple(center),
+           zoom_start, color, start_tooltip)
+    return cached_map(key, _geojson_payload, coords, start_point, center, zoom_start, color, start_tooltip)
+
+
+def show_route_map(payload, key, width=MAP_WIDTH, height=MAP_HEIGHT):
+    """
+    Draw a route payload in the route map component
+
+    The component stays mounted across reruns for the same key, so a new
+    route only sends its payload; the page, Leaflet and the base map are
+    not loaded again.
+
+    Args:
+        payload (str): Payload from route_map_payload
+        key (str): Streamlit element key, one per map on the page
+        width (int): Map width in pixels
+        height (int): Map height in pixels
+    """
+    global _route_map_component
+    # Imported here so batch and service processes using this module never load streamlit
+    import streamlit.components.v1 as components
+
+    if _route_map_component is None:
+        _route_map_component = components.declare_component("route_map", path=ROUTE_MAP_COMPONENT_DIR)
+    _route_map_component(payload=payload, width=width, height=height, key=key, default=None)
+
+
+def cached_map(key, render, *args):
+    """
+    Get rendered map HTML from the cache, or render and cache it
+
+    Args:
+        key (hashable): Identifies the map content and view options
+        render (callable): Builds the HTML from args on a cache miss
+
+    Returns:
+        str: Map HTML
+    """
+    with _maps_lock:
+        if key in _maps:
+            _maps.move_to_end(key)
+            return _maps[key]
+
+    html = render(*args)
+
+    with _maps_lock:
+        _maps[key] = html
+        while len(_maps) > MAX_MAPS_IN_MEMORY:
+            _maps.popitem(last=False)
+    return html
+
+
+def _folium_html(coords, start_point, center, zoom_start, color, start_tooltip, height):
+    if not FOLIUM_AVAILABLE:
+        raise ImportError("folium package is required to render maps")
+
+    m = folium.Map(location=list(center), zoom_start=zoom_start)
+    if coords:
+        coords = resample_coordinates(coords, "display")
+        folium.PolyLine(coords, color=color, weight=3, opacity=0.7).add_to(m)
+    if start_point is not None:
+        folium.Marker(list(start_point), tooltip=start_tooltip).add_to(m)
+    return folium.Figure(height=height).add_child(m).render()
+
+
+def _geojson_payload(coords, start_point, center, zoom_start, color, start_tooltip):
+    if coords:
+        coords = resample_coordinates(coords, "display")
+    payload = {
+        "center": list(center),
+        "zoom": zoom_start,
+        "color": color,
+        "tooltip": start_tooltip,
+        "start": list(start_point) if start_point is not None else None,
+        "route": route_geojson(coords) if coords else None,
+    }
+    return json.dumps(payload, separators=(",", ":"))
+
+
+def clear_map_cache():
+    """Drop all rendered maps"""
+    with _maps_lock:
+        _maps.clear()
@@ -0,0 +1,232 @@
+import os
+import math
+import atexit
+import time
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from graph_pruning import prune_graph
+from loop_search import find_loops, expand_loop, DEFAULT_CANDIDATES
+
+# Worker processes used for loop search (defaults to the number of cores)
+ROUTE_WORKERS = int(os.environ.get("ROUTE_WORKERS", "0")) or os.cpu_count() or 1
+
+# Loops each worker sends back to the parent
+TOP_LOOPS_PER_WORKER = 3
+
+# Pruned graphs a worker keeps for repeated requests
+PRUNED_CACHE_SIZE = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+
+# Published tiles kept in shared memory (same as the tiles graph_cache keeps in memory)
+MAX_PUBLISHED_TILES = 8
+
+# Parent side: tile key -> (SharedMemory, layout), least recently used first
+_published = OrderedDict()
+_published_lock = threading.Lock()
+
+# Worker side: shared memory name -> (SharedMemory, arrays), least recently used first
+_attached = OrderedDict()
+_pruned = OrderedDict()
+
+
+def publish_arrays(key, arrays):
+    """
+    Copy a tile's arrays into one shared memory block (once per tile)
+
+    Only the MAX_PUBLISHED_TILES most recently used tiles stay published;
+    older blocks are unlinked, and workers drop their mappings of them.
+
+    Args:
+        key (tuple): Tile key
+        arrays (dict): Tile arrays
+
+    Returns:
+        dict: Picklable layout that workers use to attach to the block
+    """
+    with _published_lock:
+        if key in _published:
+            _published.move_to_end(key)
+            return _published[key][1]
+        layout = _publish(key, arrays)
+        while len(_published) > MAX_PUBLISHED_TILES:
+            _release(next(iter(_published)))
+        return layout
+
+
+def _publish(key, arrays):
+    fields = {}
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        offset = (offset + 63) // 64 * 64  # Keep every array cache-line aligned
+        fields[name] = (offset, array.dtype.str, array.shape)
+        offset += array.nbytes
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for name, array in arrays.items():
+        start, dtype, shape = fields[name]
+        view = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=start)
+        view[...] = array
+
+    layout = {"name": shm.name, "fields": fields}
+    _published[key] = (shm, layout)
+    return layout
+
+
+def release_arrays(key=None):
+    """Unlink the shared memory of one published tile (or of all of them)"""
+    with _published_lock:
+        for k in [key] if key is not None else list(_published):
+            _release(k)
+
+
+def _release(key):
+    shm, _ = _published.pop(key, (None, None))
+    if shm is not None:
+        # Workers still searching the tile keep their mapping until they drop it
+        shm.close()
+        shm.unlink()
+
+
+atexit.register(release_arrays)
+
+
+def _attach(layout):
+    """Map a published tile into this worker without copying it"""
+    name = layout["name"]
+    if name not in _attached:
+        # Pool workers share the parent's resource tracker, so attaching does
+        # not hand ownership of the block to the worker
+        shm = shared_memory.SharedMemory(name=name)
+        arrays = {
+            field: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+            for field, (offset, dtype, shape) in layout["fields"].items()
+        }
+        _attached[name] = (shm, arrays)
+        while len(_attached) > MAX_PUBLISHED_TILES:
+            _detach(next(iter(_attached)))
+    else:
+        _attached.move_to_end(name)
+    return _attached[name][1]
+
+
+def _detach(name):
+    """Drop a worker's mapping of a tile the parent has most likely released"""
+    shm = _attached.pop(name)[0]
+    for cache_key in [cache_key for cache_key in _pruned if cache_key[0] == name]:
+        del _pruned[cache_key]
+    try:
+        shm.close()
+    except BufferError:
+        # A pruned graph still views the block; the mapping goes when it is collected
+        pass
+
+
+def _search_worker(layout, start_node, distance_m, surface_preference, time_budget,
+                   num_candidates, bearing_range, seed):
+    """Run one family of candidates in a worker and return its best loops"""
+    started = time.monotonic()
+    arrays = _attach(layout)
+
+    cache_key = (layout["name"], start_node, distance_m)
+    graph = _pruned.get(cache_key)
+    if graph is None:
+        graph = prune_graph(arrays, start_node, distance_m)
+        _pruned[cache_key] = graph
+        while len(_pruned) > PRUNED_CACHE_SIZE:
+            _pruned.popitem(last=False)
+    else:
+        _pruned.move_to_end(cache_key)
+
+    # Pruning counts against the budget
+    if time_budget is not None:
+        time_budget = max(0.0, time_budget - (time.monotonic() - started))
+    loops = find_loops(graph, distance_m, surface_preference, num_candidates=num_candidates,
+                       seed=seed, time_budget=time_budget, bearing_range=bearing_range)
+    return [
+        {
+            "tile_steps": expand_loop(graph, loop["steps"]),
+            "length": loop["length"],
+            "distance_error": loop["distance_error"],
+            "overlap": loop["overlap"],
+            "surface_mix": loop["surface_mix"],
+            "score": loop["score"],
+        }
+        for loop in loops[:TOP_LOOPS_PER_WORKER]
+    ]
+
+
+def get_pool():
+    """Get the shared process pool, starting it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=ROUTE_WORKERS)
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def parallel_find_loops(tile, start_node, distance_m, surface_preference="Any", time_budget=None,
+                        num_candidates=None, seed=None):
+    """
+    Search for loops in parallel worker processes
+
+    The tile is published to shared memory once; every worker attaches to it,
+    prunes it (cached per worker) and explores its own sector of initial
+    bearings. Only the best few loops of each worker travel back.
+
+    Args:
+        tile (dict): Graph tile from graph_cache.load_graph_tile
+        start_node (int): Tile node index of the start
+        distance_m (float): Target length in meters
+        surface_preference (str): Preferred surface type
+        time_budget (float): Seconds each worker may take, pruning included
+        num_candidates (int): Total candidates to try across all workers
+        seed (int): Base seed for the candidate samplers
+
+    Returns:
+        list: Loops with tile_steps, length, distance_error, surface_mix and score, best first
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required for parallel loop search")
+
+    layout = publish_arrays(tile["key"], tile["arrays"])
+    pool = get_pool()
+
+    if num_candidates is None and time_budget is None:
+        num_candidates = DEFAULT_CANDIDATES
+    per_worker = None if num_candidates is None else max(1, math.ceil(num_candidates / ROUTE_WORKERS))
+    rng = random.Random(seed)
+    sector = 2 * math.pi / ROUTE_WORKERS
+
+    futures = [
+        pool.submit(_search_worker, layout, int(start_node), float(distance_m), surface_preference,
+                    time_budget, per_worker, (-math.pi + i * sector, -math.pi + (i + 1) * sector),
+                    rng.randrange(2 ** 31))
+        for i in range(ROUTE_WORKERS)
+    ]
+
+    # Workers keep to the budget themselves, pruning included
+    done, _ = wait(futures)
+
+    loops = []
+    for future in done:
+        try:
+            loops.extend(future.result())
+        except Exception as e:
+            print(f"Loop search worker failed: {e}")
+
+    loops.sort(key=lambda loop: loop["score"])
+    return loops
@@ -0,0 +1,124 @@
+import math
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from simplify import project
+
+# Sampling settings per consumer of route geometry:
+#   max_chord_error_m: largest gap between the true line and a chord
+#   max_heading_change_deg: largest turn between consecutive samples
+#   max_spacing_m: longest distance between samples, even on straight streets
+#   max_points: cap on the number of samples (density is scaled down to fit)
+RESAMPLE_PROFILES = {
+    "display": {"max_chord_error_m": 2.0, "max_heading_change_deg": 20.0, "max_spacing_m": 250.0,
+                "max_points": 2000},
+    # GPS devices navigate more smoothly with regular points
+    "gpx": {"max_chord_error_m": 1.0, "max_heading_change_deg": 10.0, "max_spacing_m": 50.0,
+            "max_points": None},
+    "storage": {"max_chord_error_m": 2.0, "max_heading_change_deg": 15.0, "max_spacing_m": 200.0,
+                "max_points": None},
+}
+
+
+def resample(coords, max_chord_error_m=2.0, max_heading_change_deg=15.0, max_spacing_m=200.0,
+             max_points=None, return_positions=False):
+    """
+    Resample a line with point density following its curvature
+
+    Turns sharper than max_heading_change_deg are kept as exact vertices.
+    Gentler turns are spread along their neighbouring segments as
+    curvature k, and samples are placed at a density of
+    max(k / max_heading_change, sqrt(k / (8 * max_chord_error)), 1 / max_spacing)
+    per metre: the first two terms bound the turn between samples and the
+    chord error on an arc of radius 1/k, the last bounds the spacing.
+    Sample positions come from inverting the cumulative density, so the
+    whole line is handled with array operations.
+
+    Args:
+        coords (array-like): (n, 2) array of (lat, lon) points
+        max_chord_error_m (float): Largest chord error on curves, in metres
+        max_heading_change_deg (float): Largest turn between samples, in degrees
+        max_spacing_m (float): Longest distance between samples, in metres
+        max_points (int): Cap on the number of samples
+        return_positions (bool): Also return where each sample lies along the line
+
+    Returns:
+        np.ndarray: Resampled (lat, lon) points; first and last points are kept.
+        With return_positions, a (points, positions) tuple, positions being
+        distances in planar metres along the input line (see simplify.project)
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) < 3:
+        return (coords, np.r_[0.0, np.cumsum(np.hypot(*np.diff(project(coords), axis=0).T))]
+                if return_positions else coords)
+
+    # Drop repeated points so every segment has a length and a heading
+    xy = project(coords)
+    seg = np.hypot(*np.diff(xy, axis=0).T)
+    moved = np.r_[True, seg > 1e-6]
+    coords, xy = coords[moved], xy[moved]
+    if len(coords) < 3:
+        return (coords, np.r_[0.0, np.cumsum(np.hypot(*np.diff(xy, axis=0).T))]) if return_positions else coords
+    seg = np.hypot(*np.diff(xy, axis=0).T)
+    arc = np.r_[0.0, np.cumsum(seg)]
+
+    heading = np.arctan2(np.diff(xy[:, 1]), np.diff(xy[:, 0]))
+    turn = np.abs((np.diff(heading) + np.pi) % (2 * np.pi) - np.pi)  # At interior vertices 1..n-2
+
+    max_turn = math.radians(max_heading_change_deg)
+    sharp = turn > max_turn
+    corner_cap = max(max_points // 2, 1) if max_points is not None else None
+    if corner_cap is not None and np.count_nonzero(sharp) > corner_cap:
+        # Too many corners to keep them all: keep the sharpest ones exactly
+        sharp[:] = False
+        sharp[np.argpartition(turn, -corner_cap)[-corner_cap:]] = True
+    gentle = np.where(sharp, 0.0, turn)
+
+    # Each gentle turn is shared between the two segments meeting at its vertex
+    seg_turn = np.zeros(len(seg))
+    seg_turn[:-1] += gentle / 2
+    seg_turn[1:] += gentle / 2
+    curvature = seg_turn / seg
+
+    density = np.maximum.reduce([
+        curvature / max_turn,
+        np.sqrt(curvature / (8 * max_chord_error_m)),
+        np.full(len(seg), 1.0 / max_spacing_m),
+    ])
+    budget = np.r_[0.0, np.cumsum(density * seg)]
+
+    anchors = np.flatnonzero(sharp) + 1
+    if max_points is not None and budget[-1] + len(anchors) + 2 > max_points:
+        budget *= max(max_points - len(anchors) - 2, 1) / budget[-1]
+
+    # Arc positions where the cumulative density crosses a whole number
+    targets = np.arange(1, math.ceil(budget[-1]))
+    positions = np.interp(targets, budget, arc)
+    positions = np.unique(np.r_[0.0, positions, arc[anchors], arc[-1]])
+
+    points = np.column_stack([np.interp(positions, arc, coords[:, 0]), np.interp(positions, arc, coords[:, 1])])
+    return (points, positions) if return_positions else points
+
+
+def resample_coordinates(coords, profile="storage", **overrides):
+    """
+    Resample a list of coordinates with the settings of a consumer profile
+
+    Falls back to the original points when numpy is not installed.
+
+    Args:
+        coords (list): (lat, lon) points
+        profile (str): Key of RESAMPLE_PROFILES ("display", "gpx" or "storage")
+        **overrides: Profile settings to replace
+
+    Returns:
+        list: Resampled [lat, lon] points
+    """
+    if not NUMPY_AVAILABLE or len(coords) < 3:
+        return [list(point) for point in coords]
+    settings = dict(RESAMPLE_PROFILES[profile], **overrides)
+    return resample(coords, **settings).tolist()
@@ -0,0 +1,350 @@
+import os
+import json
+import math
+import hashlib
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from route_keys import activity_key
+from simplify import METERS_PER_DEGREE
+
+# Where per-user route indexes are persisted between runs
+ROUTE_INDEX_CACHE_DIR = os.environ.get(
+    "SMARTRUNNING_ROUTE_INDEX_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".route_index_cache")
+)
+
+# Grid cells (degrees) that route start points and bounding boxes are indexed by
+START_CELL_DEGREES = 0.01
+BOX_CELL_DEGREES = 0.05
+
+# Default query: routes starting within this many metres, within this relative distance error
+NEAR_RADIUS_M = 2000.0
+DISTANCE_TOLERANCE = 0.2
+
+# Share of the classified length a surface needs for a route to count as Road or Trail
+SURFACE_MAJORITY = 0.6
+
+# In-memory indexes by user
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def route_index_path(user_key):
+    """Get the on-disk path of a user's route index"""
+    name = hashlib.sha1(str(user_key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(ROUTE_INDEX_CACHE_DIR, f"route_index_{name}.json")
+
+
+def _empty_index(user_key):
+    # starts and boxes map grid cells to keys; they are rebuilt from the entries on load
+    return {"user": user_key, "entries": {}, "starts": {}, "boxes": {}, "lock": threading.Lock()}
+
+
+def _cell(lat, lon, size):
+    return (int(math.floor(lat / size)), int(math.floor(lon / size)))
+
+
+def _box_cells(bbox):
+    row0, col0 = _cell(bbox[0], bbox[1], BOX_CELL_DEGREES)
+    row1, col1 = _cell(bbox[2], bbox[3], BOX_CELL_DEGREES)
+    return [(row, col) for row in range(row0, row1 + 1) for col in range(col0, col1 + 1)]
+
+
+def _index_entry(index, key, entry):
+    index["entries"][key] = entry
+    index["starts"].setdefault(_cell(*entry["start"], START_CELL_DEGREES), set()).add(key)
+    for cell in _box_cells(entry["bbox"]):
+        index["boxes"].setdefault(cell, set()).add(key)
+
+
+def _unindex_entry(index, key):
+    entry = index["entries"].pop(key, None)
+    if entry is None:
+        return
+    index["starts"].get(_cell(*entry["start"], START_CELL_DEGREES), set()).discard(key)
+    for cell in _box_cells(entry["bbox"]):
+        index["boxes"].get(cell, set()).discard(key)
+
+
+def load_route_index(user_key):
+    """
+    Get a user's route index from memory or disk (empty if there is none yet)
+
+    Args:
+        user_key (str): User id
+
+    Returns:
+        dict: Index with an entry per route and the start and bounding box grids
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required for the route index")
+
+    with _indexes_lock:
+        if user_key in _indexes:
+            return _indexes[user_key]
+
+    index = _empty_index(user_key)
+    try:
+        with open(route_index_path(user_key)) as f:
+            saved = json.load(f)
+        for key, entry in saved.get("entries", {}).items():
+            _index_entry(index, key, entry)
+    except (OSError, ValueError):
+        pass
+
+    with _indexes_lock:
+        return _indexes.setdefault(user_key, index)
+
+
+def save_route_index(index):
+    """Persist the route entries as JSON"""
+    os.makedirs(ROUTE_INDEX_CACHE_DIR, exist_ok=True)
+    path = route_index_path(index["user"])
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({"entries": index["entries"]}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _save(index):
+    try:
+        save_route_index(index)
+    except OSError as e:
+        print(f"Warning: could not persist route index: {e}")
+
+
+def route_surface(route_data):
+    """
+    Surface class of a stored route
+
+    The surface mix of a generated or snapped route is used when there is
+    one; otherwise the surface preference it was generated with.
+
+    Returns:
+        str or None: Road, Trail or Mixed, or None if it is not known
+    """
+    mix = route_data.get("surface_mix") or (route_data.get("matched") or {}).get("surface_mix")
+    if mix:
+        paved, unpaved = mix.get("paved", 0.0), mix.get("unpaved", 0.0)
+        if paved + unpaved <= 0:
+            return None
+        if paved / (paved + unpaved) >= SURFACE_MAJORITY:
+            return "Road"
+        if unpaved / (paved + unpaved) >= SURFACE_MAJORITY:
+            return "Trail"
+        return "Mixed"
+    surface = route_data.get("surface_type") or route_data.get("surfacePreference")
+    return surface if surface in ("Road", "Trail", "Mixed") else None
+
+
+def route_entry(activity):
+    """
+    Index entry of an activity's route
+
+    Returns:
+        dict or None: start (lat, lon), bbox (min_lat, min_lon, max_lat, max_lon),
+        distance (km), surface, name and stamp; None if it has no track
+    """
+    route_data = activity.get("routeData") or {}
+    coords = route_data.get("coordinates")
+    if not coords or len(coords) < 2:
+        return None
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    start = route_data.get("start_point") or coords[0]
+    return {
+        "start": [float(start[0]), float(start[1])],
+        "bbox": np.r_[coords.min(axis=0), coords.max(axis=0)].tolist(),
+        "distance": float(activity.get("distance") or route_data.get("distance") or 0.0),
+        "surface": route_surface(route_data),
+        "name": activity.get("name", ""),
+        "stamp": activity.get("updatedAt", ""),
+    }
+
+
+def index_activity(index, activity, save=True):
+    """
+    Add a saved or updated activity to the index
+
+    Args:
+        index (dict): Index from load_route_index
+        activity (dict): Activity from the API
+        save (bool): Persist the index afterwards
+
+    Returns:
+        bool: Whether the index changed
+    """
+    key = activity_key(activity)
+    with index["lock"]:
+        old = index["entries"].get(key)
+        if old is not None and old["stamp"] == activity.get("updatedAt", "") and old["stamp"]:
+            return False
+        entry = route_entry(activity)
+        if entry == old:
+            return False
+        _unindex_entry(index, key)
+        if entry is not None:
+            _index_entry(index, key, entry)
+        if save:
+            _save(index)
+    return True
+
+
+def remove_activity(index, key, save=True):
+    """Remove a deleted activity from the index"""
+    with index["lock"]:
+        if key not in index["entries"]:
+            return False
+        _unindex_entry(index, key)
+        if save:
+            _save(index)
+    return True
+
+
+def update_route_index(index, activities):
+    """
+    Index activities that are new or changed and drop deleted ones
+
+    Args:
+        index (dict): Index from load_route_index
+        activities (list): All of the user's activity dicts
+
+    Returns:
+        int: Number of activities added, changed or removed
+    """
+    keys = set()
+    changed = 0
+    for activity in activities:
+        keys.add(activity_key(activity))
+        changed += index_activity(index, activity, save=False)
+    for key in [key for key in index["entries"] if key not in keys]:
+        changed += remove_activity(index, key, save=False)
+
+    if changed:
+        _save(index)
+    return changed
+
+
+def _filter(entries, distance_km, tolerance, surface):
+    """Keep entries within the distance tolerance and of the surface (vectorized over the candidates)"""
+    keep = np.ones(len(entries), dtype=bool)
+    if distance_km:
+        distances = np.array([entry["distance"] for entry in entries])
+        keep &= np.abs(distances - distance_km) <= tolerance * distance_km
+    if surface and surface != "Any":
+        keep &= np.array([entry["surface"] == surface for entry in entries])
+    return keep
+
+
+def _ring(center, radius):
+    """Grid cells exactly radius cells away from center (Chebyshev distance)"""
+    row, col = center
+    if radius == 0:
+        return [center]
+    cells = [(row + dr, col + dc) for dr in (-radius, radius) for dc in range(-radius, radius + 1)]
+    cells += [(row + dr, col + dc) for dc in (-radius, radius) for dr in range(-radius + 1, radius)]
+    return cells
+
+
+def routes_near(index, point, k=5, radius_m=NEAR_RADIUS_M, distance_km=None, tolerance=DISTANCE_TOLERANCE,
+                surface="Any"):
+    """
+    Find the routes starting closest to a point
+
+    Rings of grid cells are searched outwards from the point's cell until k
+    routes have been found that are closer than any unsearched cell could
+    be, or the radius is covered.
+
+    Args:
+        index (dict): Index from load_route_index
+        point (tuple): (lat, lon) to search from
+        k (int): Most routes to return (None for all within the radius)
+        radius_m (float): Largest start distance in metres (None for no limit)
+        distance_km (float): Route distance to match (None for any)
+        tolerance (float): Largest relative error from distance_km
+        surface (str): Surface class to match (Any, Road, Trail, Mixed)
+
+    Returns:
+        list: (activity key, entry, start distance in m), closest first
+    """
+    if k is None and radius_m is None:
+        raise ValueError("Either k or radius_m is required")
+    lat0, lon0 = float(point[0]), float(point[1])
+    # The narrower side of a cell bounds how far each further ring is
+    cell_m = START_CELL_DEGREES * METERS_PER_DEGREE * max(math.cos(math.radians(lat0)), 1e-6)
+    max_ring = math.ceil(radius_m / cell_m) if radius_m is not None else None
+    center = _cell(lat0, lon0, START_CELL_DEGREES)
+
+    with index["lock"]:
+        total = len(index["entries"])
+        found = []
+        seen = 0
+        ring = 0
+        while seen < total and (max_ring is None or ring <= max_ring):
+            keys = [key for cell in _ring(center, ring) for key in index["starts"].get(cell, ())]
+            ring += 1
+            if not keys:
+                continue
+            seen += len(keys)
+            entries = [index["entries"][key] for key in keys]
+            starts = np.array([entry["start"] for entry in entries])
+            dy = (starts[:, 0] - lat0) * METERS_PER_DEGREE
+            dx = (starts[:, 1] - lon0) * METERS_PER_DEGREE * math.cos(math.radians(lat0))
+            distances = np.hypot(dx, dy)
+            keep = _filter(entries, distance_km, tolerance, surface)
+            if radius_m is not None:
+                keep &= distances <= radius_m
+            found.extend((keys[i], entries[i], float(distances[i])) for i in np.flatnonzero(keep))
+            # Every start in a ring not searched yet is at least (ring - 1) cells away
+            if k is not None and len(found) >= k:
+                found.sort(key=lambda match: match[2])
+                if found[k - 1][2] <= (ring - 1) * cell_m:
+                    break
+
+    found.sort(key=lambda match: match[2])
+    return found[:k] if k is not None else found
+
+
+def routes_through(index, point, radius_m=0.0, distance_km=None, tolerance=DISTANCE_TOLERANCE, surface="Any"):
+    """
+    Find the routes whose bounding box comes within radius_m of a point
+
+    A cheap superset of the routes passing near the point; check the
+    geometry of the few returned if an exact answer is needed.
+
+    Args:
+        index (dict): Index from load_route_index
+        point (tuple): (lat, lon)
+        radius_m (float): Distance in metres the bounding boxes are grown by
+        distance_km (float): Route distance to match (None for any)
+        tolerance (float): Largest relative error from distance_km
+        surface (str): Surface class to match (Any, Road, Trail, Mixed)
+
+    Returns:
+        list: (activity key, entry, distance from the bounding box in m), closest first
+    """
+    lat0, lon0 = float(point[0]), float(point[1])
+    pad_lat = radius_m / METERS_PER_DEGREE
+    pad_lon = pad_lat / max(math.cos(math.radians(lat0)), 1e-6)
+
+    with index["lock"]:
+        keys = set()
+        for cell in _box_cells((lat0 - pad_lat, lon0 - pad_lon, lat0 + pad_lat, lon0 + pad_lon)):
+            keys.update(index["boxes"].get(cell, ()))
+        keys = list(keys)
+        entries = [index["entries"][key] for key in keys]
+    if not entries:
+        return []
+
+    boxes = np.array([entry["bbox"] for entry in entries])
+    dy = np.maximum(np.maximum(boxes[:, 0] - lat0, lat0 - boxes[:, 2]), 0.0) * METERS_PER_DEGREE
+    dx = (np.maximum(np.maximum(boxes[:, 1] - lon0, lon0 - boxes[:, 3]), 0.0)
+          * METERS_PER_DEGREE * math.cos(math.radians(lat0)))
+    distances = np.hypot(dx, dy)
+    keep = _filter(entries, distance_km, tolerance, surface) & (distances <= radius_m)
+    found = [(keys[i], entries[i], float(distances[i])) for i in np.flatnonzero(keep)]
+    return sorted(found, key=lambda match: match[2])
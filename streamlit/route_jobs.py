@@ -0,0 +1,174 @@
+import os
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Threads running route jobs for all Streamlit sessions of this server
+ROUTE_JOB_WORKERS = int(os.environ.get("ROUTE_JOB_WORKERS", "4"))
+
+# Seconds a finished job is kept for its session to pick up
+JOB_TTL = 600
+
+# Phases a route job goes through, in order
+PHASES = ["queued", "geocode", "graph load", "search", "export", "refine", "done"]
+
+_executor = ThreadPoolExecutor(max_workers=ROUTE_JOB_WORKERS, thread_name_prefix="route-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def submit_job(fn, *args, **kwargs):
+    """
+    Run fn(*args, progress=..., publish=..., **kwargs) in the background
+
+    Args:
+        fn (callable): Work to run; it receives a progress(phase) callback and a
+            publish(result) callback for results it hands out before returning
+
+    Returns:
+        str: Job id for get_job
+    """
+    job_id = uuid.uuid4().hex
+    now = time.time()
+    with _jobs_lock:
+        _expire_jobs(now)
+        _jobs[job_id] = {"id": job_id, "phase": "queued", "status": "running", "result": None,
+                         "revision": 0, "error": None, "started": now, "updated": now}
+    _executor.submit(_run, job_id, fn, args, kwargs)
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Get a snapshot of a job
+
+    Args:
+        job_id (str): Id returned by submit_job
+
+    Returns:
+        dict or None: Job with id, phase, status ("running", "refining", "done", "failed"),
+        result, revision (bumped whenever the result changes) and error
+    """
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job is not None else None
+
+
+def phase_progress(phase):
+    """Fraction of the work done when a phase starts (for progress bars)"""
+    if phase not in PHASES:
+        return 0.0
+    return PHASES.index(phase) / (len(PHASES) - 1)
+
+
+def _update(job_id, **fields):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            job.update(fields, updated=time.time())
+
+
+def _set_result(job_id, result, **fields):
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is not None:
+            if result is not job["result"]:
+                job["revision"] += 1
+            job.update(fields, result=result, updated=time.time())
+
+
+def _run(job_id, fn, args, kwargs):
+    try:
+        # A published result is shown while the job keeps improving it ("refining")
+        result = fn(*args, progress=lambda phase: _update(job_id, phase=phase),
+                    publish=lambda result: _set_result(job_id, result, status="refining"), **kwargs)
+        _set_result(job_id, result, phase="done", status="done")
+    except Exception as e:
+        print(f"Route job {job_id} failed: {e}")
+        _update(job_id, status="failed", error=str(e))
+
+
+def _expire_jobs(now):
+    """Forget jobs that finished long ago (called with the lock held)"""
+    for job_id in [j for j, job in _jobs.items()
+                   if job["status"] in ("done", "failed") and now - job["updated"] > JOB_TTL]:
+        del _jobs[job_id]
+
+
+def route_job(start_location, distance, surface_preference, api_url=None, headers=None, progress=None,
+              publish=None, refine_time=None):
+    """
+    Generate a route and its GPX export, for running with submit_job
+
+    The backend API is tried first when api_url and headers are given
+    (authenticated sessions); local generation is the fallback. A route
+    found on the street graph is published right away and then refined
+    (routing.refine_route); every better loop replaces the job's result.
+
+    Args:
+        start_location (str): Address or location name
+        distance (float): Desired distance in kilometers
+        surface_preference (str): Preferred surface type
+        api_url (str): Backend API URL, captured from the session
+        headers (dict): Request headers with the session's auth token
+        progress (callable): Phase callback supplied by submit_job
+        publish (callable): Result callback supplied by submit_job
+        refine_time (float): Seconds to refine a graph route (defaults to ROUTE_REFINE_TIME)
+
+    Returns:
+        dict: route_data, gpx and gpx_lite (str or None), source ("api" or "local") and api_error
+    """
+    # Imported here so the job module can be loaded before routing's optional imports run
+    from api import generate_route as api_generate_route
+    from routing import generate_route, refine_route, ROUTE_REFINE_TIME
+
+    api_error = None
+    route_data = None
+    source = "local"
+    if api_url is not None:
+        success, api_route_data = api_generate_route(start_location, distance, surface_preference,
+                                                     api_url=api_url, headers=headers)
+        if success:
+            route_data = api_route_data
+            source = "api"
+        else:
+            api_error = api_route_data
+
+    if route_data is None:
+        route_data = generate_route(start_location, distance, surface_preference, progress=progress)
+
+    if progress is not None:
+        progress("export")
+    result = dict(_export(route_data), route_data=route_data, source=source, api_error=api_error)
+
+    if refine_time is None:
+        refine_time = ROUTE_REFINE_TIME
+    # Only graph routes have a score to beat
+    if publish is not None and refine_time > 0 and "score" in route_data:
+        publish(result)
+        if progress is not None:
+            progress("refine")
+
+        def improved(better):
+            nonlocal result
+            result = dict(result, route_data=better, **_export(better))
+            publish(result)
+
+        refine_route(route_data, distance, surface_preference, refine_time, on_improvement=improved)
+
+    return result
+
+
+def _export(route_data):
+    """GPX exports of a route (None where gpxpy is missing or the export fails)"""
+    from routing import create_gpx, available_packages
+
+    gpx_data = gpx_lite = None
+    if available_packages.get('gpxpy', False):
+        try:
+            gpx_data = create_gpx(route_data)
+            gpx_lite = create_gpx(route_data, lite=True)
+        except Exception as e:
+            print(f"Error creating GPX file: {e}")
+    return {"gpx": gpx_data, "gpx_lite": gpx_lite}
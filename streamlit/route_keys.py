@@ -0,0 +1,23 @@
+import json
+import hashlib
+
+
+def route_hash(coords):
+    """
+    Get a short content hash of a route's coordinates
+
+    Args:
+        coords (list): (lat, lon) points
+
+    Returns:
+        str: Hex digest identifying the geometry
+    """
+    data = json.dumps([[round(lat, 7), round(lon, 7)] for lat, lon in coords], separators=(",", ":"))
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()[:16]
+
+
+def activity_key(activity):
+    """Key identifying an activity in the per-user caches (heatmap, records, goals, indexes)"""
+    if activity.get('_id'):
+        return str(activity['_id'])
+    return route_hash(activity.get('routeData', {}).get('coordinates', []))
@@ -0,0 +1,291 @@
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from single_flight import SingleFlight
+
+# Worker processes computing routes
+SERVICE_WORKERS = int(os.environ.get("ROUTE_SERVICE_WORKERS", "0")) or os.cpu_count() or 1
+
+# Distinct route computations allowed to queue before new ones are turned away
+SERVICE_MAX_PENDING = int(os.environ.get("ROUTE_SERVICE_MAX_PENDING", "0")) or SERVICE_WORKERS * 4
+
+# Seconds a caller waits for its route before getting a 504
+SERVICE_TIMEOUT = float(os.environ.get("ROUTE_SERVICE_TIMEOUT", "30"))
+
+# Graph tiles loaded by every worker at startup: "lat,lon,km,surface;..."
+SERVICE_PREWARM = os.environ.get("ROUTE_SERVICE_PREWARM", "")
+
+# Latency samples kept for the metrics endpoint
+LATENCY_WINDOW = 1000
+
+
+def parse_prewarm(spec):
+    """
+    Parse a prewarm spec into tile requests
+
+    Args:
+        spec (str): "lat,lon,km[,surface];..." entries
+
+    Returns:
+        list: (start_point, distance, surface_preference) tuples
+    """
+    tiles = []
+    for entry in filter(None, (part.strip() for part in spec.split(";"))):
+        fields = [field.strip() for field in entry.split(",")]
+        surface = fields[3] if len(fields) > 3 else "Any"
+        tiles.append(((float(fields[0]), float(fields[1])), float(fields[2]), surface))
+    return tiles
+
+
+def _prewarm_worker(tiles):
+    """Load the prewarm tiles into a worker's memory cache"""
+    # Imported in the worker so the parent process stays light
+    from routing import get_surface_filter
+    from graph_cache import load_graph_tile
+
+    for start_point, distance, surface in tiles:
+        try:
+            highway_filter, handle_missing_surface = get_surface_filter(surface)
+            load_graph_tile(start_point, distance, surface, highway_filter, handle_missing_surface)
+        except Exception as e:
+            print(f"Could not prewarm tile at {start_point}: {e}")
+
+
+def _ping():
+    """No-op task used to start every worker (and run its prewarm) up front"""
+    return os.getpid()
+
+
+def _generate(start_location, distance, surface_preference, start_point=None):
+    """Compute one route in a worker process"""
+    from routing import generate_route, generate_graph_route
+
+    if start_point is not None:
+        return generate_graph_route(tuple(start_point), distance, surface_preference)
+    return generate_route(start_location, distance, surface_preference)
+
+
+class ServiceBusyError(Exception):
+    """Raised when SERVICE_MAX_PENDING computations are already queued or running"""
+
+
+class RouteService:
+    """
+    Route computation shared by all HTTP handler threads
+
+    Identical requests that arrive while one is being computed wait for that
+    computation instead of starting their own. New distinct requests are
+    rejected once SERVICE_MAX_PENDING computations are queued or running in
+    the pool, including ones whose callers have already timed out.
+    """
+
+    def __init__(self, workers=SERVICE_WORKERS, max_pending=SERVICE_MAX_PENDING, prewarm=()):
+        self.pool = ProcessPoolExecutor(max_workers=workers, initializer=_prewarm_worker,
+                                        initargs=(list(prewarm),))
+        self.workers = workers
+        self.max_pending = max_pending
+        self.prewarm = list(prewarm)
+        self.started = time.time()
+        self.lock = threading.Lock()
+        self.flights = SingleFlight()
+        # Pool tasks submitted and not yet finished (reserved under self.lock)
+        self.pending = 0
+        self.latencies = []
+        self.counters = {"requests": 0, "computed": 0, "coalesced": 0, "rejected": 0,
+                         "errors": 0, "timeouts": 0}
+
+        # Start all workers now so prewarming happens before the first request
+        for _ in range(workers):
+            self.pool.submit(_ping)
+
+    def request_key(self, payload):
+        """Key identifying requests that produce the same route"""
+        return (
+            str(payload.get("startLocation", "")).strip().lower(),
+            tuple(payload["startPoint"]) if payload.get("startPoint") else None,
+            round(float(payload["distance"]), 2),
+            payload.get("surfacePreference", "Any"),
+        )
+
+    def generate(self, payload):
+        """
+        Get the route for a request, sharing work with identical in-flight requests
+
+        Args:
+            payload (dict): startLocation or startPoint, distance and surfacePreference
+
+        Returns:
+            tuple: (HTTP status, response dict)
+        """
+        started = time.perf_counter()
+        key = self.request_key(payload)
+
+        with self.lock:
+            self.counters["requests"] += 1
+
+        try:
+            route, shared = self.flights.do_shared(key, self._compute, payload, key)
+        except ServiceBusyError:
+            with self.lock:
+                self.counters["rejected"] += 1
+            return 503, {"message": "Route service is busy, try again shortly"}
+        except FutureTimeoutError:
+            with self.lock:
+                self.counters["timeouts"] += 1
+            return 504, {"message": "Route generation timed out"}
+        except Exception as e:
+            with self.lock:
+                self.counters["errors"] += 1
+            return 500, {"message": f"Error generating route: {e}"}
+
+        with self.lock:
+            self.counters["coalesced" if shared else "computed"] += 1
+            self.latencies.append((time.perf_counter() - started) * 1000)
+            del self.latencies[:-LATENCY_WINDOW]
+        return 200, route
+
+    def _compute(self, payload, key):
+        # The slot is reserved and checked in one step, and only freed when the
+        # pool task finishes, so work left behind by a timeout still counts
+        with self.lock:
+            if self.pending >= self.max_pending:
+                raise ServiceBusyError()
+            self.pending += 1
+        try:
+            future = self.pool.submit(_generate, payload.get("startLocation", ""), key[2], key[3],
+                                      payload.get("startPoint"))
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=SERVICE_TIMEOUT)
+        except FutureTimeoutError:
+            # Drops the task if it has not started yet
+            future.cancel()
+            raise
+
+    def _release(self, future=None):
+        with self.lock:
+            self.pending -= 1
+
+    def metrics(self):
+        """Counters, queue depth and latency percentiles"""
+        with self.lock:
+            latencies = sorted(self.latencies)
+            metrics = dict(self.counters)
+            metrics.update({
+                "in_flight": len(self.flights),
+                "pending": self.pending,
+                "max_pending": self.max_pending,
+                "workers": self.workers,
+                "prewarmed_tiles": len(self.prewarm),
+                "uptime_s": round(time.time() - self.started),
+            })
+        if latencies:
+            metrics["latency_ms"] = {
+                "p50": round(latencies[len(latencies) // 2], 1),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 1),
+                "p99": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))], 1),
+                "max": round(latencies[-1], 1),
+            }
+        return metrics
+
+
+def _valid_point(point):
+    """Whether point is a [lat, lon] pair of finite numbers in range"""
+    if not isinstance(point, (list, tuple)) or len(point) != 2:
+        return False
+    if not all(isinstance(v, (int, float)) and not isinstance(v, bool) and math.isfinite(v) for v in point):
+        return False
+    return -90 <= point[0] <= 90 and -180 <= point[1] <= 180
+
+
+class RouteRequestHandler(BaseHTTPRequestHandler):
+    """HTTP front end; the RouteService is attached to the server"""
+
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if status == 503:
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == "/health":
+            self._send(200, {"status": "ok", "in_flight": len(service.flights)})
+        elif self.path == "/metrics":
+            self._send(200, service.metrics())
+        else:
+            self._send(404, {"message": "Not found"})
+
+    def do_POST(self):
+        if self.path not in ("/generate", "/api/activity/generate"):
+            self._send(404, {"message": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            distance = float(payload["distance"])
+            if not math.isfinite(distance) or distance <= 0:
+                raise ValueError("distance must be a positive number")
+            if not payload.get("startLocation") and not payload.get("startPoint"):
+                raise ValueError("startLocation or startPoint is required")
+            if payload.get("startPoint") and not _valid_point(payload["startPoint"]):
+                raise ValueError("startPoint must be [lat, lon]")
+        except (KeyError, TypeError, ValueError) as e:
+            self._send(400, {"message": f"Invalid request: {e}"})
+            return
+
+        status, body = self.server.service.generate(payload)
+        self._send(status, body)
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} - {format % args}")
+
+
+def serve(host="127.0.0.1", port=8000, workers=SERVICE_WORKERS, max_pending=SERVICE_MAX_PENDING,
+          prewarm=()):
+    """Run the route service until interrupted"""
+    server = ThreadingHTTPServer((host, port), RouteRequestHandler)
+    server.daemon_threads = True
+    server.service = RouteService(workers, max_pending, prewarm)
+    print(f"Route service listening on http://{host}:{port} with {workers} workers")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve route generation over HTTP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS)
+    parser.add_argument("--max-pending", type=int, default=SERVICE_MAX_PENDING)
+    parser.add_argument("--prewarm", default=SERVICE_PREWARM, help='Tiles to preload: "lat,lon,km[,surface];..."')
+    args = parser.parse_args(argv)
+
+    serve(args.host, args.port, args.workers, args.max_pending, parse_prewarm(args.prewarm))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,346 @@
+import os
+import json
+import math
+import hashlib
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from route_keys import activity_key
+from simplify import project, douglas_peucker, METERS_PER_DEGREE
+
+# Where per-user route groups are persisted between runs
+SIMILARITY_CACHE_DIR = os.environ.get(
+    "SMARTRUNNING_SIMILARITY_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".similarity_cache")
+)
+
+# Routes whose Hausdorff distance is below this (m) are the same route
+SAME_ROUTE_M = 60.0
+
+# Geometry kept per route group: simplification tolerance (m) and point cap
+SIGNATURE_TOLERANCE_M = 15.0
+SIGNATURE_MAX_POINTS = 100
+
+# Points compared at a time, so a clear mismatch stops early
+HAUSDORFF_CHUNK = 256
+
+# Size of the coarse grid (degrees of latitude) routes are indexed by, by centroid
+CELL_DEGREES = 0.01
+
+# Candidates must have lengths within this ratio and bounding boxes overlapping this much
+LENGTH_RATIO = 0.8
+MIN_BBOX_OVERLAP = 0.5
+
+# In-memory indexes by user
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def route_signature(coords):
+    """
+    Simplified geometry and coarse summary of a route
+
+    Args:
+        coords (array-like): (lat, lon) points
+
+    Returns:
+        dict: coords (simplified array), bbox (min_lat, min_lon, max_lat, max_lon),
+        length (m) and cell (grid cell of the centroid)
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    xy = project(coords)
+    seg = np.hypot(*np.diff(xy, axis=0).T)
+    length = float(seg.sum())
+    # Length-weighted centroid, so point density does not move it
+    mid = (coords[:-1] + coords[1:]) / 2 if len(coords) > 1 else coords
+    weights = seg if len(coords) > 1 and length > 0 else None
+    centroid = np.average(mid, axis=0, weights=weights)
+    simplified = douglas_peucker(coords, SIGNATURE_TOLERANCE_M, SIGNATURE_MAX_POINTS)
+    return {
+        "coords": simplified,
+        "bbox": tuple(np.r_[coords.min(axis=0), coords.max(axis=0)].tolist()),
+        "length": length,
+        "cell": (int(math.floor(centroid[0] / CELL_DEGREES)), int(math.floor(centroid[1] / CELL_DEGREES))),
+    }
+
+
+def densify(xy, spacing):
+    """Points along a polyline no more than spacing apart (vertices included)"""
+    seg = np.hypot(*np.diff(xy, axis=0).T)
+    arc = np.r_[0.0, np.cumsum(seg)]
+    if arc[-1] == 0:
+        return xy[:1]
+    positions = np.union1d(arc, np.linspace(0, arc[-1], int(arc[-1] // spacing) + 2))
+    return np.column_stack([np.interp(positions, arc, xy[:, 0]), np.interp(positions, arc, xy[:, 1])])
+
+
+def directed_hausdorff(points, line, limit=None):
+    """
+    Largest distance from any of the points to a polyline
+
+    Distances to every segment are computed as one (points x segments)
+    array per chunk of points.
+
+    Args:
+        points (np.ndarray): (n, 2) planar points
+        line (np.ndarray): (m, 2) planar polyline
+        limit (float): Return as soon as the distance is known to exceed this
+
+    Returns:
+        float: Distance in the points' units
+    """
+    if len(line) == 1:
+        return float(np.hypot(*(points - line[0]).T).max())
+    a = line[:-1]
+    d = line[1:] - a
+    length_sq = np.maximum((d * d).sum(axis=1), 1e-12)
+    worst = 0.0
+    for start in range(0, len(points), HAUSDORFF_CHUNK):
+        rel = points[start:start + HAUSDORFF_CHUNK, None, :] - a[None, :, :]
+        t = np.clip((rel[..., 0] * d[:, 0] + rel[..., 1] * d[:, 1]) / length_sq, 0.0, 1.0)
+        dx = rel[..., 0] - t * d[:, 0]
+        dy = rel[..., 1] - t * d[:, 1]
+        worst = max(worst, float(np.sqrt((dx * dx + dy * dy).min(axis=1).max())))
+        if limit is not None and worst > limit:
+            break
+    return worst
+
+
+def hausdorff(coords_a, coords_b, limit=None):
+    """
+    Hausdorff distance between two routes in metres
+
+    The vertices of each route are checked against the other first, which
+    rejects most non-matches cheaply. The routes are then densified to
+    points half the limit apart (so the result is within a quarter of the
+    limit of the exact distance) and compared against each other's segments.
+
+    Args:
+        coords_a (array-like): (lat, lon) points
+        coords_b (array-like): (lat, lon) points
+        limit (float): Stop as soon as the distance is known to exceed this
+
+    Returns:
+        float: Distance in metres
+    """
+    coords_a = np.asarray(coords_a, dtype=np.float64).reshape(-1, 2)
+    coords_b = np.asarray(coords_b, dtype=np.float64).reshape(-1, 2)
+    lat0 = coords_a[0, 0]
+    xy_a, xy_b = project(coords_a, lat0), project(coords_b, lat0)
+    spacing = (limit or SAME_ROUTE_M) / 2
+    distance = 0.0
+    for points, line in ((xy_a, xy_b), (xy_b, xy_a), (densify(xy_a, spacing), xy_b), (densify(xy_b, spacing), xy_a)):
+        distance = max(distance, directed_hausdorff(points, line, limit))
+        if limit is not None and distance > limit:
+            break
+    return distance
+
+
+def similarity_path(user_key):
+    """Get the on-disk path of a user's route groups"""
+    name = hashlib.sha1(str(user_key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(SIMILARITY_CACHE_DIR, f"routes_{name}.npz")
+
+
+def _empty_index(user_key):
+    return {"user": user_key, "routes": {}, "groups": {}, "cells": {}, "next_group": 0,
+            "lock": threading.Lock()}
+
+
+def _index_group(index, group_id, group):
+    index["groups"][group_id] = group
+    index["cells"].setdefault(tuple(group["cell"]), set()).add(group_id)
+
+
+def load_similarity(user_key):
+    """
+    Get a user's route groups from memory or disk (empty if there are none yet)
+
+    Args:
+        user_key (str): User id
+
+    Returns:
+        dict: Index with routes (key -> group id), groups (one geometry and the
+        member keys each) and the cell -> group ids grid
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required for route similarity")
+
+    with _indexes_lock:
+        if user_key in _indexes:
+            return _indexes[user_key]
+
+    index = _empty_index(user_key)
+    path = similarity_path(user_key)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            coords = data["coords"]
+            offsets = data["offsets"]
+        for i, group in enumerate(meta["groups"]):
+            group["coords"] = coords[offsets[i]:offsets[i + 1]]
+            group["bbox"] = tuple(group["bbox"])
+            group["cell"] = tuple(group["cell"])
+            group_id = group.pop("id")
+            _index_group(index, group_id, group)
+        index["routes"] = meta["routes"]
+        index["next_group"] = meta["next_group"]
+
+    with _indexes_lock:
+        return _indexes.setdefault(user_key, index)
+
+
+def save_similarity(index):
+    """Persist route groups, with all group geometries in one array"""
+    os.makedirs(SIMILARITY_CACHE_DIR, exist_ok=True)
+    groups = []
+    parts = []
+    for group_id, group in index["groups"].items():
+        groups.append({"id": group_id, "bbox": list(group["bbox"]), "length": group["length"],
+                       "cell": list(group["cell"]), "members": group["members"]})
+        parts.append(group["coords"])
+    offsets = np.cumsum([0] + [len(part) for part in parts])
+    meta = {"routes": index["routes"], "next_group": index["next_group"], "groups": groups}
+    np.savez(similarity_path(index["user"]), meta=np.array(json.dumps(meta)),
+             coords=np.concatenate(parts) if parts else np.zeros((0, 2)), offsets=offsets)
+
+
+def _candidates(index, signature):
+    """Groups near a signature whose length and bounding box could match (vectorized filter)"""
+    row, col = signature["cell"]
+    ids = [group_id for dr in (-1, 0, 1) for dc in (-1, 0, 1)
+           for group_id in index["cells"].get((row + dr, col + dc), ())]
+    if not ids:
+        return []
+    groups = index["groups"]
+    lengths = np.array([groups[group_id]["length"] for group_id in ids])
+    boxes = np.array([groups[group_id]["bbox"] for group_id in ids])
+    box = np.array(signature["bbox"])
+
+    ratio = np.minimum(lengths, signature["length"]) / np.maximum(np.maximum(lengths, signature["length"]), 1e-9)
+    # Boxes grow by the match distance so short or straight routes still overlap
+    pad = SAME_ROUTE_M / METERS_PER_DEGREE
+    low = np.maximum(boxes[:, :2], box[:2]) - pad
+    high = np.minimum(boxes[:, 2:], box[2:]) + pad
+    inter = np.prod(np.clip(high - low, 0, None), axis=1)
+    area = lambda b: np.prod(b[..., 2:] - b[..., :2] + 2 * pad, axis=-1)
+    union = area(boxes) + area(box) - inter
+    keep = (ratio >= LENGTH_RATIO) & (inter / union >= MIN_BBOX_OVERLAP)
+    return [group_id for group_id, kept in zip(ids, keep) if kept]
+
+
+def find_matches(index, coords, threshold=SAME_ROUTE_M, signature=None):
+    """
+    Find route groups that a route is the same as
+
+    Args:
+        index (dict): Index from load_similarity
+        coords (array-like): (lat, lon) points
+        threshold (float): Largest Hausdorff distance in metres
+        signature (dict): Precomputed route_signature(coords)
+
+    Returns:
+        list: (group id, distance in m) of matching groups, closest first
+    """
+    signature = signature or route_signature(coords)
+    matches = []
+    for group_id in _candidates(index, signature):
+        distance = hausdorff(signature["coords"], index["groups"][group_id]["coords"], limit=threshold)
+        if distance <= threshold:
+            matches.append((group_id, distance))
+    return sorted(matches, key=lambda match: match[1])
+
+
+def add_route(index, key, coords):
+    """
+    Add a route to the group it repeats, or start a new group
+
+    Only the first route of a group keeps its (simplified) geometry; the
+    others are stored as references to it.
+
+    Args:
+        index (dict): Index from load_similarity
+        key (str): Activity key
+        coords (array-like): (lat, lon) points
+
+    Returns:
+        int: Group id
+    """
+    signature = route_signature(coords)
+    with index["lock"]:
+        if key in index["routes"]:
+            return index["routes"][key]
+        matches = find_matches(index, coords, signature=signature)
+        if matches:
+            group_id = matches[0][0]
+            index["groups"][group_id]["members"].append(key)
+        else:
+            group_id = index["next_group"]
+            index["next_group"] += 1
+            _index_group(index, group_id, dict(signature, members=[key]))
+        index["routes"][key] = group_id
+    return group_id
+
+
+def remove_route(index, key):
+    """Remove a deleted activity; its group goes once it has no members left"""
+    with index["lock"]:
+        group_id = index["routes"].pop(key, None)
+        if group_id is None:
+            return
+        group = index["groups"][group_id]
+        group["members"].remove(key)
+        if not group["members"]:
+            del index["groups"][group_id]
+            index["cells"][tuple(group["cell"])].discard(group_id)
+
+
+def update_similarity(index, activities):
+    """
+    Group activities that are not in the index yet and drop deleted ones
+
+    Args:
+        index (dict): Index from load_similarity
+        activities (list): All of the user's activity dicts
+
+    Returns:
+        int: Number of activities added or removed
+    """
+    tracks = {}
+    for activity in activities:
+        coords = (activity.get("routeData") or {}).get("coordinates")
+        if coords and len(coords) > 1:
+            tracks[activity_key(activity)] = coords
+
+    removed = [key for key in index["routes"] if key not in tracks]
+    for key in removed:
+        remove_route(index, key)
+    added = [key for key in tracks if key not in index["routes"]]
+    for key in added:
+        add_route(index, key, tracks[key])
+
+    if added or removed:
+        try:
+            save_similarity(index)
+        except OSError as e:
+            print(f"Warning: could not persist route groups: {e}")
+    return len(added) + len(removed)
+
+
+def route_group(index, key):
+    """
+    Group of an activity's route
+
+    Returns:
+        dict or None: coords (the group's one stored geometry) and members (activity keys)
+    """
+    group_id = index["routes"].get(key)
+    if group_id is None:
+        return None
+    group = index["groups"][group_id]
+    return {"coords": group["coords"], "members": list(group["members"])}
@@ -1,6 +1,8 @@
 import random
 import sys
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 
 # Dict to track which packages are available
 available_packages = {}
@@ -26,6 +28,7 @@ check_package('folium')
 check_package('gpxpy')
 
 # Only import if available
+geolocator = None
 if available_packages['numpy']:
     import numpy as np
 if available_packages['geopy']:
@@ -48,14 +51,49 @@ if available_packages['gpxpy']:
     import gpxpy
     import gpxpy.gpx
 
-def generate_route(start_location, distance, surface_preference="Any"):
+from graph_cache import load_graph_tile, start_nodes
+from graph_pruning import prune_graph
+from loop_search import find_loops, expand_loop, loop_coordinates, elevation_gain
+from loop_library import load_library, lookup as lookup_loop
+from parallel_search import parallel_find_loops
+from single_flight import SingleFlight
+from simplify import simplify_coordinates, GPX_LITE_TOLERANCE_M
+from resample import resample_coordinates
+
+# Seconds pruning and the loop search may take (after the tile is loaded) before returning the best
+# candidate so far; only the first candidate may run past it
+ROUTE_TIME_BUDGET = float(os.environ.get("ROUTE_TIME_BUDGET", "2.0"))
+
+# Seconds a route job keeps searching for a better loop after returning its first route (0: off)
+ROUTE_REFINE_TIME = float(os.environ.get("ROUTE_REFINE_TIME", "10.0"))
+
+# Seconds a request waits for its graph tile (a cold download) before giving up; the load
+# carries on in the background, so a later request finds the tile cached (0: no limit)
+ROUTE_LOAD_TIMEOUT = float(os.environ.get("ROUTE_LOAD_TIMEOUT", "20.0"))
+
+# Threads loading graph tiles, so a request can stop waiting for a slow download
+_tile_loader = ThreadPoolExecutor(max_workers=4, thread_name_prefix="tile-load")
+
+# Identical concurrent route requests and geocode lookups share one computation
+_route_flight = SingleFlight()
+_geocode_flight = SingleFlight()
+
+# "inline" searches in the calling thread, "process" spreads candidates over a process pool
+ROUTE_EXECUTION_MODE = os.environ.get("ROUTE_EXECUTION_MODE", "inline")
+
+def generate_route(start_location, distance, surface_preference="Any", time_budget=None, progress=None):
     """
     Generate a running route based on the given parameters
     
+    Concurrent calls with the same parameters share one computation.
+    
     Args:
         start_location (str): Address or location name
         distance (float): Desired distance in kilometers
         surface_preference (str): Preferred surface type (Any, Road, Trail, Mixed)
+        time_budget (float): Seconds the loop search may take (defaults to ROUTE_TIME_BUDGET)
+        progress (callable): Called with the name of each phase ("geocode", "graph load", "search")
+            as it starts; only the caller that runs a shared computation receives it
         
     Returns:
         dict: Route data including coordinates, distance, and metadata
@@ -63,6 +101,13 @@ def generate_route(start_location, distance, surface_preference="Any"):
     Raises:
         ValueError: If required packages are missing or location cannot be geocoded
     """
+    key = (str(start_location).strip().lower(), round(float(distance), 2), surface_preference, time_budget)
+    route_data = _route_flight.do(key, _generate_route, start_location, distance, surface_preference, time_budget,
+                                  progress)
+    # Callers share the result, so each gets its own top-level dict
+    return dict(route_data)
+
+def _generate_route(start_location, distance, surface_preference, time_budget, progress=None):
     missing_packages = []
     # Check if required packages are available
     for package in ['numpy', 'geopy']:
@@ -91,7 +136,9 @@ def generate_route(start_location, distance, surface_preference="Any"):
             }
         else:
             try:
-                location = geolocator.geocode(start_location)
+                if progress is not None:
+                    progress("geocode")
+                location = geocode_location(start_location)
                 if not location:
                     error_msg = f"Could not find location: {start_location}. Please enter a valid location."
                     print(error_msg)
@@ -105,7 +152,7 @@ def generate_route(start_location, distance, surface_preference="Any"):
                         "error": error_msg
                     }
                 else:
-                    start_point = (location.latitude, location.longitude)
+                    start_point = location
             except:
                 error_msg = f"Error geocoding location: {start_location}. Please check the input."
                 print(error_msg)
@@ -121,12 +168,6 @@ def generate_route(start_location, distance, surface_preference="Any"):
         
         print(f"Generating route from {start_point} for {distance} km on {surface_preference}")
         
-        # In a full implementation, we would:
-        # 1. Download the street network using OSMnx
-        # 2. Apply filters based on surface preference
-        # 3. Use NetworkX to generate routes of specified distance
-        # 4. Return the optimal route
-        
         # Check if OSMnx is available to generate a real route
         if not available_packages.get('osmnx', False) or not available_packages.get('networkx', False):
             return {
@@ -139,37 +180,28 @@ def generate_route(start_location, distance, surface_preference="Any"):
                 "error": "Required routing libraries (osmnx, networkx) not available. Using a simplified route."
             }
         
-        # For this placeholder, we'll return a simple dictionary with mock data
-        
-        # Get surface filter for this preference
-        surface_filter, handle_missing_surface = get_surface_filter(surface_preference)
-        
-        # In a real implementation, we'd use these filters with OSMnx:
-        # G = ox.graph_from_point(start_point, dist=distance*1000/2, filters=surface_filter)
-        # Then process the graph to handle edges with missing surface tags using handle_missing_surface function
+        # Search for a loop on the cached street network
+        try:
+            return generate_graph_route(start_point, distance, surface_preference, time_budget=time_budget,
+                                        progress=progress)
+        except Exception as e:
+            print(f"Warning: graph route search failed, using a circular route instead: {e}")
         
-        # Generate a simple circular route as a placeholder
-        # In a real implementation, this would be replaced with actual routing logic
+        # Fall back to a simple circular route
         if available_packages.get('numpy', False):
             # Use numpy for calculation if available
             # Make distance calculation more precise by adjusting the radius
             # A proper circle with circumference = distance
             radius_km = distance / (2 * np.pi)  # Exact calculation for a circular route
-            num_points = int(distance * 10)  # 10 points per km for smooth route
+            num_points = max(int(distance * 200), 64)  # Dense outline (every ~5 m), resampled below
             
-            route_coords = []
-            for i in range(num_points):
-                angle = 2 * np.pi * i / num_points
-                # Convert km to latitude/longitude degrees (approximate)
-                lat_offset = radius_km * np.cos(angle) / 111.32
-                lng_offset = radius_km * np.sin(angle) / (111.32 * np.cos(start_point[0] * np.pi / 180))
-                
-                lat = start_point[0] + lat_offset
-                lng = start_point[1] + lng_offset
-                route_coords.append((lat, lng))
+            angles = np.linspace(0, 2 * np.pi, num_points + 1)  # Last point closes the loop
+            # Convert km to latitude/longitude degrees (approximate)
+            lats = start_point[0] + radius_km * np.cos(angles) / 111.32
+            lngs = start_point[1] + radius_km * np.sin(angles) / (111.32 * np.cos(start_point[0] * np.pi / 180))
             
-            # Add the start point to close the loop
-            route_coords.append(route_coords[0])
+            # Keep only as many points as the curve needs
+            route_coords = [tuple(point) for point in resample_coordinates(np.column_stack([lats, lngs]), "storage")]
         else:
             # Fallback to a simpler calculation if numpy is not available
             import math
@@ -247,12 +279,194 @@ def generate_route(start_location, distance, surface_preference="Any"):
             "error": error_msg
         }
 
-def create_gpx(route_data):
+def geocode_location(start_location):
+    """
+    Look up the coordinates of an address or location name
+    
+    Args:
+        start_location (str): Address or location name
+        
+    Returns:
+        tuple or None: (lat, lon), or None if the location was not found
+    """
+    if geolocator is None:
+        raise ValueError("Geocoding service not available")
+    return _geocode_flight.do(str(start_location).strip().lower(), _geocode, start_location)
+
+def _geocode(start_location):
+    location = geolocator.geocode(start_location)
+    if not location:
+        return None
+    return (location.latitude, location.longitude)
+
+def generate_graph_route(start_point, distance, surface_preference="Any", time_budget=None,
+                         num_candidates=None, seed=None, on_improvement=None, use_library=True,
+                         execution_mode=None, progress=None, load_timeout=None):
+    """
+    Generate a loop on the cached street network
+    
+    The start is snapped to the nearest street, the tile is pruned to what a
+    loop of this length can reach, and the best scoring candidate loop found
+    within the time budget is returned. The budget starts once the tile is
+    loaded and covers pruning and the search; loading the tile is bounded
+    separately by load_timeout, so a slow first download does not cut the
+    search short.
+    
+    Args:
+        start_point (tuple): (lat, lon) of the start
+        distance (float): Desired distance in kilometers
+        surface_preference (str): Preferred surface type (Any, Road, Trail, Mixed)
+        time_budget (float): Seconds pruning and the loop search may take once the tile is
+            loaded (defaults to ROUTE_TIME_BUDGET)
+        num_candidates (int): Maximum candidates to try (None: until the budget runs out)
+        seed (int): Seed for the candidate sampler
+        on_improvement (callable): Called with route data for every better loop found
+        use_library (bool): Whether precomputed loops may answer the request
+        execution_mode (str): "inline" or "process" (defaults to ROUTE_EXECUTION_MODE);
+            on_improvement is only called in inline mode
+        progress (callable): Called with "graph load" and "search" as those phases start
+        load_timeout (float): Seconds to wait for the graph tile (defaults to ROUTE_LOAD_TIMEOUT)
+        
+    Returns:
+        dict: Route data including coordinates, distance, and metadata
+        
+    Raises:
+        ValueError: If no loop could be found
+        TimeoutError: If the graph tile is not loaded within load_timeout
+    """
+    started = time.monotonic()
+    if time_budget is None:
+        time_budget = ROUTE_TIME_BUDGET
+    if load_timeout is None:
+        load_timeout = ROUTE_LOAD_TIMEOUT
+    
+    if progress is not None:
+        progress("graph load")
+    surface_filter, handle_missing_surface = get_surface_filter(surface_preference)
+    load = _tile_loader.submit(load_graph_tile, start_point, distance, surface_preference, surface_filter,
+                               handle_missing_surface)
+    try:
+        tile = load.result(timeout=load_timeout if load_timeout > 0 else None)
+    except FutureTimeoutError:
+        raise TimeoutError(f"Street network around {start_point} is still loading after {load_timeout:g} s")
+    arrays = tile["arrays"]
+    if progress is not None:
+        progress("search")
+    searching = time.monotonic()
+    
+    # Start at the closer end of the nearest edge
+    start_node = int(start_nodes(tile, [start_point[0]], [start_point[1]])[0])
+    
+    def route_data(tile_steps, length, surface_mix, score, source):
+        actual_distance = round(length / 1000, 2)
+        data = {
+            "coordinates": resample_coordinates(loop_coordinates(arrays, tile_steps), "storage"),
+            "start_point": (float(arrays["node_lat"][start_node]), float(arrays["node_lon"][start_node])),
+            "distance": actual_distance,
+            "distance_error": round(actual_distance - distance, 2),
+            "surface_type": surface_preference,
+            "surface_mix": surface_mix,
+            "estimated_time": round(actual_distance * 6),  # Assumes 6 min/km pace
+            "score": round(score, 4),
+            "source": source,
+            "search_time_ms": round((time.monotonic() - started) * 1000)
+        }
+        # Left out when the tile has no elevations, so the page does not show a made-up 0 m
+        gain = elevation_gain(arrays, tile_steps)
+        if gain is not None:
+            data["elevation_gain"] = round(gain)
+        return data
+    
+    # Popular start points are answered from the precomputed loop library
+    library = load_library(tile["key"]) if use_library else None
+    match = lookup_loop(library, int(start_node), distance, surface_preference) if library is not None else None
+    if match is not None:
+        entry, tile_steps = match
+        length = float(entry["length"])
+        surface_mix = {"unknown": max(0.0, 1.0 - float(entry["paved"]) - float(entry["unpaved"])),
+                       "paved": float(entry["paved"]), "unpaved": float(entry["unpaved"])}
+        result = route_data(tile_steps, length, surface_mix, abs(length / 1000 - distance) / distance, "library")
+    elif (execution_mode or ROUTE_EXECUTION_MODE) == "process":
+        distance_m = distance * 1000
+        loops = parallel_find_loops(tile, int(start_node), distance_m, surface_preference,
+                                    time_budget=_remaining(time_budget, searching),
+                                    num_candidates=num_candidates, seed=seed)
+        if not loops:
+            raise ValueError(f"No loop of {distance} km found from {start_point}")
+        
+        best = loops[0]
+        result = route_data(best["tile_steps"], best["length"], best["surface_mix"], best["score"], "search")
+    else:
+        distance_m = distance * 1000
+        graph = prune_graph(arrays, int(start_node), distance_m)
+        
+        def improved(loop):
+            if on_improvement is not None:
+                on_improvement(route_data(expand_loop(graph, loop["steps"]), loop["length"],
+                                          loop["surface_mix"], loop["score"], "search"))
+        
+        loops = find_loops(graph, distance_m, surface_preference, num_candidates=num_candidates,
+                           seed=seed, time_budget=_remaining(time_budget, searching), on_improvement=improved)
+        if not loops:
+            raise ValueError(f"No loop of {distance} km found from {start_point}")
+        
+        best = loops[0]
+        result = route_data(expand_loop(graph, best["steps"]), best["length"], best["surface_mix"],
+                            best["score"], "search")
+    
+    print(f"Requested distance: {distance} km, Actual route distance: {result['distance']} km "
+          f"({result['source']}, {result['search_time_ms']} ms)")
+    return result
+
+def refine_route(route_data, distance, surface_preference="Any", refine_time=None, on_improvement=None):
+    """
+    Keep searching for a better loop from a generated route's start
+    
+    A fresh inline search with another seed runs for refine_time (the loop
+    library is skipped), and every loop that beats the best so far, starting
+    from route_data's own score, is reported as it is found. Route jobs run
+    this after handing out their first route.
+    
+    Args:
+        route_data (dict): Graph route (with a score) returned by generate_route
+        distance (float): Desired distance in kilometers
+        surface_preference (str): Preferred surface type
+        refine_time (float): Seconds to keep searching (defaults to ROUTE_REFINE_TIME)
+        on_improvement (callable): Called with the route data of every better loop
+        
+    Returns:
+        dict: Best route data found (route_data itself if nothing beat it)
+    """
+    best = route_data
+    
+    def improved(candidate):
+        nonlocal best
+        if candidate["score"] < best["score"]:
+            best = candidate
+            if on_improvement is not None:
+                on_improvement(candidate)
+    
+    try:
+        generate_graph_route(route_data["start_point"], distance, surface_preference,
+                             time_budget=refine_time if refine_time is not None else ROUTE_REFINE_TIME,
+                             seed=random.randrange(2 ** 31), on_improvement=improved, use_library=False,
+                             execution_mode="inline")
+    except Exception as e:
+        print(f"Route refinement stopped: {e}")
+    return best
+
+def _remaining(time_budget, since):
+    """Seconds left of a time budget that started at time.monotonic() value since"""
+    return max(0.0, time_budget - (time.monotonic() - since))
+
+def create_gpx(route_data, lite=False):
     """
     Create a GPX file from route data
     
     Args:
         route_data (dict): Route information including coordinates
+        lite (bool): Simplify the track to GPX_LITE_TOLERANCE_M for smaller files
+            (for watches and devices with limited storage)
         
     Returns:
         str: GPX file content as string
@@ -282,8 +496,14 @@ def create_gpx(route_data):
         )
         gpx.waypoints.append(start)
     
+    coordinates = route_data["coordinates"]
+    if lite:
+        coordinates = simplify_coordinates(coordinates, GPX_LITE_TOLERANCE_M)
+    else:
+        coordinates = resample_coordinates(coordinates, "gpx")
+    
     # Add points
-    for point in route_data["coordinates"]:
+    for point in coordinates:
         # Add elevation if available (mock for now)
         track_point = gpxpy.gpx.GPXTrackPoint(point[0], point[1])
         segment.points.append(track_point)
@@ -295,18 +515,20 @@ def create_gpx(route_data):
     gpx_xml = gpx.to_xml()
     
     # Validate by reading back the GPX file and print details to server log
-    validate_gpx(gpx_xml, route_data)
+    validate_gpx(gpx_xml, route_data, coordinates)
     
     return gpx_xml
 
 
-def validate_gpx(gpx_xml, original_data):
+def validate_gpx(gpx_xml, original_data, written_coordinates=None):
     """
     Validates GPX content by reading it back and comparing with original data
     
     Args:
         gpx_xml (str): The GPX XML content
         original_data (dict): The original route data used to create the GPX
+        written_coordinates (list): Points written to the track, when they were
+            simplified or resampled from the route's coordinates
     """
     try:
         # Skip validation if gpxpy isn't available
@@ -332,7 +554,9 @@ def validate_gpx(gpx_xml, original_data):
             print(f"Total points in track: {total_points}")
             
             # Validate number of points
-            expected_points = len(original_data.get('coordinates', []))
+            if written_coordinates is None:
+                written_coordinates = original_data.get('coordinates', [])
+            expected_points = len(written_coordinates)
             if total_points == expected_points:
                 print(f"✅ Point count matches original data: {total_points}")
             else:
@@ -0,0 +1,396 @@
+import os
+import json
+import uuid
+import hashlib
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from route_keys import activity_key
+from simplify import project
+from route_similarity import densify, directed_hausdorff
+
+# Where per-user segments and their efforts are persisted between runs
+SEGMENTS_CACHE_DIR = os.environ.get(
+    "SMARTRUNNING_SEGMENTS_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".segments_cache")
+)
+
+# How far (m) a run may stray from a segment and still count as an effort on it
+SEGMENT_TOLERANCE_M = 25.0
+
+# Distance (m) over which the direction of a start or end gate is measured
+GATE_HEADING_M = 20.0
+
+# Size (degrees of latitude) of the grid cells activities are indexed by
+GRID_CELL_DEGREES = 0.002
+
+# In-memory segment state by user
+_segments = {}
+_segments_lock = threading.Lock()
+
+
+def timed_track(activity):
+    """
+    Stored points and point times of a recorded activity
+
+    Returns:
+        tuple or None: ((n, 2) lat/lon array, (n,) seconds from the start), or
+        None for planned routes and activities imported without times
+    """
+    route_data = activity.get("routeData") or {}
+    coords, times = route_data.get("coordinates"), route_data.get("times")
+    if not coords or not times or len(coords) != len(times) or len(coords) < 2:
+        return None
+    return np.asarray(coords, dtype=np.float64), np.asarray(times, dtype=np.float64)
+
+
+def track_cells(coords):
+    """
+    Grid cells a track passes through
+
+    The track is densified to half a cell first, so long straight stretches
+    between stored points still mark every cell they cross.
+
+    Args:
+        coords (np.ndarray): (n, 2) lat/lon points
+
+    Returns:
+        set: (row, col) cells
+    """
+    points = densify(coords, GRID_CELL_DEGREES / 2)
+    cells = np.unique(np.floor(points / GRID_CELL_DEGREES).astype(np.int64), axis=0)
+    return set(map(tuple, cells.tolist()))
+
+
+def _gate_cells(point):
+    row, col = (int(v) for v in np.floor(np.asarray(point) / GRID_CELL_DEGREES))
+    return {(row + dr, col + dc) for dr in (-1, 0, 1) for dc in (-1, 0, 1)}
+
+
+def _point_at(xy, arc, position):
+    return np.array([np.interp(position, arc, xy[:, 0]), np.interp(position, arc, xy[:, 1])])
+
+
+def segment_gates(xy):
+    """
+    Start and end gates of a segment in planar metres
+
+    Each gate is a centre and the unit direction a run crosses it in.
+    """
+    arc = np.r_[0.0, np.cumsum(np.hypot(*np.diff(xy, axis=0).T))]
+    heading = min(GATE_HEADING_M, arc[-1])
+    start_dir = _point_at(xy, arc, heading) - xy[0]
+    end_dir = xy[-1] - _point_at(xy, arc, arc[-1] - heading)
+    return ((xy[0], start_dir / max(np.hypot(*start_dir), 1e-9)),
+            (xy[-1], end_dir / max(np.hypot(*end_dir), 1e-9)))
+
+
+def gate_crossings(xy, center, direction, half_width, edge=None):
+    """
+    Where a track crosses a gate in its direction
+
+    Signed distances along and across the gate direction are computed for
+    every point at once; a crossing is a step from behind the gate line to on
+    or past it, interpolated to the exact fraction of the step.
+
+    Args:
+        xy (np.ndarray): (n, 2) planar track points
+        center (np.ndarray): Gate centre
+        direction (np.ndarray): Unit crossing direction
+        half_width (float): Largest distance from the centre along the gate line
+        edge (str): Also count a track that starts just past the gate ("start")
+            or ends just before it ("end")
+
+    Returns:
+        np.ndarray: Crossing positions as fractional point indices, increasing
+    """
+    rel = xy - center
+    along = rel @ direction
+    across = rel @ np.array([-direction[1], direction[0]])
+    before, after = along[:-1], along[1:]
+    steps = np.flatnonzero((before < 0) & (after >= 0))
+    fraction = -before[steps] / (after[steps] - before[steps])
+    offset = across[steps] + fraction * (across[steps + 1] - across[steps])
+    positions = (steps + fraction)[np.abs(offset) <= half_width]
+
+    if edge == "start" and 0 <= along[0] <= half_width and abs(across[0]) <= half_width:
+        positions = np.r_[0.0, positions]
+    if edge == "end" and -half_width <= along[-1] < 0 and abs(across[-1]) <= half_width:
+        positions = np.r_[positions, len(xy) - 1.0]
+    return positions
+
+
+def _at(values, position):
+    """Interpolate per-point values at a fractional point index"""
+    i = min(int(position), len(values) - 2)
+    return values[i] + (position - i) * (values[i + 1] - values[i])
+
+
+def match_segment(segment_xy, tolerance, xy, times):
+    """
+    Time every effort on a segment within one track
+
+    Each end gate crossing is paired with the latest start crossing far
+    enough before it to cover the segment (and each start with its first
+    end), so on a loop the crossing that ends one lap starts the next.
+    The stretch in between must cover the whole segment and never stray
+    from it by more than the tolerance. Start and finish times are
+    interpolated at the crossings.
+
+    Args:
+        segment_xy (np.ndarray): (m, 2) planar segment points
+        tolerance (float): Largest distance in metres between the run and the segment
+        xy (np.ndarray): (n, 2) planar track points, in the same projection
+        times (np.ndarray): (n,) seconds from the start of the track
+
+    Returns:
+        list: Dicts with time (s) and start (s from the start of the track)
+    """
+    (start_center, start_dir), (end_center, end_dir) = segment_gates(segment_xy)
+    starts = gate_crossings(xy, start_center, start_dir, tolerance, edge="start")
+    ends = gate_crossings(xy, end_center, end_dir, tolerance, edge="end")
+    if not len(starts) or not len(ends):
+        return []
+
+    segment_length = np.hypot(*np.diff(segment_xy, axis=0).T).sum()
+    arc = np.r_[0.0, np.cumsum(np.hypot(*np.diff(xy, axis=0).T))]
+    start_arc = np.interp(starts, np.arange(len(arc)), arc)
+    end_arc = np.interp(ends, np.arange(len(arc)), arc)
+    latest = np.searchsorted(start_arc, end_arc - max(segment_length - 2 * tolerance, 0.0), side="right") - 1
+    valid = latest >= 0
+    paired, first_end = np.unique(latest[valid], return_index=True)
+
+    segment_points = densify(segment_xy, tolerance / 2)
+    efforts = []
+    for start, end in zip(starts[paired], ends[valid][first_end]):
+        first, last = int(start) + 1, int(np.ceil(end))
+        stretch = np.vstack([_at(xy, start), xy[first:last], _at(xy, end)])
+        if (directed_hausdorff(segment_points, stretch, tolerance) > tolerance
+                or directed_hausdorff(densify(stretch, tolerance / 2), segment_xy, tolerance) > tolerance):
+            continue
+        began = _at(times, start)
+        elapsed = _at(times, end) - began
+        if elapsed > 0:
+            efforts.append({"time": round(float(elapsed), 1), "start": round(float(began), 1)})
+    return efforts
+
+
+def segments_path(user_key):
+    """Get the on-disk path of a user's segments"""
+    name = hashlib.sha1(str(user_key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(SEGMENTS_CACHE_DIR, f"segments_{name}.json")
+
+
+def _empty_segments(user_key):
+    # grid and cells index activity points in memory; they are rebuilt after a restart
+    return {"user": user_key, "segments": {}, "efforts": {}, "activities": {}, "grid": {}, "cells": {},
+            "lock": threading.Lock()}
+
+
+def load_segments(user_key):
+    """
+    Get a user's segments and efforts from memory or disk
+
+    Args:
+        user_key (str): User id
+
+    Returns:
+        dict: State with segments, efforts per segment, the update time of
+        each matched activity and the grid index of activity points
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required for segments")
+
+    with _segments_lock:
+        if user_key in _segments:
+            return _segments[user_key]
+
+    state = _empty_segments(user_key)
+    try:
+        with open(segments_path(user_key)) as f:
+            saved = json.load(f)
+        for name in ("segments", "efforts", "activities"):
+            state[name] = saved.get(name, state[name])
+    except (OSError, ValueError):
+        pass
+
+    with _segments_lock:
+        return _segments.setdefault(user_key, state)
+
+
+def save_segments(state):
+    """Persist segments and efforts as JSON"""
+    os.makedirs(SEGMENTS_CACHE_DIR, exist_ok=True)
+    path = segments_path(state["user"])
+    with open(f"{path}.tmp", "w") as f:
+        json.dump({name: state[name] for name in ("segments", "efforts", "activities")}, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def _save(state):
+    try:
+        save_segments(state)
+    except OSError as e:
+        print(f"Warning: could not persist segments: {e}")
+
+
+def _effort_entries(segment, key, activity, track):
+    coords, times = track
+    lat0 = segment["coords"][0][0]
+    efforts = match_segment(project(segment["coords"], lat0), segment["tolerance"], project(coords, lat0), times)
+    route_data = activity.get("routeData") or {}
+    date = route_data.get("start_time") or activity.get("createdAt", "")
+    return [dict(effort, activity=key, name=activity.get("name", "Activity"), date=date) for effort in efforts]
+
+
+def _passes_gates(segment, cells):
+    return bool(_gate_cells(segment["coords"][0]) & cells) and bool(_gate_cells(segment["coords"][-1]) & cells)
+
+
+def _unindex(state, key):
+    for cell in state["cells"].pop(key, ()):
+        keys = state["grid"].get(cell)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del state["grid"][cell]
+
+
+def _index(state, key, coords):
+    _unindex(state, key)
+    cells = track_cells(coords)
+    state["cells"][key] = cells
+    for cell in cells:
+        state["grid"].setdefault(cell, set()).add(key)
+    return cells
+
+
+def add_segment(state, name, coords, activities, tolerance=SEGMENT_TOLERANCE_M):
+    """
+    Define a segment and backfill its efforts over the whole history
+
+    Only activities indexed in grid cells around both the start and the end
+    gate are matched.
+
+    Args:
+        state (dict): State from load_segments
+        name (str): Segment name
+        coords (list): (lat, lon) points of the segment
+        activities (list): All of the user's activity dicts
+        tolerance (float): Largest distance in metres between a run and the segment
+
+    Returns:
+        dict: The segment
+
+    Raises:
+        ValueError: If the segment has fewer than two points
+    """
+    if len(coords) < 2:
+        raise ValueError("A segment needs at least two points")
+    segment = {"id": uuid.uuid4().hex[:8], "name": name, "coords": [list(point) for point in coords],
+               "tolerance": float(tolerance)}
+    update_segments(state, activities)
+    by_key = {activity_key(activity): activity for activity in activities}
+
+    with state["lock"]:
+        start_keys = set().union(*(state["grid"].get(cell, ()) for cell in _gate_cells(coords[0])))
+        end_keys = set().union(*(state["grid"].get(cell, ()) for cell in _gate_cells(coords[-1])))
+        efforts = []
+        for key in start_keys & end_keys:
+            activity = by_key.get(key)
+            track = timed_track(activity) if activity is not None else None
+            if track is not None:
+                efforts += _effort_entries(segment, key, activity, track)
+        state["segments"][segment["id"]] = segment
+        state["efforts"][segment["id"]] = sorted(efforts, key=lambda effort: effort["time"])
+        _save(state)
+    return segment
+
+
+def remove_segment(state, segment_id):
+    with state["lock"]:
+        state["segments"].pop(segment_id, None)
+        state["efforts"].pop(segment_id, None)
+        _save(state)
+
+
+def update_segments(state, activities):
+    """
+    Match new and updated activities against every segment and drop deleted ones
+
+    Every timed activity is indexed by the grid cells it passes through
+    (all of them after a restart, since the grid lives in memory), but only
+    activities not matched before, or updated since, are checked against the
+    segments whose gates they pass near.
+
+    Args:
+        state (dict): State from load_segments
+        activities (list): All of the user's activity dicts
+
+    Returns:
+        int: Number of activities matched or removed
+    """
+    seen = set()
+    changed = 0
+    with state["lock"]:
+        for activity in activities:
+            if not (activity.get("routeData") or {}).get("times"):
+                continue
+            key = activity_key(activity)
+            seen.add(key)
+            stamp = activity.get("updatedAt", "")
+            fresh = state["activities"].get(key) != stamp
+            if key in state["cells"] and not fresh:
+                continue
+            track = timed_track(activity)
+            if track is None:
+                continue
+            cells = _index(state, key, track[0])
+            if not fresh:
+                continue
+            for segment_id, segment in state["segments"].items():
+                efforts = [effort for effort in state["efforts"].setdefault(segment_id, [])
+                           if effort["activity"] != key]
+                if _passes_gates(segment, cells):
+                    efforts += _effort_entries(segment, key, activity, track)
+                state["efforts"][segment_id] = sorted(efforts, key=lambda effort: effort["time"])
+            state["activities"][key] = stamp
+            changed += 1
+
+        for key in [key for key in state["activities"] if key not in seen]:
+            del state["activities"][key]
+            _unindex(state, key)
+            for segment_id, efforts in state["efforts"].items():
+                state["efforts"][segment_id] = [effort for effort in efforts if effort["activity"] != key]
+            changed += 1
+
+        if changed:
+            _save(state)
+    return changed
+
+
+def segment_from_activity(activity, start_km, end_km):
+    """
+    Cut a segment out of an activity's route
+
+    Args:
+        activity (dict): Activity with routeData coordinates
+        start_km (float): Where the segment starts along the route
+        end_km (float): Where it ends
+
+    Returns:
+        list: [lat, lon] points of the segment
+    """
+    coords = np.asarray(activity["routeData"]["coordinates"], dtype=np.float64)
+    xy = project(coords)
+    arc = np.r_[0.0, np.cumsum(np.hypot(*np.diff(xy, axis=0).T))]
+    start, end = start_km * 1000, min(end_km * 1000, arc[-1])
+    inside = (arc > start) & (arc < end)
+    lat = np.r_[np.interp(start, arc, coords[:, 0]), coords[inside, 0], np.interp(end, arc, coords[:, 0])]
+    lon = np.r_[np.interp(start, arc, coords[:, 1]), coords[inside, 1], np.interp(end, arc, coords[:, 1])]
+    return np.column_stack([lat, lon]).tolist()
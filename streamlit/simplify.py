@@ -0,0 +1,272 @@
+import math
+import heapq
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Metres per pixel at the equator at zoom 0 for 256 px web map tiles
+EQUATOR_METERS_PER_PIXEL = 156543.03
+
+# Metres per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111320.0
+
+# Deviation (m) allowed when thinning routes for maps and storage; well
+# below GPS accuracy, so the simplified line looks the same
+DISPLAY_TOLERANCE_M = 2.0
+
+# Deviation (m) allowed in "lite" GPX exports
+GPX_LITE_TOLERANCE_M = 5.0
+
+
+def meters_per_pixel(lat, zoom):
+    """
+    Get the ground size of one map pixel
+
+    Args:
+        lat (float): Latitude in degrees
+        zoom (float): Web map zoom level
+
+    Returns:
+        float: Metres covered by one pixel
+    """
+    return EQUATOR_METERS_PER_PIXEL * math.cos(math.radians(lat)) / (2 ** zoom)
+
+
+def project(coords, lat0=None):
+    """
+    Project (lat, lon) points to local planar metres
+
+    Args:
+        coords (array-like): (n, 2) array of (lat, lon) points
+        lat0 (float): Reference latitude (defaults to the first point's)
+
+    Returns:
+        np.ndarray: (n, 2) array of (x, y) in metres
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if lat0 is None:
+        lat0 = coords[0, 0] if len(coords) else 0.0
+    xy = np.empty_like(coords)
+    xy[:, 0] = coords[:, 1] * METERS_PER_DEGREE * math.cos(math.radians(lat0))
+    xy[:, 1] = coords[:, 0] * METERS_PER_DEGREE
+    return xy
+
+
+def simplify_for_zoom(coords, zoom, pixels=1.0):
+    """
+    Simplify a track so no detail below a given number of pixels is kept at a zoom level
+
+    Args:
+        coords (array-like): (n, 2) array of (lat, lon) points
+        zoom (float): Web map zoom level
+        pixels (float): Smallest detail to keep, in screen pixels
+
+    Returns:
+        np.ndarray: Kept (lat, lon) points
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    if len(coords) <= 2:
+        return coords
+    return douglas_peucker(coords, meters_per_pixel(coords[0, 0], zoom) * pixels)
+
+
+def _segment_distances(points, a, b):
+    """Distances from points to the segment a-b (all in planar metres)"""
+    ab = b - a
+    length_sq = float(ab @ ab)
+    if length_sq == 0.0:
+        return np.hypot(points[:, 0] - a[0], points[:, 1] - a[1])
+    t = np.clip(((points - a) @ ab) / length_sq, 0.0, 1.0)
+    closest = a + t[:, None] * ab
+    return np.hypot(points[:, 0] - closest[:, 0], points[:, 1] - closest[:, 1])
+
+
+def douglas_peucker(coords, tolerance_m=0.0, max_points=None):
+    """
+    Simplify a line with the Douglas-Peucker algorithm
+
+    Segments are split at their farthest point, farthest first, so with
+    max_points the result is the best max_points-point approximation the
+    algorithm can give. Distances to each chord are computed with numpy;
+    the number of Python-level steps is the number of points kept.
+
+    Args:
+        coords (array-like): (n, 2) array of (lat, lon) points
+        tolerance_m (float): Stop splitting once no point is farther than this from its chord
+        max_points (int): Keep at most this many points (at least 2)
+
+    Returns:
+        np.ndarray: Kept (lat, lon) points, first and last always included
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    return coords[douglas_peucker_mask(coords, tolerance_m, max_points)]
+
+
+def douglas_peucker_mask(coords, tolerance_m=0.0, max_points=None):
+    """
+    Which points douglas_peucker keeps, for simplifying values stored alongside the points
+
+    Args:
+        coords (array-like): (n, 2) array of (lat, lon) points
+        tolerance_m (float): Stop splitting once no point is farther than this from its chord
+        max_points (int): Keep at most this many points (at least 2)
+
+    Returns:
+        np.ndarray: Boolean mask of kept points, first and last always included
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    n = len(coords)
+    if n <= 2:
+        return np.ones(n, dtype=bool)
+    max_points = n if max_points is None else max(int(max_points), 2)
+
+    xy = project(coords)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    kept = 2
+
+    def split(i, j):
+        if j - i < 2:
+            return None
+        distances = _segment_distances(xy[i + 1:j], xy[i], xy[j])
+        k = int(np.argmax(distances))
+        return (-float(distances[k]), i, j, i + 1 + k)
+
+    heap = [split(0, n - 1)]
+    while heap and kept < max_points:
+        neg_distance, i, j, k = heapq.heappop(heap)
+        if -neg_distance <= tolerance_m:
+            break
+        keep[k] = True
+        kept += 1
+        for part in (split(i, k), split(k, j)):
+            if part is not None:
+                heapq.heappush(heap, part)
+
+    return keep
+
+
+def visvalingam(coords, min_area_m2=0.0, max_points=None):
+    """
+    Simplify a line with the Visvalingam-Whyatt algorithm
+
+    The point forming the smallest triangle with its neighbours is removed
+    until every remaining triangle is at least min_area_m2, or only
+    max_points points are left. Tends to keep the overall shape better than
+    Douglas-Peucker on noisy GPS tracks.
+
+    Args:
+        coords (array-like): (n, 2) array of (lat, lon) points
+        min_area_m2 (float): Smallest triangle area (square metres) worth keeping
+        max_points (int): Keep at most this many points (at least 2)
+
+    Returns:
+        np.ndarray: Kept (lat, lon) points, first and last always included
+    """
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    n = len(coords)
+    if n <= 2:
+        return coords
+    max_points = n if max_points is None else max(int(max_points), 2)
+
+    xy = project(coords)
+    x, y = xy[:, 0], xy[:, 1]
+
+    def area(p, i, q):
+        return abs((x[p] - x[i]) * (y[q] - y[i]) - (x[q] - x[i]) * (y[p] - y[i])) / 2
+
+    # Initial areas for all interior points at once
+    areas = np.abs((x[:-2] - x[1:-1]) * (y[2:] - y[1:-1]) - (x[2:] - x[1:-1]) * (y[:-2] - y[1:-1])) / 2
+    prev = np.arange(-1, n - 1)
+    nxt = np.arange(1, n + 1)
+    current = np.full(n, np.inf)
+    current[1:-1] = areas
+    heap = [(float(a), i) for i, a in enumerate(areas.tolist(), start=1)]
+    heapq.heapify(heap)
+
+    keep = np.ones(n, dtype=bool)
+    remaining = n
+    smallest = 0.0
+    while heap:
+        a, i = heapq.heappop(heap)
+        if not keep[i] or a != current[i]:
+            continue  # Stale entry
+        # A point's area never drops below that of one removed before it
+        smallest = max(smallest, a)
+        if remaining <= max_points and smallest >= min_area_m2:
+            break
+        keep[i] = False
+        remaining -= 1
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        for j in (p, q):
+            if 0 < j < n - 1:
+                current[j] = area(prev[j], j, nxt[j])
+                heapq.heappush(heap, (current[j], j))
+
+    return coords[keep]
+
+
+def simplify(coords, tolerance_m=0.0, max_points=None, method="douglas_peucker"):
+    """
+    Simplify a line by distance tolerance, point budget, or both
+
+    Args:
+        coords (array-like): (lat, lon) points
+        tolerance_m (float): Largest deviation allowed, in metres
+        max_points (int): Keep at most this many points
+        method (str): "douglas_peucker" or "visvalingam" (which uses
+            tolerance_m squared as its minimum triangle area)
+
+    Returns:
+        np.ndarray: Kept (lat, lon) points
+    """
+    if method == "visvalingam":
+        return visvalingam(coords, tolerance_m ** 2, max_points)
+    return douglas_peucker(coords, tolerance_m, max_points)
+
+
+def simplify_coordinates(coords, tolerance_m=DISPLAY_TOLERANCE_M, max_points=None):
+    """
+    Simplify a list of coordinates for display, storage or export
+
+    Falls back to the original points when numpy is not installed.
+
+    Args:
+        coords (list): (lat, lon) points
+        tolerance_m (float): Largest deviation allowed, in metres
+        max_points (int): Keep at most this many points
+
+    Returns:
+        list: Kept [lat, lon] points
+    """
+    if not NUMPY_AVAILABLE or len(coords) <= 2:
+        return [list(point) for point in coords]
+    return douglas_peucker(coords, tolerance_m, max_points).tolist()
+
+
+def fit_zoom(bounds, width, height, max_zoom=18):
+    """
+    Get the largest zoom level at which a bounding box fits a map view
+
+    Args:
+        bounds (tuple): (min_lat, min_lon, max_lat, max_lon)
+        width (int): Map width in pixels
+        height (int): Map height in pixels
+        max_zoom (int): Zoom used for a single point
+
+    Returns:
+        int: Zoom level
+    """
+    min_lat, min_lon, max_lat, max_lon = bounds
+    lat = (min_lat + max_lat) / 2
+    span_x = (max_lon - min_lon) * METERS_PER_DEGREE * math.cos(math.radians(lat))
+    span_y = (max_lat - min_lat) * METERS_PER_DEGREE
+    zoom = max_zoom
+    while zoom > 0 and (span_x > width * meters_per_pixel(lat, zoom) or
+                        span_y > height * meters_per_pixel(lat, zoom)):
+        zoom -= 1
+    return zoom
@@ -0,0 +1,80 @@
+import threading
+
+
+class _Call:
+    """One in-progress computation and its outcome"""
+
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    De-duplicate concurrent calls that share a key
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait and receive the same result (or exception). Nothing is cached:
+    once the call finishes, the next caller for that key runs it again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) unless an identical call is already running
+
+        Args:
+            key (hashable): Identifies calls that produce the same result
+            fn (callable): Function to run
+
+        Returns:
+            The function's result (shared with all concurrent callers)
+        """
+        result, _ = self.do_shared(key, fn, *args, **kwargs)
+        return result
+
+    def do_shared(self, key, fn, *args, **kwargs):
+        """
+        Like do(), but also tell whether the result came from another caller
+
+        Returns:
+            tuple: (result, shared)
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._calls
+
+    def __len__(self):
+        with self._lock:
+            return len(self._calls)
@@ -0,0 +1,347 @@
+import math
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+# Meters per degree of latitude (mean)
+METERS_PER_DEG_LAT = 110540.0
+# Meters per degree of longitude at the equator
+METERS_PER_DEG_LON = 111320.0
+
+# Default grid cell size in meters
+DEFAULT_CELL_SIZE = 100.0
+
+# Rings searched around a query cell before falling back to a full scan
+MAX_RINGS = 8
+
+
+def _gather(cell_ptr, cell_items, cell_ids):
+    """
+    Collect the items stored in a batch of cells
+
+    Args:
+        cell_ptr (np.ndarray): CSR offsets per cell
+        cell_items (np.ndarray): Item ids sorted by cell
+        cell_ids (np.ndarray): Cells to read
+
+    Returns:
+        tuple: (owner, items) where owner[i] is the position in cell_ids item i came from
+    """
+    starts = cell_ptr[cell_ids]
+    counts = cell_ptr[cell_ids + 1] - starts
+    total = int(counts.sum())
+    owner = np.repeat(np.arange(len(cell_ids)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return owner, cell_items[np.repeat(starts, counts) + offsets]
+
+
+def _closest_per_owner(owner, distances, num_owners):
+    """Get the position of the smallest distance for each owner (-1 if none)"""
+    best = np.full(num_owners, -1, dtype=np.int64)
+    if len(owner) == 0:
+        return best
+    order = np.lexsort((distances, owner))
+    owners_sorted = owner[order]
+    first = np.flatnonzero(np.r_[True, owners_sorted[1:] != owners_sorted[:-1]])
+    best[owners_sorted[first]] = order[first]
+    return best
+
+
+class GridIndex:
+    """
+    Uniform grid (bucket) index over the nodes and edge segments of a graph tile
+
+    Coordinates are projected to local meters around the tile origin, so
+    distances are accurate to well under a meter at tile scale. Every query
+    method is batched: pass arrays of latitudes and longitudes.
+    """
+
+    def __init__(self, origin, cell_size, shape, seg_a, seg_b, seg_edge, seg_offset,
+                 seg_cell_ptr, seg_cell_items, node_xy, node_cell_ptr, node_cell_items):
+        self.origin = origin
+        self.cell_size = cell_size
+        self.shape = shape
+        self.seg_a = seg_a
+        self.seg_b = seg_b
+        self.seg_edge = seg_edge
+        self.seg_offset = seg_offset
+        self.seg_cell_ptr = seg_cell_ptr
+        self.seg_cell_items = seg_cell_items
+        self.node_xy = node_xy
+        self.node_cell_ptr = node_cell_ptr
+        self.node_cell_items = node_cell_items
+
+    # Construction
+
+    @classmethod
+    def build(cls, arrays, cell_size=DEFAULT_CELL_SIZE):
+        """
+        Build the index from graph arrays
+
+        Args:
+            arrays (dict): Graph arrays from graph_cache.build_graph_arrays
+            cell_size (float): Grid cell size in meters
+
+        Returns:
+            GridIndex: The index
+        """
+        if not NUMPY_AVAILABLE:
+            raise ImportError("numpy package is required to build a spatial index")
+
+        geom_ptr = arrays["geom_ptr"]
+        origin = (float(arrays["geom_lat"].min()), float(arrays["geom_lon"].min()))
+        cos_lat = math.cos(math.radians(origin[0] + (arrays["geom_lat"].max() - origin[0]) / 2))
+        origin = (origin[0], origin[1], cos_lat)
+
+        geom_xy = _project(origin, arrays["geom_lat"], arrays["geom_lon"])
+        node_xy = _project(origin, arrays["node_lat"], arrays["node_lon"])
+
+        # One segment per consecutive pair of geometry points within an edge
+        num_edges = len(geom_ptr) - 1
+        points_per_edge = np.diff(geom_ptr)
+        seg_edge = np.repeat(np.arange(num_edges, dtype=np.int32), points_per_edge - 1)
+        is_last = np.zeros(len(geom_xy), dtype=bool)
+        is_last[geom_ptr[1:] - 1] = True
+        seg_start = np.flatnonzero(~is_last)
+        seg_a = geom_xy[seg_start]
+        seg_b = geom_xy[seg_start + 1]
+
+        # Offset of each segment start along its edge
+        seg_len = np.hypot(*(seg_b - seg_a).T)
+        cum = np.cumsum(seg_len)
+        edge_first_seg = np.r_[0, np.cumsum(points_per_edge - 1)][:-1]
+        seg_offset = cum - seg_len
+        seg_offset -= np.repeat(np.r_[0.0, cum][edge_first_seg], points_per_edge - 1)
+
+        extent = np.maximum(geom_xy.max(axis=0), node_xy.max(axis=0))
+        shape = (int(extent[1] // cell_size) + 1, int(extent[0] // cell_size) + 1)
+
+        # A segment goes into every cell its bounding box touches
+        lo = np.floor(np.minimum(seg_a, seg_b) / cell_size).astype(np.int64)
+        hi = np.floor(np.maximum(seg_a, seg_b) / cell_size).astype(np.int64)
+        span_x = hi[:, 0] - lo[:, 0] + 1
+        span_y = hi[:, 1] - lo[:, 1] + 1
+        per_seg = span_x * span_y
+        seg_ids = np.repeat(np.arange(len(seg_a)), per_seg)
+        k = np.arange(per_seg.sum()) - np.repeat(np.cumsum(per_seg) - per_seg, per_seg)
+        cx = lo[seg_ids, 0] + k % span_x[seg_ids]
+        cy = lo[seg_ids, 1] + k // span_x[seg_ids]
+        seg_cell_ptr, seg_cell_items = _bucket(cy * shape[1] + cx, seg_ids, shape)
+
+        node_cells = _cell_ids(node_xy, cell_size, shape)
+        node_cell_ptr, node_cell_items = _bucket(node_cells, np.arange(len(node_xy)), shape)
+
+        return cls(origin, float(cell_size), shape, seg_a, seg_b, seg_edge, seg_offset.astype(np.float64),
+                   seg_cell_ptr, seg_cell_items, node_xy, node_cell_ptr, node_cell_items)
+
+    def to_arrays(self):
+        """Serialize the index to a dict of arrays (for np.savez)"""
+        return {
+            "origin": np.array(self.origin, dtype=np.float64),
+            "cell_size": np.array(self.cell_size, dtype=np.float64),
+            "shape": np.array(self.shape, dtype=np.int64),
+            "seg_a": self.seg_a,
+            "seg_b": self.seg_b,
+            "seg_edge": self.seg_edge,
+            "seg_offset": self.seg_offset,
+            "seg_cell_ptr": self.seg_cell_ptr,
+            "seg_cell_items": self.seg_cell_items,
+            "node_xy": self.node_xy,
+            "node_cell_ptr": self.node_cell_ptr,
+            "node_cell_items": self.node_cell_items,
+        }
+
+    @classmethod
+    def from_arrays(cls, data):
+        """Restore an index serialized with to_arrays"""
+        return cls(tuple(float(v) for v in data["origin"]), float(data["cell_size"]),
+                   tuple(int(v) for v in data["shape"]), data["seg_a"], data["seg_b"],
+                   data["seg_edge"], data["seg_offset"], data["seg_cell_ptr"],
+                   data["seg_cell_items"], data["node_xy"], data["node_cell_ptr"],
+                   data["node_cell_items"])
+
+    # Queries
+
+    def project(self, lats, lons):
+        """Project latitudes/longitudes to the index's local meter grid"""
+        return _project(self.origin, np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64))
+
+    def nearest_nodes(self, lats, lons):
+        """
+        Find the nearest graph node to each query point
+
+        Args:
+            lats (array-like): Query latitudes
+            lons (array-like): Query longitudes
+
+        Returns:
+            tuple: (node_indices, distances_m) as arrays
+        """
+        points = self.project(lats, lons)
+
+        def distance(query_ids, items):
+            return np.hypot(*(self.node_xy[items] - points[query_ids]).T), None
+
+        best, dist, _ = self._search(points, self.node_cell_ptr, self.node_cell_items,
+                                     len(self.node_xy), distance)
+        return best, dist
+
+    def nearest_edges(self, lats, lons):
+        """
+        Find the nearest graph edge to each query point
+
+        Args:
+            lats (array-like): Query latitudes
+            lons (array-like): Query longitudes
+
+        Returns:
+            tuple: (edge_ids, offsets_m, distances_m) as arrays, where the offset
+            is measured along the edge geometry from its first node
+        """
+        points = self.project(lats, lons)
+
+        def distance(query_ids, items):
+            return self._segment_distance(points[query_ids], items)
+
+        best, dist, offset = self._search(points, self.seg_cell_ptr, self.seg_cell_items,
+                                          len(self.seg_a), distance)
+        return self.seg_edge[best], offset, dist
+
+    def candidate_edges(self, lats, lons, radius, k=5):
+        """
+        Find up to k distinct edges within a radius of each query point
+
+        Args:
+            lats (array-like): Query latitudes
+            lons (array-like): Query longitudes
+            radius (float): Search radius in meters
+            k (int): Maximum number of candidates per point
+
+        Returns:
+            tuple: (edge_ids, offsets_m, distances_m) arrays of shape (n, k),
+            padded with -1 / inf where fewer candidates exist, sorted by distance
+        """
+        points = self.project(lats, lons)
+        n = len(points)
+        rings = int(math.ceil(radius / self.cell_size))
+        query_ids, cells = self._ring_cells(points, np.arange(n), 0, rings)
+        owner, items = _gather(self.seg_cell_ptr, self.seg_cell_items, cells)
+        query_ids = query_ids[owner]
+        dist, offset = self._segment_distance(points[query_ids], items)
+        edges = self.seg_edge[items]
+
+        keep = dist <= radius
+        query_ids, edges, dist, offset = query_ids[keep], edges[keep], dist[keep], offset[keep]
+
+        # Keep the closest segment of each (query, edge) pair
+        order = np.lexsort((dist, edges, query_ids))
+        query_ids, edges, dist, offset = query_ids[order], edges[order], dist[order], offset[order]
+        first = np.r_[True, (query_ids[1:] != query_ids[:-1]) | (edges[1:] != edges[:-1])]
+        query_ids, edges, dist, offset = query_ids[first], edges[first], dist[first], offset[first]
+
+        order = np.lexsort((dist, query_ids))
+        query_ids, edges, dist, offset = query_ids[order], edges[order], dist[order], offset[order]
+        group_start = np.searchsorted(query_ids, query_ids, side='left')
+        rank = np.arange(len(query_ids)) - group_start
+        keep = rank < k
+
+        out_edges = np.full((n, k), -1, dtype=np.int64)
+        out_offsets = np.full((n, k), np.inf)
+        out_dist = np.full((n, k), np.inf)
+        out_edges[query_ids[keep], rank[keep]] = edges[keep]
+        out_offsets[query_ids[keep], rank[keep]] = offset[keep]
+        out_dist[query_ids[keep], rank[keep]] = dist[keep]
+        return out_edges, out_offsets, out_dist
+
+    # Internals
+
+    def _segment_distance(self, points, seg_ids):
+        """Distance from points to segments, and the offset of the foot point along the edge"""
+        a = self.seg_a[seg_ids]
+        ab = self.seg_b[seg_ids] - a
+        length_sq = np.einsum('ij,ij->i', ab, ab)
+        t = np.einsum('ij,ij->i', points - a, ab) / np.where(length_sq > 0, length_sq, 1.0)
+        t = np.clip(t, 0.0, 1.0)
+        foot = a + ab * t[:, None]
+        dist = np.hypot(*(points - foot).T)
+        offset = self.seg_offset[seg_ids] + t * np.sqrt(length_sq)
+        return dist, offset
+
+    def _ring_cells(self, points, query_ids, ring_min, ring_max):
+        """List (query, cell) pairs for the cells in rings ring_min..ring_max around each query"""
+        cx = np.floor(points[query_ids, 0] / self.cell_size).astype(np.int64)
+        cy = np.floor(points[query_ids, 1] / self.cell_size).astype(np.int64)
+        dx, dy = np.meshgrid(np.arange(-ring_max, ring_max + 1), np.arange(-ring_max, ring_max + 1))
+        ring = np.maximum(np.abs(dx), np.abs(dy)).ravel()
+        dx, dy = dx.ravel()[ring >= ring_min], dy.ravel()[ring >= ring_min]
+
+        qx = cx[:, None] + dx[None, :]
+        qy = cy[:, None] + dy[None, :]
+        inside = (qx >= 0) & (qx < self.shape[1]) & (qy >= 0) & (qy < self.shape[0])
+        owners = np.broadcast_to(query_ids[:, None], qx.shape)[inside]
+        return owners, (qy * self.shape[1] + qx)[inside]
+
+    def _search(self, points, cell_ptr, cell_items, num_items, distance):
+        """Expanding ring search shared by the nearest-node and nearest-edge queries"""
+        n = len(points)
+        best = np.full(n, -1, dtype=np.int64)
+        best_dist = np.full(n, np.inf)
+        best_extra = np.zeros(n)
+        pending = np.arange(n)
+        searched = -1
+
+        for rings in range(1, MAX_RINGS + 1):
+            if len(pending) == 0:
+                break
+            query_ids, cells = self._ring_cells(points, pending, searched + 1, rings)
+            searched = rings
+            owner, items = _gather(cell_ptr, cell_items, cells)
+            query_ids = query_ids[owner]
+            if len(items):
+                dist, extra = distance(query_ids, items)
+                pick = _closest_per_owner(query_ids, dist, n)
+                found = np.flatnonzero(pick >= 0)
+                better = dist[pick[found]] < best_dist[found]
+                found = found[better]
+                best[found] = items[pick[found]]
+                best_dist[found] = dist[pick[found]]
+                if extra is not None:
+                    best_extra[found] = extra[pick[found]]
+
+            # Anything outside the searched rings is at least this far away
+            pending = pending[best_dist[pending] > rings * self.cell_size]
+
+        # Queries far outside the tile: compare against everything
+        for q in pending:
+            items = np.arange(num_items)
+            dist, extra = distance(np.full(num_items, q), items)
+            i = int(np.argmin(dist))
+            best[q], best_dist[q] = items[i], dist[i]
+            if extra is not None:
+                best_extra[q] = extra[i]
+
+        return best, best_dist, best_extra
+
+
+def _project(origin, lats, lons):
+    """Equirectangular projection to meters relative to origin (lat0, lon0, cos_lat)"""
+    x = (lons - origin[1]) * METERS_PER_DEG_LON * origin[2]
+    y = (lats - origin[0]) * METERS_PER_DEG_LAT
+    return np.column_stack([x, y])
+
+
+def _cell_ids(xy, cell_size, shape):
+    cx = np.clip(np.floor(xy[:, 0] / cell_size).astype(np.int64), 0, shape[1] - 1)
+    cy = np.clip(np.floor(xy[:, 1] / cell_size).astype(np.int64), 0, shape[0] - 1)
+    return cy * shape[1] + cx
+
+
+def _bucket(cell_ids, items, shape):
+    """Sort items by cell and build CSR offsets over all cells"""
+    order = np.argsort(cell_ids, kind='stable')
+    cell_ptr = np.zeros(shape[0] * shape[1] + 1, dtype=np.int64)
+    np.cumsum(np.bincount(cell_ids, minlength=shape[0] * shape[1]), out=cell_ptr[1:])
+    return cell_ptr, items[order].astype(np.int32)
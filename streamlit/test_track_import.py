@@ -0,0 +1,36 @@
+import io
+
+import numpy as np
+import pytest
+
+from track_import import read_gpx, _XmlTrackReader
+
+
+def _gpx(point_body, n=100):
+    points = "".join(
+        f'<trkpt lat="{55.4 + i * 1e-4}" lon="10.39">'
+        + point_body(f"<ele>{10 + i * 0.5}</ele>", f"<time>2024-05-01T10:{i // 60:02d}:{i % 60:02d}Z</time>")
+        + "</trkpt>"
+        for i in range(n)
+    )
+    return f'<?xml version="1.0"?><gpx><trk><trkseg>{points}</trkseg></trk></gpx>'.encode()
+
+
+def _expat_gpx(data):
+    fields = {"ele": "ele", "time": "time", "hr": "hr", "heartrate": "hr", "cad": "cad", "cadence": "cad"}
+    return _XmlTrackReader("trkpt", fields, position_attributes=True).parse(io.BytesIO(data))
+
+
+@pytest.mark.parametrize("point_body", [
+    lambda ele, time: ele + time,
+    lambda ele, time: time + ele,
+], ids=["ele-time", "time-ele"])
+def test_gpx_elevation_and_time_in_either_order(point_body):
+    data = _gpx(point_body)
+    track = read_gpx(io.BytesIO(data))
+    expected = _expat_gpx(data)
+
+    assert not np.isnan(track["ele"]).any()
+    assert not np.isnan(track["time"]).any()
+    for name in ("lat", "lon", "ele", "time"):
+        np.testing.assert_allclose(track[name], expected[name])
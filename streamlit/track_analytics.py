@@ -0,0 +1,365 @@
+import hashlib
+from collections import OrderedDict
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from track_import import track_distances
+from best_efforts import best_efforts
+
+# Speed (m/s) below which the runner counts as stopped
+MOVING_SPEED_MS = 0.5
+
+# Metres per split, by unit name
+SPLIT_UNITS = {"km": 1000.0, "mi": 1609.344}
+
+# Seconds of track averaged for smoothed pace
+PACE_WINDOW_S = 30.0
+
+# Metres of track over which grade is measured for grade-adjusted pace
+GRADE_WINDOW_M = 50.0
+
+# Steepest grade the running cost model is used for
+MAX_GRADE = 0.45
+
+# Heart rate zones 1-5 as lower bounds, in fractions of max heart rate
+HR_ZONES = (0.5, 0.6, 0.7, 0.8, 0.9)
+
+# Max heart rate used when the profile has none
+DEFAULT_MAX_HR = 190
+
+# Running cadence zones as lower bounds, in steps per minute
+CADENCE_ZONES = (0, 150, 160, 170, 180, 190)
+
+# Analyses kept in memory, keyed by activity
+ANALYTICS_CACHE_SIZE = 256
+
+_cache = OrderedDict()
+
+
+def running_cost(grade):
+    """
+    Energy cost of running on a grade relative to the flat
+
+    Uses the Minetti et al. (2002) polynomial for the cost of running,
+    in J/kg/m, divided by its value at grade 0.
+
+    Args:
+        grade (np.ndarray): Rise over run
+
+    Returns:
+        np.ndarray: Cost factor (1.0 on the flat)
+    """
+    g = np.clip(grade, -MAX_GRADE, MAX_GRADE)
+    return (((((155.4 * g - 30.4) * g - 43.3) * g + 46.3) * g + 19.5) * g + 3.6) / 3.6
+
+
+def _fill_gaps(values):
+    """Linearly interpolate NaNs; returns None if no value is present"""
+    present = ~np.isnan(values)
+    if not present.any():
+        return None
+    if present.all():
+        return values
+    index = np.arange(len(values))
+    return np.interp(index, index[present], values[present])
+
+
+def interpolate_at(cumulative, columns, positions):
+    """
+    Interpolate cumulative columns at positions along a non-decreasing axis
+
+    Positions are located with one searchsorted call for all columns.
+
+    Args:
+        cumulative (np.ndarray): Non-decreasing axis (e.g. cumulative distance)
+        columns (np.ndarray): (n, k) values at each axis point
+        positions (np.ndarray): Axis positions to read at
+
+    Returns:
+        np.ndarray: (len(positions), k) interpolated values
+    """
+    i = np.clip(np.searchsorted(cumulative, positions, side="left"), 1, len(cumulative) - 1)
+    start, end = cumulative[i - 1], cumulative[i]
+    span = end - start
+    fraction = np.divide(positions - start, span, out=np.ones_like(span), where=span > 0)
+    return columns[i - 1] + fraction[:, None] * (columns[i] - columns[i - 1])
+
+
+def window_rate(axis, values, half_window):
+    """
+    Change of values per unit of axis over a centred window
+
+    Args:
+        axis (np.ndarray): Increasing axis (time or distance)
+        values (np.ndarray): Values along it
+        half_window (float): Half the window, in axis units
+
+    Returns:
+        np.ndarray: (values[x + w] - values[x - w]) / (2w), with the window clipped at the ends
+    """
+    lo = np.maximum(axis - half_window, axis[0])
+    hi = np.minimum(axis + half_window, axis[-1])
+    span = hi - lo
+    change = np.interp(hi, axis, values) - np.interp(lo, axis, values)
+    return np.divide(change, span, out=np.zeros_like(span), where=span > 0)
+
+
+def zone_times(values, seconds, bounds):
+    """
+    Seconds spent in each zone
+
+    Args:
+        values (np.ndarray): Value per segment (NaN where missing)
+        seconds (np.ndarray): Duration of each segment
+        bounds (sequence): Lower bound of each zone
+
+    Returns:
+        list: Seconds per zone, or None if no value is present
+    """
+    present = ~np.isnan(values)
+    if not present.any():
+        return None
+    edges = np.r_[np.asarray(bounds, dtype=np.float64), np.inf]
+    return np.histogram(values[present], bins=edges, weights=seconds[present])[0].round(1).tolist()
+
+
+def _json_list(values, decimals=1):
+    """Rounded list with None in place of NaN, so it can be stored as JSON"""
+    values = np.round(values, decimals)
+    return [None if value != value else value for value in values.tolist()]
+
+
+def split_table(distance, cumulative, unit):
+    """
+    Per-unit splits from cumulative columns
+
+    Args:
+        distance (np.ndarray): Cumulative distance in metres
+        cumulative (dict): Cumulative columns along distance: elapsed, moving, gain,
+            and hr_seconds/hr_weight for time-weighted heart rate
+        unit (float): Split length in metres
+
+    Returns:
+        dict: Lists per split of distance, elapsed, moving, pace (moving seconds per unit),
+        elevation_gain and hr (None where unknown); the last split may be partial
+    """
+    total = distance[-1]
+    boundaries = np.r_[np.arange(unit, total, unit), total] if total > 0 else np.array([0.0])
+    names = list(cumulative)
+    at = interpolate_at(distance, np.column_stack([cumulative[name] for name in names]), boundaries)
+    at = np.vstack([np.zeros(len(names)), at])
+    per_split = dict(zip(names, np.diff(at, axis=0).T))
+
+    length = np.diff(np.r_[0.0, boundaries])
+    with np.errstate(divide="ignore", invalid="ignore"):
+        pace = per_split["moving"] / length * unit
+        hr = per_split["hr_seconds"] / per_split["hr_weight"]
+    return {
+        "distance": _json_list(length),
+        "elapsed": _json_list(per_split["elapsed"]),
+        "moving": _json_list(per_split["moving"]),
+        "pace": _json_list(np.where(np.isfinite(pace), pace, np.nan)),
+        "elevation_gain": _json_list(per_split["gain"]),
+        "hr": _json_list(np.where(np.isfinite(hr), hr, np.nan), 0),
+    }
+
+
+def analyze_track(track, max_hr=DEFAULT_MAX_HR, min_speed=MOVING_SPEED_MS):
+    """
+    Compute distance, time, pace, splits and zones for a track
+
+    Everything is computed with array operations over the whole track:
+    splits read cumulative time, moving time, climb and heart rate at unit
+    boundaries with searchsorted, and smoothed and grade-adjusted pace come
+    from centred windows read with np.interp.
+
+    Args:
+        track (dict): Arrays from track_import.read_track (lat and lon required;
+            ele, time, hr and cad used when present)
+        max_hr (float): Max heart rate for the zones
+        min_speed (float): Speed in m/s below which time is not moving time
+
+    Returns:
+        dict: Totals (distance, elapsed_time, moving_time, elevation_gain, average_pace,
+        average_gap, average_hr, average_cadence), splits per unit, best_efforts
+        (see best_efforts.best_efforts), hr_zones and
+        cadence_zones (seconds per zone), and per-point arrays distance, pace and gap
+        (seconds per km, NaN when stopped). Time-based values are None when the track has no times.
+    """
+    n = len(track["lat"])
+    empty = np.full(n, np.nan)
+    distance = np.r_[0.0, np.cumsum(track_distances(track))] if n > 1 else np.zeros(n)
+
+    time = _fill_gaps(np.asarray(track.get("time", empty), dtype=np.float64))
+    if time is not None:
+        # Devices sometimes repeat or reorder a timestamp
+        time = np.maximum.accumulate(time)
+    ele = _fill_gaps(np.asarray(track.get("ele", empty), dtype=np.float64))
+    hr = np.asarray(track.get("hr", empty), dtype=np.float64)
+    # Running cadence is recorded per stride
+    steps = np.asarray(track.get("cad", empty), dtype=np.float64) * 2
+
+    step = np.diff(distance)
+    climb = np.maximum(np.diff(ele), 0.0) if ele is not None else np.zeros(max(n - 1, 0))
+    result = {
+        "points": n,
+        "distance": round(float(distance[-1]), 1) if n else 0.0,
+        "elevation_gain": round(float(climb.sum()), 1) if ele is not None else None,
+        "elapsed_time": None, "moving_time": None,
+        "average_pace": None, "average_gap": None,
+        "average_hr": None, "average_cadence": None,
+        "splits": None, "best_efforts": None, "hr_zones": None, "cadence_zones": None,
+        "distance_series": distance,
+        "pace": None, "gap": None,
+    }
+    if n < 2:
+        return result
+
+    if time is None:
+        seconds = np.zeros(n - 1)
+        moving = np.zeros(n - 1, dtype=bool)
+    else:
+        seconds = np.diff(time)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            moving = (seconds > 0) & (step / seconds >= min_speed)
+    moving_seconds = np.where(moving, seconds, 0.0)
+
+    hr_segment = hr[:-1]
+    hr_known = ~np.isnan(hr_segment)
+    cumulative = {
+        "elapsed": np.r_[0.0, np.cumsum(seconds)],
+        "moving": np.r_[0.0, np.cumsum(moving_seconds)],
+        "gain": np.r_[0.0, np.cumsum(climb)],
+        "hr_seconds": np.r_[0.0, np.cumsum(np.where(hr_known, hr_segment * seconds, 0.0))],
+        "hr_weight": np.r_[0.0, np.cumsum(np.where(hr_known, seconds, 0.0))],
+    }
+    result["splits"] = {name: split_table(distance, cumulative, unit) for name, unit in SPLIT_UNITS.items()}
+
+    if time is None:
+        return result
+
+    moving_time = float(moving_seconds.sum())
+    moving_distance = float(step[moving].sum())
+    result["elapsed_time"] = round(float(time[-1] - time[0]), 1)
+    result["moving_time"] = round(moving_time, 1)
+    if moving_distance > 0:
+        result["average_pace"] = round(moving_time / moving_distance * 1000, 1)
+
+    result["best_efforts"] = best_efforts(distance, time)
+
+    speed = window_rate(time, distance, PACE_WINDOW_S / 2)
+    stopped = speed < min_speed
+    with np.errstate(divide="ignore"):
+        result["pace"] = np.where(stopped, np.nan, 1000.0 / speed)
+    if ele is not None:
+        grade = window_rate(distance, ele, GRADE_WINDOW_M / 2)
+        effort = running_cost(grade)
+        with np.errstate(divide="ignore"):
+            result["gap"] = np.where(stopped, np.nan, 1000.0 / (speed * effort))
+        # Moving time the same effort would have taken on the flat
+        flat_time = float(np.sum(moving_seconds / effort[:-1]))
+        if moving_distance > 0:
+            result["average_gap"] = round(flat_time / moving_distance * 1000, 1)
+
+    if hr_known.any() and cumulative["hr_weight"][-1] > 0:
+        result["average_hr"] = round(float(cumulative["hr_seconds"][-1] / cumulative["hr_weight"][-1]))
+        result["hr_zones"] = zone_times(hr_segment / max_hr, moving_seconds, HR_ZONES)
+    steps_segment = steps[:-1]
+    if not np.isnan(steps_segment).all():
+        running = moving & ~np.isnan(steps_segment)
+        if running.any():
+            result["average_cadence"] = round(float(np.average(steps_segment[running], weights=seconds[running])))
+        result["cadence_zones"] = zone_times(steps_segment, moving_seconds, CADENCE_ZONES)
+    return result
+
+
+def track_key(track):
+    """Content hash of a track's positions and times"""
+    digest = hashlib.sha1()
+    for name in ("lat", "lon", "time"):
+        if name in track:
+            digest.update(np.ascontiguousarray(track[name], dtype=np.float64).tobytes())
+    return digest.hexdigest()[:16]
+
+
+def analyze(track, key=None, max_hr=DEFAULT_MAX_HR, min_speed=MOVING_SPEED_MS):
+    """
+    Analyze a track, reusing the cached result for the same activity
+
+    Args:
+        track (dict): Track arrays (see analyze_track)
+        key (str): Activity key (defaults to a hash of the track)
+        max_hr (float): Max heart rate for the zones
+        min_speed (float): Speed in m/s below which time is not moving time
+
+    Returns:
+        dict: Result of analyze_track (shared; do not modify)
+
+    Raises:
+        ImportError: If numpy is not installed
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required for track analytics")
+
+    cache_key = (key or track_key(track), max_hr, min_speed)
+    if cache_key in _cache:
+        _cache.move_to_end(cache_key)
+        return _cache[cache_key]
+
+    result = analyze_track(track, max_hr, min_speed)
+    _cache[cache_key] = result
+    while len(_cache) > ANALYTICS_CACHE_SIZE:
+        _cache.popitem(last=False)
+    return result
+
+
+def analysis_summary(result):
+    """Analysis without per-point arrays, small enough to store with an activity"""
+    return {name: value for name, value in result.items() if name not in ("distance_series", "pace", "gap")}
+
+
+def activity_analysis(activity, max_hr=DEFAULT_MAX_HR):
+    """
+    Get the analysis summary of a saved activity
+
+    Imported runs carry the summary computed from their full recording.
+    For planned routes only the coordinates are stored, so times are
+    spread evenly over the activity's duration and the splits show an
+    even pace.
+
+    Args:
+        activity (dict): Activity from the API
+        max_hr (float): Max heart rate for the zones
+
+    Returns:
+        dict or None: Summary (see analysis_summary) with an "estimated" flag,
+        or None if the activity has no route
+    """
+    route_data = activity.get("routeData") or {}
+    if route_data.get("analysis"):
+        return dict(route_data["analysis"], estimated=False)
+    coords = route_data.get("coordinates")
+    if not coords or len(coords) < 2:
+        return None
+
+    coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+    track = {"lat": coords[:, 0], "lon": coords[:, 1]}
+    duration = float(activity.get("duration") or 0)
+    if duration > 0:
+        distance = np.r_[0.0, np.cumsum(track_distances(track))]
+        track["time"] = distance / max(distance[-1], 1e-9) * duration
+
+    key = f"{activity['_id']}:{activity.get('updatedAt', '')}" if activity.get("_id") else None
+    return dict(analysis_summary(analyze(track, key, max_hr)), estimated=True)
+
+
+def format_pace(seconds):
+    """Format seconds per unit as m:ss, or "-" when unknown"""
+    if seconds is None or seconds != seconds:
+        return "-"
+    seconds = int(round(seconds))
+    return f"{seconds // 60}:{seconds % 60:02d}"
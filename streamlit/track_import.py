@@ -0,0 +1,634 @@
+import os
+import re
+import sys
+import struct
+import calendar
+from array import array
+from datetime import datetime, timezone
+from xml.parsers import expat
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+NAN = float("nan")
+
+# Columns of an imported track; cad is cadence as recorded (strides per minute when running)
+TRACK_COLUMNS = ("lat", "lon", "ele", "time", "hr", "cad")
+
+# Bytes read at a time when scanning GPX and TCX files
+SCAN_CHUNK_BYTES = 1 << 20
+
+# FIT timestamps count seconds from 1989-12-31 00:00 UTC
+FIT_EPOCH = 631065600
+
+# Degrees per FIT semicircle
+SEMICIRCLE_DEGREES = 180.0 / 2 ** 31
+
+# FIT "record" message and the fields read from it: number -> column
+FIT_RECORD = 20
+FIT_RECORD_FIELDS = {0: "lat", 1: "lon", 2: "ele", 78: "ele", 3: "hr", 4: "cad", 253: "time"}
+
+# FIT base types: number -> (struct code, invalid value)
+FIT_BASE_TYPES = {
+    0x00: ("B", 0xFF), 0x01: ("b", 0x7F), 0x02: ("B", 0xFF), 0x83: ("h", 0x7FFF),
+    0x84: ("H", 0xFFFF), 0x85: ("i", 0x7FFFFFFF), 0x86: ("I", 0xFFFFFFFF), 0x07: ("s", None),
+    0x88: ("f", None), 0x89: ("d", None), 0x0A: ("B", 0x00), 0x8B: ("H", 0x0000),
+    0x8C: ("I", 0x00000000), 0x0D: ("B", None), 0x8E: ("q", 0x7FFFFFFFFFFFFFFF),
+    0x8F: ("Q", 0xFFFFFFFFFFFFFFFF), 0x90: ("Q", 0x0000000000000000),
+}
+
+
+class TrackBuilder:
+    """Collects track points straight into compact typed arrays"""
+
+    def __init__(self):
+        self.columns = {name: array("d") for name in TRACK_COLUMNS}
+
+    def add(self, lat, lon, ele=NAN, time=NAN, hr=NAN, cad=NAN):
+        columns = self.columns
+        columns["lat"].append(lat)
+        columns["lon"].append(lon)
+        columns["ele"].append(ele)
+        columns["time"].append(time)
+        columns["hr"].append(hr)
+        columns["cad"].append(cad)
+
+    def extend(self, columns):
+        """Append whole columns of float64 values (a dict like TRACK_COLUMNS)"""
+        for name, column in self.columns.items():
+            column.frombytes(np.ascontiguousarray(columns[name], dtype=np.float64).tobytes())
+
+    def __len__(self):
+        return len(self.columns["lat"])
+
+    def build(self):
+        """
+        Get the collected points as NumPy arrays
+
+        Returns:
+            dict: float64 arrays for lat, lon, ele, time (Unix seconds), hr and cad (NaN where missing)
+        """
+        return {name: np.frombuffer(column, dtype=np.float64) for name, column in self.columns.items()}
+
+
+def parse_time(text):
+    """
+    Parse an ISO 8601 UTC timestamp as used in GPX and TCX files
+
+    Args:
+        text (str): Timestamp such as 2024-05-01T06:30:00Z or 2024-05-01T06:30:00.250+00:00
+
+    Returns:
+        float: Unix seconds, or NaN if it cannot be parsed
+    """
+    text = text.strip()
+    try:
+        # Fast path for the common "YYYY-MM-DDTHH:MM:SS[.fff]Z" form
+        if text.endswith("Z") and len(text) >= 20:
+            seconds = calendar.timegm((int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                                       int(text[11:13]), int(text[14:16]), int(text[17:19]), 0, 0, 0))
+            fraction = text[19:-1]
+            return seconds + (float(fraction) if fraction.startswith(".") else 0.0)
+        return datetime.fromisoformat(text.replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return NAN
+
+
+class _XmlTrackReader:
+    """
+    Streams track points out of XML with expat callbacks
+
+    No element tree is built: the text of the few elements of interest is
+    converted as soon as they close and written to the TrackBuilder.
+
+    Args:
+        point_tag (str): Element holding one track point
+        fields (dict): Child element name -> column it fills
+        position_attributes (bool): Whether lat/lon are attributes of the point element (GPX)
+    """
+
+    def __init__(self, point_tag, fields, position_attributes):
+        self.point_tag = point_tag
+        self.fields = fields
+        self.position_attributes = position_attributes
+        self.builder = TrackBuilder()
+        self.point = None
+        self.column = None
+        self.text = []
+
+    def parse(self, source):
+        parser = expat.ParserCreate()
+        parser.buffer_text = True
+        parser.StartElementHandler = self.start
+        parser.EndElementHandler = self.end
+        parser.CharacterDataHandler = self.data
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, "rb") as f:
+                parser.ParseFile(f)
+        else:
+            parser.ParseFile(source)
+        return self.builder.build()
+
+    def start(self, name, attributes):
+        name = name.rsplit(":", 1)[-1]
+        if name == self.point_tag:
+            self.point = {}
+            if self.position_attributes:
+                self.point["lat"] = float(attributes["lat"])
+                self.point["lon"] = float(attributes["lon"])
+        elif self.point is not None and name in self.fields:
+            self.column = self.fields[name]
+            self.text = []
+
+    def data(self, text):
+        if self.column is not None:
+            self.text.append(text)
+
+    def end(self, name):
+        if self.point is None:
+            return
+        name = name.rsplit(":", 1)[-1]
+        if self.column is not None:
+            text = "".join(self.text)
+            if text.strip():
+                self.point[self.column] = parse_time(text) if self.column == "time" else float(text)
+            self.column = None
+        elif name == self.point_tag:
+            point = self.point
+            self.point = None
+            # Indoor or paused TCX points have no position
+            if "lat" in point and "lon" in point:
+                self.builder.add(point["lat"], point["lon"], point.get("ele", NAN),
+                                 point.get("time", NAN), point.get("hr", NAN), point.get("cad", NAN))
+
+
+def _tag(name):
+    """Pattern for an element name with an optional namespace prefix"""
+    return rb"(?:[\w.-]+:)?" + name
+
+
+def _skip_within(point_tag):
+    """Pattern lazily skipping content without leaving the current point element"""
+    return rb"[^<]*(?:<(?!/" + _tag(point_tag) + rb">)[^<]*)*?"
+
+
+# One GPX <trkpt> with lat/lon in either order, then <ele> and <time> in
+# either order and extension heart rate and cadence (in that order) anywhere inside it
+_GPX_POINT = re.compile(
+    rb"<" + _tag(rb"trkpt") + rb"\s[^>]*?\b(lat|lon)\s*=\s*[\"']([^\"']*)[\"']"
+    rb"[^>]*?\b(?:lat|lon)\s*=\s*[\"']([^\"']*)[\"'][^>]*>"
+    rb"(?:\s*<" + _tag(rb"ele") + rb">([^<]*)</" + _tag(rb"ele") + rb">)?"
+    rb"(?:\s*<" + _tag(rb"time") + rb">([^<]*)</" + _tag(rb"time") + rb">)?"
+    rb"(?:\s*<" + _tag(rb"ele") + rb">([^<]*)</" + _tag(rb"ele") + rb">)?"
+    rb"(?:" + _skip_within(rb"trkpt") + rb"<" + _tag(rb"(?:hr|heartrate)") + rb">([^<]*)<)?"
+    rb"(?:" + _skip_within(rb"trkpt") + rb"<" + _tag(rb"(?:cad|cadence)") + rb">([^<]*)<)?"
+    + _skip_within(rb"trkpt") + rb"</" + _tag(rb"trkpt") + rb">"
+)
+_GPX_OPEN = re.compile(rb"<" + _tag(rb"trkpt") + rb"[\s>/]")
+
+# One TCX <Trackpoint> in schema order: Time, Position, AltitudeMeters,
+# then HeartRateBpm and Cadence (or the RunCadence extension) anywhere after
+_TCX_POINT = re.compile(
+    rb"<" + _tag(rb"Trackpoint") + rb">\s*<" + _tag(rb"Time") + rb">([^<]*)</" + _tag(rb"Time") + rb">"
+    rb"(?:\s*<" + _tag(rb"Position") + rb">"
+    rb"\s*<" + _tag(rb"LatitudeDegrees") + rb">([^<]*)</" + _tag(rb"LatitudeDegrees") + rb">"
+    rb"\s*<" + _tag(rb"LongitudeDegrees") + rb">([^<]*)</" + _tag(rb"LongitudeDegrees") + rb">"
+    rb"\s*</" + _tag(rb"Position") + rb">)?"
+    rb"(?:\s*<" + _tag(rb"AltitudeMeters") + rb">([^<]*)</" + _tag(rb"AltitudeMeters") + rb">)?"
+    rb"(?:" + _skip_within(rb"Trackpoint") + rb"<" + _tag(rb"HeartRateBpm") + rb"[^>]*>"
+    rb"\s*<" + _tag(rb"Value") + rb">([^<]*)<)?"
+    rb"(?:" + _skip_within(rb"Trackpoint") + rb"<" + _tag(rb"(?:Cadence|RunCadence)") + rb">([^<]*)<)?"
+    + _skip_within(rb"Trackpoint") + rb"</" + _tag(rb"Trackpoint") + rb">"
+)
+_TCX_OPEN = re.compile(rb"<" + _tag(rb"Trackpoint") + rb"[\s>/]")
+
+
+def _float_column(values):
+    """Convert a list of byte strings to floats, NaN where empty"""
+    values = np.array(values)
+    column = np.full(len(values), NAN)
+    present = np.char.strip(values) != b""
+    if present.any():
+        column[present] = values[present].astype(np.float64)
+    return column
+
+
+def _time_column(values):
+    """Convert a list of ISO 8601 byte strings to Unix seconds, NaN where empty"""
+    values = np.char.strip(np.array(values))
+    column = np.full(len(values), NAN)
+    present = values != b""
+    stamps = values[present]
+    if not len(stamps):
+        return column
+    if np.char.endswith(stamps, b"Z").all():
+        try:
+            column[present] = np.char.rstrip(stamps, b"Z").astype("U").astype("datetime64[us]").astype(np.int64) / 1e6
+            return column
+        except ValueError:
+            pass
+    column[present] = [parse_time(stamp.decode("ascii", "replace")) for stamp in stamps.tolist()]
+    return column
+
+
+def _gpx_columns(matches):
+    first, value1, value2, ele, time, ele_after_time, hr, cad = zip(*matches)
+    # Only one of the two <ele> positions is filled in a point
+    ele = [a or b for a, b in zip(ele, ele_after_time)]
+    lat_first = np.array(first) == b"lat"
+    value1, value2 = _float_column(value1), _float_column(value2)
+    return {
+        "lat": np.where(lat_first, value1, value2),
+        "lon": np.where(lat_first, value2, value1),
+        "ele": _float_column(ele),
+        "time": _time_column(time),
+        "hr": _float_column(hr),
+        "cad": _float_column(cad),
+    }
+
+
+def _tcx_columns(matches):
+    time, lat, lon, ele, hr, cad = zip(*matches)
+    return {"lat": _float_column(lat), "lon": _float_column(lon), "ele": _float_column(ele),
+            "time": _time_column(time), "hr": _float_column(hr), "cad": _float_column(cad)}
+
+
+def _last_close(data, point_tag):
+    """Offset just past the last complete closing tag of point_tag in data, or -1"""
+    end = len(data)
+    while True:
+        i = data.rfind(point_tag + b">", 0, end)
+        if i < 0:
+            return -1
+        lt = data.rfind(b"<", 0, i)
+        if lt >= 0 and data[lt + 1:lt + 2] == b"/":
+            return i + len(point_tag) + 1
+        end = i
+
+
+def _scan_points(f, point_tag, pattern, open_pattern, to_columns):
+    """
+    Read track points with a C-level regex over fixed-size chunks
+
+    Each chunk is cut after its last complete point; the rest is carried
+    into the next one. Fields are converted a chunk at a time with numpy.
+
+    Returns:
+        dict or None: Track arrays, or None if a point did not match the
+        expected layout (the caller then falls back to the XML parser)
+    """
+    builder = TrackBuilder()
+    tail = b""
+    while True:
+        block = f.read(SCAN_CHUNK_BYTES)
+        data = tail + block
+        cut = len(data) if not block else _last_close(data, point_tag)
+        if cut < 0:
+            tail = data
+            continue
+        chunk, tail = data[:cut], data[cut:]
+        matches = pattern.findall(chunk)
+        if len(matches) != len(open_pattern.findall(chunk)):
+            return None
+        if matches:
+            columns = to_columns(matches)
+            # Indoor or paused TCX points have no position
+            located = ~(np.isnan(columns["lat"]) | np.isnan(columns["lon"]))
+            if not located.all():
+                columns = {name: column[located] for name, column in columns.items()}
+            builder.extend(columns)
+        if not block:
+            return builder.build()
+
+
+def _read_xml_track(source, point_tag, pattern, open_pattern, to_columns, reader):
+    """Scan a GPX/TCX file with the regex reader, re-reading with expat if needed"""
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return _read_xml_track(f, point_tag, pattern, open_pattern, to_columns, reader)
+    if not source.seekable():
+        return reader.parse(source)
+    start = source.tell()
+    try:
+        track = _scan_points(source, point_tag, pattern, open_pattern, to_columns)
+    except ValueError:
+        track = None
+    if track is None:
+        source.seek(start)
+        track = reader.parse(source)
+    return track
+
+
+def read_gpx(source):
+    """
+    Stream the track points of a GPX file into arrays
+
+    Files are scanned in chunks with a regular expression; files whose
+    points are laid out differently are parsed with expat instead.
+
+    Args:
+        source (str or file): Path or binary file object
+
+    Returns:
+        dict: Track arrays (see TrackBuilder.build)
+    """
+    fields = {"ele": "ele", "time": "time", "hr": "hr", "heartrate": "hr", "cad": "cad", "cadence": "cad"}
+    reader = _XmlTrackReader("trkpt", fields, position_attributes=True)
+    return _read_xml_track(source, b"trkpt", _GPX_POINT, _GPX_OPEN, _gpx_columns, reader)
+
+
+def read_tcx(source):
+    """
+    Stream the trackpoints of a TCX file into arrays
+
+    Scanned like read_gpx, with the same expat fallback.
+
+    Args:
+        source (str or file): Path or binary file object
+
+    Returns:
+        dict: Track arrays (see TrackBuilder.build)
+    """
+    fields = {"LatitudeDegrees": "lat", "LongitudeDegrees": "lon", "AltitudeMeters": "ele",
+              "Time": "time", "Value": "hr", "Cadence": "cad", "RunCadence": "cad"}
+    reader = _XmlTrackReader("Trackpoint", fields, position_attributes=False)
+    return _read_xml_track(source, b"Trackpoint", _TCX_POINT, _TCX_OPEN, _tcx_columns, reader)
+
+
+def read_fit(source):
+    """
+    Decode the record messages of a FIT file into arrays
+
+    Only position, altitude, heart rate and timestamp fields of record
+    messages are decoded; everything else is skipped by size.
+
+    Args:
+        source (str or file): Path or binary file object
+
+    Returns:
+        dict: Track arrays (see TrackBuilder.build)
+
+    Raises:
+        ValueError: If the file is not a valid FIT file
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            data = f.read()
+    else:
+        data = source.read()
+
+    header_size = data[0] if data else 0
+    if header_size < 12 or data[8:12] != b".FIT":
+        raise ValueError("Not a FIT file")
+    data_size = struct.unpack_from("<I", data, 4)[0]
+    end = min(header_size + data_size, len(data))
+
+    builder = TrackBuilder()
+    definitions = {}
+    last_timestamp = 0
+    pos = header_size
+
+    while pos < end:
+        header = data[pos]
+        pos += 1
+
+        if header & 0x80:
+            # Compressed timestamp header: a record with a 5-bit time offset
+            local = (header >> 5) & 0x03
+            offset = header & 0x1F
+            last_timestamp += (offset - last_timestamp) & 0x1F
+            timestamp = last_timestamp
+        elif header & 0x40:
+            local = header & 0x0F
+            pos = _read_fit_definition(data, pos, local, definitions, bool(header & 0x20))
+            continue
+        else:
+            local = header & 0x0F
+            timestamp = None
+
+        definition = definitions.get(local)
+        if definition is None:
+            raise ValueError(f"FIT data message for undefined local type {local}")
+        global_num, layout, size = definition
+        if global_num == FIT_RECORD:
+            point = {column: value for column, value in zip(layout.columns, layout.unpack_from(data, pos))
+                     if value is not None}
+            if "time" in point:
+                last_timestamp = point["time"]
+            elif timestamp is not None:
+                point["time"] = timestamp
+            _add_fit_point(builder, point)
+        elif "time" in layout.columns:
+            # Other messages with a timestamp still advance the compressed time base
+            stamp = dict(zip(layout.columns, layout.unpack_from(data, pos))).get("time")
+            if stamp is not None:
+                last_timestamp = stamp
+        pos += size
+
+    return builder.build()
+
+
+class _FitLayout:
+    """Decoder for the fields of one FIT message definition"""
+
+    def __init__(self, fields, big_endian):
+        # Every field is kept as raw bytes except the ones we read
+        fmt = [">" if big_endian else "<"]
+        self.columns = []
+        self.invalid = []
+        for number, size, base_type in fields:
+            code, invalid = FIT_BASE_TYPES.get(base_type, ("B", None))
+            column = FIT_RECORD_FIELDS.get(number)
+            code_size = struct.calcsize("<" + code) if code != "s" else 1
+            if column is not None and code != "s" and size == code_size:
+                fmt.append(code)
+                self.columns.append(column)
+                self.invalid.append(invalid)
+            else:
+                fmt.append(f"{size}x")
+        self.struct = struct.Struct("".join(fmt))
+
+    def unpack_from(self, data, pos):
+        values = self.struct.unpack_from(data, pos)
+        return [None if value == invalid else value for value, invalid in zip(values, self.invalid)]
+
+
+def _read_fit_definition(data, pos, local, definitions, has_developer_fields):
+    big_endian = data[pos + 1] == 1
+    global_num = struct.unpack_from(">H" if big_endian else "<H", data, pos + 2)[0]
+    num_fields = data[pos + 4]
+    pos += 5
+    fields = []
+    for _ in range(num_fields):
+        fields.append((data[pos], data[pos + 1], data[pos + 2]))
+        pos += 3
+    size = sum(field[1] for field in fields)
+    if has_developer_fields:
+        num_dev = data[pos]
+        pos += 1
+        for _ in range(num_dev):
+            # Developer fields are skipped as padding
+            fields.append((None, data[pos + 1], 0x0D))
+            size += data[pos + 1]
+            pos += 3
+    layout = _FitLayout(fields, big_endian)
+    definitions[local] = (global_num, layout, size)
+    return pos
+
+
+def _add_fit_point(builder, point):
+    lat, lon = point.get("lat"), point.get("lon")
+    if lat is None or lon is None:
+        return
+    ele = point.get("ele")
+    time = point.get("time")
+    hr = point.get("hr")
+    cad = point.get("cad")
+    builder.add(
+        lat * SEMICIRCLE_DEGREES,
+        lon * SEMICIRCLE_DEGREES,
+        ele / 5.0 - 500.0 if ele is not None else NAN,
+        time + FIT_EPOCH if time is not None else NAN,
+        float(hr) if hr is not None else NAN,
+        float(cad) if cad is not None else NAN,
+    )
+
+
+def detect_format(name, head=b""):
+    """
+    Guess a track file's format from its name, or else from its first bytes
+
+    Returns:
+        str: "gpx", "tcx" or "fit"
+    """
+    extension = os.path.splitext(name or "")[1].lower().lstrip(".")
+    if extension in ("gpx", "tcx", "fit"):
+        return extension
+    if head[8:12] == b".FIT":
+        return "fit"
+    if b"TrainingCenterDatabase" in head:
+        return "tcx"
+    return "gpx"
+
+
+def read_track(source, name=None):
+    """
+    Read a GPX, TCX or FIT file into track arrays
+
+    Args:
+        source (str or file): Path or binary file object (e.g. a Streamlit upload)
+        name (str): File name used to pick the format (defaults to the path)
+
+    Returns:
+        dict: Track arrays for lat, lon, ele, time (Unix seconds), hr and cad
+
+    Raises:
+        ImportError: If numpy is not installed
+        ValueError: If the file cannot be parsed
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required to import tracks")
+
+    if isinstance(source, (str, os.PathLike)):
+        name = name or str(source)
+        with open(source, "rb") as f:
+            return read_track(f, name)
+
+    if hasattr(source, "peek"):
+        head = source.peek(512)[:512]
+    else:
+        head = source.read(512)
+        source.seek(0)
+
+    fmt = detect_format(name, head)
+    try:
+        if fmt == "fit":
+            return read_fit(source)
+        if fmt == "tcx":
+            return read_tcx(source)
+        return read_gpx(source)
+    except (expat.ExpatError, struct.error, IndexError, KeyError) as e:
+        raise ValueError(f"Could not parse {fmt.upper()} file: {e}")
+
+
+def track_distances(track):
+    """Great-circle distance in metres from each point to the next"""
+    lat = np.radians(track["lat"])
+    lon = np.radians(track["lon"])
+    a = (np.sin(np.diff(lat) / 2) ** 2 +
+         np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin(np.diff(lon) / 2) ** 2)
+    return 2 * 6371000.0 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def track_route_data(track):
+    """
+    Turn imported track arrays into route data that save_activity accepts
+
+    Args:
+        track (dict): Arrays from read_track
+
+    Returns:
+        dict: Route data with coordinates, distance, duration, elevation and an
+        analysis summary (see track_analytics.analysis_summary)
+
+    Raises:
+        ValueError: If the track has fewer than two points
+    """
+    # Imported here so the parsers can be used without routing's dependencies
+    # (and because track_analytics imports this module)
+    from resample import resample, RESAMPLE_PROFILES
+    from simplify import project
+    from track_analytics import analyze_track, analysis_summary
+
+    if len(track["lat"]) < 2:
+        raise ValueError("Track has fewer than two points")
+
+    distance_km = round(float(track_distances(track).sum()) / 1000, 2)
+    times = track["time"][~np.isnan(track["time"])]
+    duration_min = round(float(times[-1] - times[0]) / 60) if len(times) > 1 else round(distance_km * 6)
+    climbs = np.diff(track["ele"])
+    heart_rate = track["hr"][~np.isnan(track["hr"])]
+
+    coords = np.column_stack([track["lat"], track["lon"]])
+    stored, positions = resample(coords, return_positions=True, **RESAMPLE_PROFILES["storage"])
+
+    route_data = {
+        "coordinates": stored.tolist(),
+        "start_point": (float(track["lat"][0]), float(track["lon"][0])),
+        "distance": distance_km,
+        "elevation_gain": round(float(np.nansum(np.where(climbs > 0, climbs, 0.0)))),
+        "estimated_time": duration_min,
+        # save_activity reads the duration from this key
+        "estimatedTime": duration_min,
+        "source": "import",
+    }
+    if len(times):
+        route_data["start_time"] = datetime.fromtimestamp(times[0], timezone.utc).isoformat().replace("+00:00", "Z")
+    if len(times) > 1:
+        # Seconds from the start at each stored point, so segment efforts can be timed later
+        timed = ~np.isnan(track["time"])
+        arc = np.r_[0.0, np.cumsum(np.hypot(*np.diff(project(coords), axis=0).T))]
+        offsets = np.interp(positions, arc[timed], np.maximum.accumulate(times)) - times[0]
+        route_data["times"] = np.round(offsets, 1).tolist()
+    if len(heart_rate):
+        route_data["average_heart_rate"] = round(float(heart_rate.mean()))
+    # Splits, moving time and zones need the full recording, which is not stored
+    route_data["analysis"] = analysis_summary(analyze_track(track))
+    return route_data
+
+
+def main(argv=None):
+    """Print a summary of each track file given on the command line"""
+    for path in (argv if argv is not None else sys.argv[1:]):
+        track = read_track(path)
+        route_data = track_route_data(track)
+        print(f"{path}: {len(track['lat'])} points, {route_data['distance']} km, "
+              f"{route_data['estimated_time']} min, {len(route_data['coordinates'])} stored points")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,259 @@
+import os
+import math
+import datetime
+import hashlib
+import threading
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+from route_keys import activity_key
+
+# Where per-user training load series are persisted between runs
+TRAINING_CACHE_DIR = os.environ.get(
+    "SMARTRUNNING_TRAINING_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".training_cache")
+)
+
+# Time constants (days) of acute (fatigue) and chronic (fitness) training load
+ATL_DAYS = 7
+CTL_DAYS = 42
+
+# Days per block of the closed-form EWMA; keeps a ** -k well inside float range
+EWMA_CHUNK_DAYS = 128
+
+# Heart rates used for TRIMP when the profile has none
+DEFAULT_MAX_HR = 190
+DEFAULT_REST_HR = 60
+
+# Heart rate reserve fraction assumed for activities without heart rate (easy running)
+DEFAULT_HR_RATIO = 0.6
+
+# In-memory series by user
+_series = {}
+_series_lock = threading.Lock()
+
+
+def ewma(values, days, initial=0.0, chunk=EWMA_CHUNK_DAYS):
+    """
+    Exponentially weighted moving average x[t] = a * x[t-1] + (1 - a) * values[t]
+
+    The recurrence is solved in closed form a block at a time:
+    x[k] = a^(k+1) * x[-1] + (1 - a) * a^k * cumsum(values * a^-k)[k],
+    so each block is a few array operations. Blocks are short enough that
+    a^-k stays well inside float range.
+
+    Args:
+        values (np.ndarray): Daily values
+        days (float): Time constant in days (a = exp(-1 / days))
+        initial (float): Average on the day before values[0]
+        chunk (int): Block length in days
+
+    Returns:
+        np.ndarray: Average for every day
+    """
+    a = math.exp(-1.0 / days)
+    out = np.empty(len(values))
+    k = np.arange(min(chunk, len(values)))
+    growth = a ** -k
+    decay = a ** k
+    x = initial
+    for start in range(0, len(values), chunk):
+        block = values[start:start + chunk]
+        m = len(block)
+        out[start:start + m] = a * decay[:m] * x + (1 - a) * decay[:m] * np.cumsum(block * growth[:m])
+        x = out[start + m - 1]
+    return out
+
+
+def trimp(minutes, average_hr=None, max_hr=DEFAULT_MAX_HR, rest_hr=DEFAULT_REST_HR):
+    """
+    Banister training impulse of an activity
+
+    Args:
+        minutes (float): Moving time in minutes
+        average_hr (float): Average heart rate (DEFAULT_HR_RATIO of reserve is assumed without one)
+        max_hr (float): Max heart rate
+        rest_hr (float): Resting heart rate
+
+    Returns:
+        float: Training load
+    """
+    if average_hr:
+        ratio = min(max((average_hr - rest_hr) / (max_hr - rest_hr), 0.0), 1.0)
+    else:
+        ratio = DEFAULT_HR_RATIO
+    return minutes * ratio * 0.64 * math.exp(1.92 * ratio)
+
+
+def activity_day(activity):
+    """Day number (days since 1970-01-01) an activity took place on, or None"""
+    route_data = activity.get("routeData") or {}
+    stamp = route_data.get("start_time") or activity.get("createdAt")
+    try:
+        return (datetime.date.fromisoformat(str(stamp)[:10]) - datetime.date(1970, 1, 1)).days
+    except ValueError:
+        return None
+
+
+def activity_load(activity, max_hr=DEFAULT_MAX_HR, rest_hr=DEFAULT_REST_HR):
+    """Training load of an activity from its measured analysis, or its duration"""
+    analysis = (activity.get("routeData") or {}).get("analysis") or {}
+    seconds = analysis.get("moving_time") or activity.get("duration") or 0
+    return trimp(seconds / 60, analysis.get("average_hr"), max_hr, rest_hr)
+
+
+def training_path(user_key):
+    """Get the on-disk path of a user's training load series"""
+    name = hashlib.sha1(str(user_key).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(TRAINING_CACHE_DIR, f"training_{name}.npz")
+
+
+def _empty_series(user_key):
+    return {"user": user_key, "start": None, "load": np.zeros(0), "atl": np.zeros(0), "ctl": np.zeros(0),
+            "activities": {}, "version": 0, "lock": threading.Lock()}
+
+
+def load_training(user_key):
+    """
+    Get a user's training load series from memory or disk (empty if there is none yet)
+
+    Args:
+        user_key (str): User id
+
+    Returns:
+        dict: Series with start day, daily load, atl and ctl arrays and per-activity (day, load)
+    """
+    if not NUMPY_AVAILABLE:
+        raise ImportError("numpy package is required for training load")
+
+    with _series_lock:
+        if user_key in _series:
+            return _series[user_key]
+
+    series = _empty_series(user_key)
+    path = training_path(user_key)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            series["start"] = int(data["start"]) if data["load"].size else None
+            for name in ("load", "atl", "ctl"):
+                series[name] = data[name]
+            series["activities"] = {key: (int(day), float(load)) for key, day, load in
+                                    zip(data["keys"].tolist(), data["days"].tolist(), data["loads"].tolist())}
+        series["version"] = 1
+
+    with _series_lock:
+        return _series.setdefault(user_key, series)
+
+
+def save_training(series):
+    """Persist a training load series as arrays"""
+    os.makedirs(TRAINING_CACHE_DIR, exist_ok=True)
+    activities = series["activities"]
+    np.savez(training_path(series["user"]), start=np.int64(series["start"] or 0),
+             load=series["load"], atl=series["atl"], ctl=series["ctl"],
+             keys=np.array(list(activities), dtype=str),
+             days=np.array([day for day, _ in activities.values()], dtype=np.int64),
+             loads=np.array([load for _, load in activities.values()], dtype=np.float64))
+
+
+def update_training(series, activities, today=None, max_hr=DEFAULT_MAX_HR, rest_hr=DEFAULT_REST_HR):
+    """
+    Bring a training load series up to date with the activity list and today's date
+
+    Daily loads are re-binned (one bincount), but ATL and CTL are only
+    recomputed from the earliest day that changed, starting from the
+    stored values of the day before. A new activity today updates one day;
+    a day passing without activities just decays the tail.
+
+    Args:
+        series (dict): Series from load_training
+        activities (list): All of the user's activity dicts
+        today (int): Day number to extend the series to (defaults to today)
+        max_hr (float): Max heart rate for TRIMP
+        rest_hr (float): Resting heart rate for TRIMP
+
+    Returns:
+        int: Days recomputed
+    """
+    if today is None:
+        today = (datetime.date.today() - datetime.date(1970, 1, 1)).days
+
+    entries = {}
+    for activity in activities:
+        day = activity_day(activity)
+        if day is not None:
+            entries[activity_key(activity)] = (day, round(activity_load(activity, max_hr, rest_hr), 3))
+
+    with series["lock"]:
+        old = series["activities"]
+        changed = [entries[key][0] for key in entries if old.get(key) != entries[key]]
+        changed += [old[key][0] for key in old if key not in entries]
+        if not entries:
+            if old:
+                series.update(start=None, load=np.zeros(0), atl=np.zeros(0), ctl=np.zeros(0), activities={})
+                series["version"] += 1
+                try:
+                    save_training(series)
+                except OSError as e:
+                    print(f"Warning: could not persist training load: {e}")
+            return 0
+
+        first_day = min(day for day, _ in entries.values())
+        start = series["start"]
+        end = max(today, max(day for day, _ in entries.values()))
+        if start is None or first_day < start:
+            # History now begins earlier: everything shifts, so start over
+            start, from_day = first_day, first_day
+        else:
+            from_day = min(changed + [start + len(series["load"])])
+        if from_day > end and len(series["load"]) == end - start + 1:
+            return 0
+
+        days = np.array([day for day, _ in entries.values()]) - start
+        loads = np.array([load for _, load in entries.values()])
+        load = np.bincount(days, weights=loads, minlength=end - start + 1)
+
+        keep = min(from_day - start, len(load))
+        prev_atl = series["atl"][keep - 1] if keep > 0 else 0.0
+        prev_ctl = series["ctl"][keep - 1] if keep > 0 else 0.0
+        series["atl"] = np.r_[series["atl"][:keep], ewma(load[keep:], ATL_DAYS, prev_atl)]
+        series["ctl"] = np.r_[series["ctl"][:keep], ewma(load[keep:], CTL_DAYS, prev_ctl)]
+        series.update(start=start, load=load, activities=entries)
+        series["version"] += 1
+        try:
+            save_training(series)
+        except OSError as e:
+            print(f"Warning: could not persist training load: {e}")
+        return len(load) - keep
+
+
+def training_frame(series, days=None):
+    """
+    Chart data for a training load series
+
+    Form (TSB) on a day is the previous day's fitness minus fatigue.
+
+    Args:
+        series (dict): Series from update_training
+        days (int): Only return the last this many days
+
+    Returns:
+        dict: Date, Load, Fitness (CTL), Fatigue (ATL) and Form (TSB) columns
+    """
+    if series["start"] is None:
+        return {"Date": [], "Load": [], "Fitness (CTL)": [], "Fatigue (ATL)": [], "Form (TSB)": []}
+    ctl, atl = series["ctl"], series["atl"]
+    tsb = np.r_[0.0, (ctl - atl)[:-1]]
+    dates = np.datetime64("1970-01-01") + series["start"] + np.arange(len(ctl))
+    window = slice(-days, None) if days else slice(None)
+    return {
+        "Date": dates[window],
+        "Load": series["load"][window].round(1),
+        "Fitness (CTL)": ctl[window].round(1),
+        "Fatigue (ATL)": atl[window].round(1),
+        "Form (TSB)": tsb[window].round(1),
+    }